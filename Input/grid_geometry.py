@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# =========================
+# Projected geometry of the GETM grid, cached on disk
+# =========================
+# Projects lonc/latc of the topo file (e.g. topo_adjusted_dws_200m_2009.nc)
+# as plain arrays with one pyproj transform, and keeps the projected
+# coordinates, the land mask and a KD-tree of the cell centres in a cache
+# directory. The cache is keyed by the SHA-256 of the topo file content (and
+# the target CRS and land value), so a changed topo file is projected again
+# and an unchanged one is loaded in well under a second.
+import hashlib
+import os
+import pickle
+import numpy as np
+from netCDF4 import Dataset
+from pyproj import Transformer
+from scipy.spatial import cKDTree
+
+# UTM zone 31N, meters
+UTM31N = "EPSG:32631"
+
+# bathymetry value of land cells in the topo file
+LAND_VALUE = -10
+
+
+def file_hash(path, blocksize=1024**2):
+    """
+    SHA-256 of the content of a file, read in blocks
+    """
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def project(lon, lat, crs=UTM31N):
+    """
+    Project lon/lat arrays (EPSG:4326) to crs
+    lon, lat: arrays of any (equal) shape
+    crs: target coordinate reference system
+    Returns x, y arrays of the same shape (meters for UTM).
+    """
+    transformer = Transformer.from_crs("EPSG:4326", crs, always_xy=True)
+    x, y = transformer.transform(np.asarray(lon, dtype=float), np.asarray(lat, dtype=float))
+    return np.asarray(x), np.asarray(y)
+
+
+class GridGeometry:
+    """
+    Grid cell centres of a topo file
+    lon, lat: 2D geographic coordinates (lonc, latc)
+    x, y: 2D projected coordinates (meters)
+    land_mask: 2D bool, True for land (bathymetry == land value)
+    bathymetry: 2D bathymetry
+    tree: cKDTree of the (x, y) of all cells, in the order of x.ravel()
+    """
+
+    def __init__(self, lon, lat, x, y, land_mask, bathymetry, tree=None):
+        self.lon = lon
+        self.lat = lat
+        self.x = x
+        self.y = y
+        self.land_mask = land_mask
+        self.bathymetry = bathymetry
+        self.tree = tree if tree is not None else cKDTree(np.column_stack((x.ravel(), y.ravel())))
+
+    @property
+    def shape(self):
+        return self.x.shape
+
+    @property
+    def xy(self):
+        """(M,2) projected coordinates of all cells"""
+        return np.column_stack((self.x.ravel(), self.y.ravel()))
+
+
+def read_topo(topo_nc, land_value=LAND_VALUE):
+    """
+    Read lonc, latc and bathymetry of a topo file; returns (lon, lat, bathymetry, land_mask)
+    """
+    with Dataset(topo_nc, "r") as nc:
+        nc.set_auto_mask(False)
+        lon = nc.variables["lonc"][:]
+        lat = nc.variables["latc"][:]
+        bathy = nc.variables["bathymetry"][:]
+    return lon, lat, bathy, bathy == land_value
+
+
+def load_grid_geometry(topo_nc, crs=UTM31N, cache_dir=None, land_value=LAND_VALUE, verbose=True):
+    """
+    Grid geometry of a topo file, from the cache if the file content is unchanged
+    topo_nc: topo file with lonc, latc and bathymetry
+    crs: projection of x, y
+    cache_dir: cache directory; default .grid_cache next to the topo file
+    land_value: bathymetry value of land cells
+    Returns a GridGeometry.
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(topo_nc)), ".grid_cache")
+    key = "%s_%s_%g" % (file_hash(topo_nc)[:20], crs.replace(":", ""), land_value)
+    cache_file = os.path.join(cache_dir, key + ".pkl")
+    if os.path.exists(cache_file):
+        with open(cache_file, "rb") as f:
+            geometry = pickle.load(f)
+        if verbose:
+            print("grid geometry from cache:", cache_file)
+        return geometry
+
+    lon, lat, bathy, land_mask = read_topo(topo_nc, land_value)
+    x, y = project(lon, lat, crs)
+    geometry = GridGeometry(lon, lat, x, y, land_mask, bathy)
+    os.makedirs(cache_dir, exist_ok=True)
+    # write to a temporary name first, so an interrupted run leaves no broken cache
+    tmp = cache_file + ".%d.tmp" % os.getpid()
+    with open(tmp, "wb") as f:
+        pickle.dump(geometry, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, cache_file)
+    if verbose:
+        print("grid geometry cached:", cache_file)
+    return geometry
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# =========================
+# Inverse distance weighting (IDW) of scattered samples onto the model grid
+# =========================
+# All grid cells are handled in batches: the KD-tree queries of a batch run
+# on all cores (scipy workers=-1) and the weights are computed for all
+# (cell, sample) pairs of the batch at once, without a Python loop over cells.
+# Neighbours are the samples within a radius, the k nearest, or the k nearest
+# within a radius. A sample at (almost) zero distance is an exact hit: the
+# cell gets its value (the mean of the hits if there are several).
+import numpy as np
+from scipy.spatial import cKDTree
+
+# grid cells per batch of KD-tree queries
+BATCH = 200000
+
+
+def _weighted_mean(cell, dist, value, ncells, power, exact):
+    """
+    IDW mean per cell from (cell, distance, value) pairs.
+    cell: (P,) index of the cell of each pair
+    dist: (P,) distance between cell and sample
+    value: (P,) sample value
+    ncells: number of cells
+    power: inverse distance power
+    exact: distances below this are exact hits
+    """
+    hit = dist < exact
+    weights = np.zeros_like(dist)
+    weights[~hit] = dist[~hit] ** -power
+    wsum = np.bincount(cell, weights, minlength=ncells)
+    vsum = np.bincount(cell, weights * value, minlength=ncells)
+    nhit = np.bincount(cell[hit], minlength=ncells)
+    hitsum = np.bincount(cell[hit], value[hit], minlength=ncells)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(nhit > 0, hitsum / np.maximum(nhit, 1), vsum / wsum)
+
+
+def idw(xy_points, values, xy_targets, radius=None, power=2, k=None, min_neighbours=1,
+        skip=None, exact=1e-6, workers=-1, batch=BATCH):
+    """
+    IDW interpolation of scattered samples at target points
+    xy_points: (N,2) array of sample coordinates in meters
+    values: (N,) array of sample values
+    xy_targets: (M,2) array of target coordinates in meters
+    radius: influence radius (meters); None: no limit (k must be given)
+    power: inverse distance power
+    k: use the k nearest samples (within radius, if given); None: all samples within radius
+    min_neighbours: targets with fewer samples in reach get NaN
+    skip: (M,) bool array of targets to leave out (e.g. land), they get NaN
+    exact: distance (meters) below which a sample is an exact hit
+    workers: number of threads for the KD-tree queries, -1: all cores
+    batch: number of targets per batch of queries
+    Returns (M,) array of interpolated values.
+    """
+    if radius is None and k is None:
+        raise ValueError("give a radius, k, or both")
+    xy_points = np.asarray(xy_points, dtype=float)
+    values = np.asarray(values, dtype=float)
+    xy_targets = np.asarray(xy_targets, dtype=float)
+    tree = cKDTree(xy_points)
+
+    result = np.full(len(xy_targets), np.nan)
+    todo = np.arange(len(xy_targets))
+    if skip is not None:
+        todo = todo[~np.asarray(skip, dtype=bool).ravel()]
+
+    for start in range(0, len(todo), batch):
+        cells = todo[start:start + batch]
+        targets = xy_targets[cells]
+        if k is not None:
+            dist, idx = tree.query(targets, k=k, workers=workers,
+                                   distance_upper_bound=np.inf if radius is None else radius)
+            dist = dist.reshape(len(cells), -1)
+            idx = idx.reshape(len(cells), -1)
+            found = idx < len(xy_points)
+            cell = np.nonzero(found)[0]
+            idx = idx[found]
+            dist = dist[found]
+        else:
+            neighbours = tree.query_ball_point(targets, r=radius, workers=workers,
+                                               return_sorted=False)
+            counts = np.fromiter(map(len, neighbours), dtype=np.int64, count=len(cells))
+            cell = np.repeat(np.arange(len(cells)), counts)
+            idx = np.concatenate(neighbours).astype(np.int64) if counts.sum() else np.zeros(0, np.int64)
+            dist = np.hypot(xy_points[idx, 0] - targets[cell, 0], xy_points[idx, 1] - targets[cell, 1])
+        interp = _weighted_mean(cell, dist, values[idx], len(cells), power, exact)
+        enough = np.bincount(cell, minlength=len(cells)) >= max(min_neighbours, 1)
+        result[cells] = np.where(enough, interp, np.nan)
+    return result
+
+
+def idw_grid(xy_points, values, xi, yi, land_mask=None, **kwargs):
+    """
+    IDW interpolation onto a 2D grid
+    xy_points: (N,2) array of sample coordinates in meters
+    values: (N,) array of sample values
+    xi, yi: 2D grid coordinates (meters)
+    land_mask: 2D bool array, True for land cells (e.g. bathymetry == -10); they get NaN
+    kwargs: radius, power, k, min_neighbours, exact, workers, batch (see idw)
+    Returns the 2D interpolated field.
+    """
+    targets = np.column_stack((np.ravel(xi), np.ravel(yi)))
+    skip = None if land_mask is None else np.ravel(land_mask)
+    return idw(xy_points, values, targets, skip=skip, **kwargs).reshape(np.shape(xi))
+
+
+def idw_wet(xy_points, values, wet, **kwargs):
+    """
+    IDW interpolation at the wet cells of a WetGrid (see wet_grid.py)
+    xy_points: (N,2) array of sample coordinates in meters
+    values: (N,) array of sample values
+    wet: WetGrid with projected coordinates x, y
+    kwargs: radius, power, k, min_neighbours, exact, workers, batch (see idw)
+    Returns a 1D array on the wet cells.
+    """
+    return idw(xy_points, values, wet.xy, **kwargs)
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# =========================
+# Local (moving neighbourhood) ordinary kriging onto the model grid
+# =========================
+# Global kriging over all samples needs an N x N system per grid and does not
+# fit in memory for thousands of samples and 400k cells. Here:
+#   1. the variogram is fitted once to the sample pairs (fit_variogram)
+#   2. each cell gets its k nearest samples (optionally within a radius) from a KD-tree
+#   3. the grid is cut in tiles; per tile the (k+1) x (k+1) kriging systems of
+#      all its cells are stacked and solved in one batched np.linalg.solve
+#   4. tiles are spread over a pool of processes
+# Memory is bounded by one batch of systems per process, and the run time is
+# linear in the number of cells. The kriging variance is returned with the estimate.
+import multiprocessing
+import numpy as np
+from scipy.optimize import curve_fit
+from scipy.spatial import cKDTree
+from scipy.spatial.distance import pdist
+
+# cells per batch of kriging systems
+BATCH = 20000
+
+
+def spherical(h, nugget, psill, vrange):
+    """spherical model; vrange: range (meters)"""
+    r = np.minimum(h / vrange, 1.0)
+    return nugget + psill * (1.5 * r - 0.5 * r ** 3)
+
+
+def exponential(h, nugget, psill, vrange):
+    """exponential model; vrange: practical range (95% of the sill)"""
+    return nugget + psill * (1.0 - np.exp(-3.0 * h / vrange))
+
+
+def gaussian(h, nugget, psill, vrange):
+    """gaussian model; vrange: practical range (95% of the sill)"""
+    return nugget + psill * (1.0 - np.exp(-3.0 * (h / vrange) ** 2))
+
+
+MODELS = {"spherical": spherical, "exponential": exponential, "gaussian": gaussian}
+
+
+class VariogramModel:
+    """
+    Fitted variogram: gamma(h) = model(h, nugget, psill, vrange), gamma(0) = 0
+    model: one of MODELS
+    nugget, psill, vrange: parameters (vrange in meters)
+    """
+
+    def __init__(self, model, nugget, psill, vrange):
+        self.model = model
+        self.nugget = nugget
+        self.psill = psill
+        self.vrange = vrange
+
+    def __call__(self, h):
+        h = np.asarray(h, dtype=float)
+        return np.where(h > 0, MODELS[self.model](h, self.nugget, self.psill, self.vrange), 0.0)
+
+    def __repr__(self):
+        return "%s variogram: nugget %.4g, partial sill %.4g, range %.0f m" % (
+            self.model, self.nugget, self.psill, self.vrange)
+
+
+def experimental_variogram(xy_points, values, n_lags=15, max_lag=None, max_points=3000, seed=0):
+    """
+    Binned semivariance of the sample pairs
+    xy_points: (N,2) array of sample coordinates in meters
+    values: (N,) array of sample values
+    n_lags: number of distance bins
+    max_lag: largest distance used (meters); default half the largest pair distance
+    max_points: random subset of samples used if there are more (the pair count is quadratic)
+    seed: seed of the subset
+    Returns (lag centres, semivariance, pair count) of the non-empty bins.
+    """
+    xy_points = np.asarray(xy_points, dtype=float)
+    values = np.asarray(values, dtype=float)
+    if len(values) > max_points:
+        keep = np.random.default_rng(seed).choice(len(values), max_points, replace=False)
+        xy_points, values = xy_points[keep], values[keep]
+    dist = pdist(xy_points)
+    semivar = 0.5 * pdist(values[:, None], "sqeuclidean")
+    if max_lag is None:
+        max_lag = dist.max() / 2
+    edges = np.linspace(0, max_lag, n_lags + 1)
+    which = np.digitize(dist, edges) - 1
+    inside = (which >= 0) & (which < n_lags)
+    count = np.bincount(which[inside], minlength=n_lags)
+    total = np.bincount(which[inside], semivar[inside], minlength=n_lags)
+    centres = 0.5 * (edges[1:] + edges[:-1])
+    filled = count > 0
+    return centres[filled], total[filled] / count[filled], count[filled]
+
+
+def fit_variogram(xy_points, values, model="spherical", n_lags=15, max_lag=None, max_points=3000):
+    """
+    Fit a variogram model to the experimental variogram, weighted by the pair count
+    xy_points: (N,2) array of sample coordinates in meters
+    values: (N,) array of sample values
+    model: one of MODELS
+    n_lags, max_lag, max_points: see experimental_variogram
+    Returns a VariogramModel.
+    """
+    lags, semivar, count = experimental_variogram(xy_points, values, n_lags, max_lag, max_points)
+    guess = [semivar.min(), max(semivar.max() - semivar.min(), 1e-12), lags.max() / 2]
+    params, _ = curve_fit(MODELS[model], lags, semivar, p0=guess, sigma=1.0 / np.sqrt(count),
+                          bounds=([0, 0, lags.min()], [np.inf, np.inf, 10 * lags.max()]))
+    return VariogramModel(model, *params)
+
+
+def solve_systems(variogram, xy_points, values, targets, idx, valid):
+    """
+    Ordinary kriging at a batch of targets, each with its own neighbours
+    variogram: VariogramModel
+    xy_points, values: all samples
+    targets: (B,2) target coordinates
+    idx: (B,k) neighbour sample indices (any value where not valid)
+    valid: (B,k) bool, the neighbour exists (within radius)
+    Returns (estimate, variance), (B,) each; NaN where a target has no neighbour.
+    """
+    nb, k = idx.shape
+    idx = np.where(valid, idx, 0)
+    pts = xy_points[idx]                                    # (B,k,2)
+    diff = pts[:, :, None, :] - pts[:, None, :, :]
+    missing = ~valid
+    gamma = variogram(np.hypot(diff[..., 0], diff[..., 1]))
+    a = np.zeros((nb, k + 1, k + 1))
+    a[:, :k, :k] = np.where(missing[:, :, None] | missing[:, None, :], 0.0, gamma)
+    a[:, :k, k] = valid
+    a[:, k, :k] = valid
+    # a missing neighbour gets an identity row and column: its weight is 0
+    rows, cols = np.nonzero(missing)
+    a[rows, cols, cols] = 1.0
+    b = np.zeros((nb, k + 1))
+    b[:, :k] = variogram(np.hypot(pts[..., 0] - targets[:, None, 0], pts[..., 1] - targets[:, None, 1]))
+    b[:, :k][missing] = 0.0
+    b[:, k] = 1.0
+    usable = valid.any(axis=1)
+    a[~usable] = np.eye(k + 1)
+    b[~usable] = 0.0
+
+    try:
+        sol = np.linalg.solve(a, b[:, :, None])[:, :, 0]
+    except np.linalg.LinAlgError:
+        # duplicate sample locations make a system singular
+        sol = np.matmul(np.linalg.pinv(a), b[:, :, None])[:, :, 0]
+    weights = sol[:, :k]
+    estimate = np.sum(weights * values[idx], axis=1)
+    variance = np.sum(weights * b[:, :k], axis=1) + sol[:, k]
+    estimate[~usable] = np.nan
+    variance[~usable] = np.nan
+    return estimate, variance
+
+
+# samples, KD-tree and variogram of a worker process, set by _init_worker
+_state = {}
+
+
+def _init_worker(xy_points, values, variogram, k, radius):
+    _state.update(xy_points=xy_points, values=values, variogram=variogram, k=k, radius=radius,
+                  tree=cKDTree(xy_points))
+
+
+def _krige_tile(cells, targets, batch=BATCH):
+    """
+    Kriging of the targets of one tile, in batches; returns (cells, estimate, variance)
+    """
+    s = _state
+    k = min(s["k"], len(s["values"]))
+    estimate = np.empty(len(cells))
+    variance = np.empty(len(cells))
+    for start in range(0, len(cells), batch):
+        part = slice(start, start + batch)
+        dist, idx = s["tree"].query(targets[part], k=k,
+                                    distance_upper_bound=np.inf if s["radius"] is None else s["radius"])
+        dist = dist.reshape(len(targets[part]), k)
+        idx = idx.reshape(len(targets[part]), k)
+        estimate[part], variance[part] = solve_systems(s["variogram"], s["xy_points"], s["values"],
+                                                       targets[part], idx, np.isfinite(dist))
+    return cells, estimate, variance
+
+
+def krige_grid(xy_points, values, xi, yi, variogram=None, k=16, radius=None, land_mask=None,
+               tile=64, workers=1, model="spherical"):
+    """
+    Local ordinary kriging onto a 2D grid
+    xy_points: (N,2) array of sample coordinates in meters
+    values: (N,) array of sample values
+    xi, yi: 2D grid coordinates (meters)
+    variogram: VariogramModel; None: fitted with fit_variogram(model=model)
+    k: number of nearest samples per cell
+    radius: only samples within this distance (meters); None: no limit
+    land_mask: 2D bool array, True for land cells; they get NaN
+    tile: tile size in grid cells (tile x tile cells per task)
+    workers: number of processes, 1: serial
+    Returns (estimate, variance), 2D arrays like xi.
+    """
+    xy_points = np.asarray(xy_points, dtype=float)
+    values = np.asarray(values, dtype=float)
+    if variogram is None:
+        variogram = fit_variogram(xy_points, values, model)
+    shape = np.shape(xi)
+    flat = np.arange(int(np.prod(shape))).reshape(shape)
+    xy = np.column_stack((np.ravel(xi), np.ravel(yi)))
+    todo = np.ones(shape, dtype=bool) if land_mask is None else ~np.asarray(land_mask, dtype=bool)
+
+    tasks = []
+    for r0 in range(0, shape[0], tile):
+        for c0 in range(0, shape[1], tile):
+            cells = flat[r0:r0 + tile, c0:c0 + tile][todo[r0:r0 + tile, c0:c0 + tile]]
+            if len(cells):
+                tasks.append((cells, xy[cells]))
+
+    estimate, variance = _run_tiles(tasks, flat.size, (xy_points, values, variogram, k, radius), workers)
+    return estimate.reshape(shape), variance.reshape(shape)
+
+
+def _run_tiles(tasks, ncells, initargs, workers):
+    """
+    Run the (cells, targets) tasks, in a pool if workers > 1; returns (estimate, variance) of ncells
+    """
+    estimate = np.full(ncells, np.nan)
+    variance = np.full(ncells, np.nan)
+    if workers > 1:
+        pool = multiprocessing.Pool(workers, _init_worker, initargs)
+        results = pool.starmap(_krige_tile, tasks)
+        pool.close()
+        pool.join()
+    else:
+        _init_worker(*initargs)
+        results = (_krige_tile(*task) for task in tasks)
+    for cells, est, var in results:
+        estimate[cells] = est
+        variance[cells] = var
+    return estimate, variance
+
+
+def krige_wet(xy_points, values, wet, variogram=None, k=16, radius=None, chunk=4096, workers=1,
+              model="spherical"):
+    """
+    Local ordinary kriging at the wet cells of a WetGrid (see wet_grid.py)
+    xy_points, values, variogram, k, radius, workers, model: see krige_grid
+    wet: WetGrid with projected coordinates x, y
+    chunk: wet cells per task (consecutive cells, so neighbouring rows of the grid)
+    Returns (estimate, variance), 1D arrays on the wet cells.
+    """
+    xy_points = np.asarray(xy_points, dtype=float)
+    values = np.asarray(values, dtype=float)
+    if variogram is None:
+        variogram = fit_variogram(xy_points, values, model)
+    xy = wet.xy
+    tasks = [(np.arange(start, min(start + chunk, wet.size)), xy[start:start + chunk])
+             for start in range(0, wet.size, chunk)]
+    return _run_tiles(tasks, wet.size, (xy_points, values, variogram, k, radius), workers)
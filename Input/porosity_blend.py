@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# =========================
+# Wadden Sea / North Sea porosity blend on the GETM grid (Input_data_prep.Rmd)
+# =========================
+# The Wadden Sea porosity (sediment_mud_fraction.nc, from the Franken silt
+# raster) replaces the default North Sea porosity (the regular lon/lat
+# Ben_Sedprop.nc of the nwes setup) where it has data; land is missing.
+# With a transition zone the two are mixed linearly over that distance
+# (meters) inside the edge of the Wadden Sea data, so the porosity has no
+# jump in the tidal inlets. Land does not count as an edge: along the
+# islands the Wadden Sea values are used as they are.
+# The North Sea raster is sampled with vectorised index lookups (nearest
+# as terra::extract "simple", or bilinear) at the wet cells only, and the
+# blend works on the wet cells (1D, see wet_grid.py); only the transition
+# zone is a distance transform on the dense grid.
+#
+# Usage:
+#   python porosity_blend.py --topo topo_adjusted_dws_200m_2009.nc \
+#       --mud sediment_mud_fraction.nc --north-sea Ben_Sedprop.nc \
+#       --out ../dws_200m/Input/Ben_Sedprop.nc --transition 2000
+import argparse
+from datetime import datetime
+import numpy as np
+from netCDF4 import Dataset
+from scipy.ndimage import distance_transform_edt
+from grid_geometry import project, read_topo, UTM31N
+from wet_grid import WetGrid
+
+# fill value of the output file
+FILL_VALUE = -999.0
+
+
+def read_north_sea(ben_nc, varname="Porosity"):
+    """
+    Read a regular lon/lat field (lon(lon), lat(lat), varname(lat, lon)); missing values NaN
+    Returns (lon, lat, field).
+    """
+    with Dataset(ben_nc, "r") as nc:
+        nc.set_auto_mask(False)
+        lon = nc.variables["lon"][:].astype(np.float64)
+        lat = nc.variables["lat"][:].astype(np.float64)
+        var = nc.variables[varname]
+        field = var[:].astype(np.float64).reshape(len(lat), len(lon))
+        for att in ("_FillValue", "missing_value"):
+            if att in var.ncattrs():
+                field[field == var.getncattr(att)] = np.nan
+    return lon, lat, field
+
+
+def _axis(centres, x, method):
+    """
+    Index along one axis of a raster with increasing centres: (index, fraction, inside)
+    nearest: index of the cell containing x; bilinear: index of the centre left of x
+    """
+    n = len(centres)
+    # cell edges halfway between the centres, the outer ones half a cell outside
+    edges = np.concatenate(([1.5 * centres[0] - 0.5 * centres[1]], 0.5 * (centres[1:] + centres[:-1]),
+                            [1.5 * centres[-1] - 0.5 * centres[-2]]))
+    cell = np.searchsorted(edges, x, side="right") - 1
+    inside = (cell >= 0) & (cell < n)
+    if method == "nearest":
+        return np.clip(cell, 0, n - 1), None, inside
+    pos = np.interp(x, centres, np.arange(n))      # fractional index, constant beyond the outer centres
+    i = np.clip(np.floor(pos), 0, n - 2).astype(np.int64)
+    return i, pos - i, inside
+
+
+def sample_regular(rlon, rlat, field, lon, lat, method="nearest"):
+    """
+    Sample a regular lon/lat raster at points
+    rlon, rlat: 1D cell centres of the raster (increasing or decreasing)
+    field: (lat, lon) values, NaN missing
+    lon, lat: point coordinates, any equal shape
+    method: "nearest" (cell containing the point) or "bilinear" (missing corners left out,
+            NaN where the cell containing the point is missing)
+    Returns an array of the shape of lon; NaN outside the raster.
+    """
+    if method not in ("nearest", "bilinear"):
+        raise ValueError("unknown method %s, use nearest or bilinear" % method)
+    ilon = np.argsort(rlon)
+    ilat = np.argsort(rlat)
+    rlon, rlat, field = rlon[ilon], rlat[ilat], field[np.ix_(ilat, ilon)]
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    i, fi, inside_i = _axis(rlon, lon, method)
+    j, fj, inside_j = _axis(rlat, lat, method)
+    inside = inside_i & inside_j
+    if method == "nearest":
+        return np.where(inside, field[j, i], np.nan)
+    total = np.zeros(lon.shape)
+    wsum = np.zeros(lon.shape)
+    for dj, di, w in ((0, 0, (1 - fj) * (1 - fi)), (0, 1, (1 - fj) * fi),
+                      (1, 0, fj * (1 - fi)), (1, 1, fj * fi)):
+        v = field[j + dj, i + di]
+        ok = np.isfinite(v) & (w > 0)
+        total += np.where(ok, w * v, 0.0)
+        wsum += np.where(ok, w, 0.0)
+    # the data coverage stays that of the raster cells (no values in missing cells)
+    cell_i, _, _ = _axis(rlon, lon, "nearest")
+    cell_j, _, _ = _axis(rlat, lat, "nearest")
+    valid = inside & (wsum > 0) & np.isfinite(field[cell_j, cell_i])
+    with np.errstate(invalid="ignore"):
+        return np.where(valid, total / wsum, np.nan)
+
+
+def cell_size(lon, lat, crs=UTM31N):
+    """
+    Median cell size (meters) of a curvilinear grid along its two dimensions
+    """
+    x, y = project(lon, lat, crs)
+    d0 = np.hypot(np.diff(x, axis=0), np.diff(y, axis=0))
+    d1 = np.hypot(np.diff(x, axis=1), np.diff(y, axis=1))
+    return float(np.median(d0)), float(np.median(d1))
+
+
+def transition_weight(has_wadden, land, transition, spacing):
+    """
+    Weight of the Wadden Sea porosity: rising linearly with the distance to the
+    nearest wet cell without Wadden Sea data, 1 from `transition` meters on
+    has_wadden: 2D bool, the Wadden Sea porosity is valid
+    land: 2D bool land mask; land is not an edge
+    transition: width of the transition zone (meters); 0: no transition
+    spacing: (d0, d1) cell size along the two dimensions (meters)
+    """
+    inside = has_wadden | land
+    if transition <= 0 or inside.all():
+        return has_wadden.astype(np.float64)
+    # distance from the centre of a cell to the centre of the nearest cell outside
+    distance = distance_transform_edt(inside, sampling=spacing)
+    return np.where(has_wadden, np.minimum(distance / transition, 1.0), 0.0)
+
+
+def blend_porosity(wadden, north_sea, wet, transition=0.0, spacing=(200.0, 200.0), north_sea_value=None):
+    """
+    Blend the Wadden Sea porosity into the North Sea porosity
+    wadden, north_sea: porosity on the wet cells of wet, NaN missing
+    wet: WetGrid of the model grid
+    transition: width of the transition zone (meters); 0: Wadden Sea values replace
+                the North Sea ones (Input_data_prep.Rmd)
+    spacing: (d0, d1) cell size along the two dimensions (meters), see cell_size
+    north_sea_value: one value for all North Sea cells with data (e.g. 0.4011); None: the field
+    Returns the porosity on the wet cells.
+    """
+    north_sea = np.array(north_sea, dtype=np.float64)
+    if north_sea_value is not None:
+        north_sea[np.isfinite(north_sea)] = north_sea_value
+    has_wadden = np.isfinite(wadden)
+    weight = wet.compress(transition_weight(wet.expand(has_wadden, fill=False), ~wet.mask,
+                                            transition, spacing))
+    blended = weight * wadden + (1.0 - weight) * north_sea
+    # where there is no North Sea value the Wadden Sea value is used as it is
+    return np.where(has_wadden, np.where(np.isfinite(north_sea), blended, wadden), north_sea)
+
+
+def read_wadden(mud_nc, varname="porosity"):
+    """
+    Wadden Sea porosity of a sediment_mud_fraction.nc file; negative values (fill) NaN
+    """
+    with Dataset(mud_nc, "r") as nc:
+        nc.set_auto_mask(False)
+        values = nc.variables[varname][:].astype(np.float64)
+    values[values < 0] = np.nan
+    return values
+
+
+def write_porosity(fname, lon, lat, wet, porosity):
+    """
+    Write lonc, latc and the porosity of the wet cells of wet on (xc, yc), land and missing
+    values FILL_VALUE (layout of Input_data_prep.Rmd)
+    """
+    with Dataset(fname, "w", format="NETCDF4") as nc:
+        nc.createDimension("xc", lon.shape[0])
+        nc.createDimension("yc", lon.shape[1])
+        lon_var = nc.createVariable("lonc", "f4", ("xc", "yc"), fill_value=1e20)
+        lat_var = nc.createVariable("latc", "f4", ("xc", "yc"), fill_value=1e20)
+        por_var = nc.createVariable("porosity", "f4", ("xc", "yc"), fill_value=FILL_VALUE)
+        lon_var.units = "degree_east"
+        lat_var.units = "degree_north"
+        por_var.units = "1"
+        lon_var[:] = lon
+        lat_var[:] = lat
+        por_var[:] = wet.expand(np.where(np.isfinite(porosity), porosity, FILL_VALUE), fill=FILL_VALUE)
+        nc.type = "Merged Wadden Sea + North Sea porosity"
+        nc.gridid = "North Sea and Wadden Sea"
+        nc.history = "Created: " + datetime.now().strftime("%Y-%m-%d %H:%M")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Blend Wadden Sea and North Sea porosity on the GETM grid")
+    parser.add_argument("--topo", required=True, help="GETM topo file (lonc, latc, bathymetry)")
+    parser.add_argument("--mud", required=True, help="sediment_mud_fraction.nc with the Wadden Sea porosity")
+    parser.add_argument("--north-sea", required=True, help="North Sea Ben_Sedprop.nc (lon/lat, Porosity)")
+    parser.add_argument("--out", required=True, help="output file")
+    parser.add_argument("--transition", type=float, default=0.0,
+                        help="width of the transition zone in meters (default 0: replace)")
+    parser.add_argument("--method", default="nearest", choices=("nearest", "bilinear"),
+                        help="sampling of the North Sea raster (default: nearest)")
+    parser.add_argument("--north-sea-value", type=float, default=None,
+                        help="one porosity for all North Sea cells (e.g. 0.4011)")
+    args = parser.parse_args()
+
+    lon, lat, bathy, land = read_topo(args.topo)
+    wet = WetGrid.from_mask(land | ~np.isfinite(bathy), lon=lon, lat=lat)
+    north_sea = sample_regular(*read_north_sea(args.north_sea), wet.lon, wet.lat, args.method)
+    porosity = blend_porosity(wet.compress(read_wadden(args.mud)), north_sea, wet, args.transition,
+                              cell_size(lon, lat), args.north_sea_value)
+    write_porosity(args.out, lon, lat, wet, porosity)
+    print("cells with porosity: %d of %d" % (np.isfinite(porosity).sum(), lon.size))
+    print("Wrote NetCDF:", args.out)
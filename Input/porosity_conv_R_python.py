@@ -1,8 +1,12 @@
 import numpy as np
 import rasterio
-from rasterio.warp import transform, reproject, Resampling
+from rasterio.warp import calculate_default_transform, reproject, Resampling
 from netCDF4 import Dataset
-import matplotlib.pyplot as plt
+from raster_sampling import sample_raster
+from raster_aggregate import aggregate_raster
+from grid_geometry import read_topo
+from wet_grid import WetGrid
+from quicklook import quicklook
 
 # ------------------------------------------------------------
 # Paths
@@ -14,6 +18,17 @@ tif_file  = "2024_11_18_Franken_SuppInfo3B_BelowMurkyWaters_Silt.tif"
 topo_nc   = "topo_adjusted_dws_200m_2009.nc"
 out_nc    = ncfile_path + "sediment_mud_fraction.nc"
 
+# "nearest": TIFF pixel containing the cell centre, read block by block in the
+#            TIFF's own CRS (memory of the model grid; NaN outside the TIFF)
+# "match_reprojection": the values of "reproject" without holding the whole
+#            reprojected TIFF, only its rows that hold cells at full width
+#            (opt-in, for a bit-for-bit comparison; see raster_sampling.py)
+# "reproject": the former path, the whole TIFF reprojected to EPSG:4326 in
+#              memory, then the nearest pixel (0 outside the TIFF footprint)
+# "aggregate": area-weighted mean of all TIFF pixels in the cell footprint,
+#              with the covered fraction and pixel count (weights cached)
+sampling  = "nearest"
+
 # ------------------------------------------------------------
 # 1. Load TIFF (silt) and GETM topology
 # ------------------------------------------------------------
@@ -23,82 +38,62 @@ nc_path  = ncfile_path + topo_nc
 src = rasterio.open(tif_path)
 silt_crs = src.crs
 
-# Read GETM grid (lonc, latc)
-nc = Dataset(nc_path, "r")
-lonc = nc.variables["lonc"][:]   # shape [xc, yc]
-latc = nc.variables["latc"][:]
-nc.close()
+# Read GETM grid (lonc, latc); only the wet cells are sampled and converted
+lonc, latc, bathy, land = read_topo(nc_path)
+wet = WetGrid.from_mask(land | ~np.isfinite(bathy), lon=lonc, lat=latc)
 
 dim_xc, dim_yc = lonc.shape
 
 print("TIFF CRS:", silt_crs)
 print("GETM lon range:", np.nanmin(lonc), np.nanmax(lonc))
 print("GETM lat range:", np.nanmin(latc), np.nanmax(latc))
+print("wet cells:", wet.size, "of", lonc.size)
 
 # ------------------------------------------------------------
-# 2. Reproject TIFF to EPSG:4326
-# ------------------------------------------------------------
-dst_crs = "EPSG:4326"
-
-# Create output array for reprojected TIFF
-transform_src = src.transform
-profile = src.profile
-
-# Read original data
-silt_data = src.read(1)
-
-# Build new transform & array shape via rasterio.warp
-from rasterio.warp import calculate_default_transform
-transform_ll, width_ll, height_ll = calculate_default_transform(
-    src.crs, dst_crs, src.width, src.height, *src.bounds
-)
-
-silt_ll = np.empty((height_ll, width_ll), dtype=silt_data.dtype)
-
-reproject(
-    source=silt_data,
-    destination=silt_ll,
-    src_transform=transform_src,
-    src_crs=src.crs,
-    dst_transform=transform_ll,
-    dst_crs=dst_crs,
-    resampling=Resampling.nearest,
-)
-
-# ------------------------------------------------------------
-# 3. Sample TIFF at GETM grid cell centers
+# 2. Sample TIFF at the wet GETM grid cell centers
 # ------------------------------------------------------------
-# Prepare flat coordinate list
-xy = np.column_stack([lonc.ravel(), latc.ravel()])
-
-# Convert lon/lat → pixel row/col
-rows, cols = rasterio.transform.rowcol(transform_ll, xy[:, 0], xy[:, 1])
-
-# Bilinear sampling handled above during reprojection
-# Here we extract nearest values; could interpolate manually if needed
-vals = np.full(len(rows), np.nan)
-mask = (rows >= 0) & (rows < height_ll) & (cols >= 0) & (cols < width_ll)
-vals[mask] = silt_ll[rows[mask], cols[mask]]
-
-# reshape back to GETM dims
-silt_arr = vals.reshape(dim_xc, dim_yc)
+# Use method="bilinear" in sample_raster for interpolated values.
+if sampling == "aggregate":
+    # the footprints need the full grid
+    aggregated = aggregate_raster(tif_path, lonc, latc)
+    silt_arr = wet.compress(aggregated.mean)
+    coverage = wet.compress(aggregated.coverage)
+    count = wet.compress(aggregated.count)
+elif sampling == "reproject":
+    dst_crs = "EPSG:4326"
+    transform_ll, width_ll, height_ll = calculate_default_transform(
+        src.crs, dst_crs, src.width, src.height, *src.bounds
+    )
+    silt_ll = np.empty((height_ll, width_ll), dtype=src.dtypes[0])
+    reproject(
+        source=src.read(1),
+        destination=silt_ll,
+        src_transform=src.transform,
+        src_crs=src.crs,
+        dst_transform=transform_ll,
+        dst_crs=dst_crs,
+        resampling=Resampling.nearest,
+    )
+    rows, cols = rasterio.transform.rowcol(transform_ll, wet.lon, wet.lat)
+    rows, cols = np.asarray(rows), np.asarray(cols)
+    silt_arr = np.full(wet.size, np.nan)
+    mask = (rows >= 0) & (rows < height_ll) & (cols >= 0) & (cols < width_ll)
+    silt_arr[mask] = silt_ll[rows[mask], cols[mask]]
+else:
+    silt_arr = sample_raster(src, wet.lon, wet.lat, method="nearest",
+                             match_reprojection=(sampling == "match_reprojection"))
+src.close()
 
 # ------------------------------------------------------------
-# 4. Handle NA and compute porosity
+# 3. Handle NA and compute porosity (wet cells)
 # ------------------------------------------------------------
 fill_na_with = -999.0
 
-silt_arr_filled = np.where(np.isnan(silt_arr), fill_na_with, silt_arr)
-
-# R formula: porosity = 0.387 + 0.415 * (silt_fraction/100)
-porosity_arr = 0.387 + 0.415 * (silt_arr_filled / 100.0)
-
-porosity_arr = np.where(silt_arr_filled == fill_na_with,
-                        fill_na_with,
-                        porosity_arr)
+# R formula: porosity = 0.387 + 0.415 * (silt_fraction/100); missing stays NaN
+porosity_arr = 0.387 + 0.415 * (silt_arr / 100.0)
 
 # ------------------------------------------------------------
-# 5. Write to NetCDF
+# 4. Write to NetCDF
 # ------------------------------------------------------------
 ncnew = Dataset(out_nc, "w", format="NETCDF4")
 
@@ -112,10 +107,19 @@ lat_var = ncnew.createVariable("latc", "f4", ("xc", "yc"), fill_value=1e20)
 mud_var = ncnew.createVariable("mud_fraction", "f4", ("xc", "yc"), fill_value=fill_na_with)
 por_var = ncnew.createVariable("porosity", "f4", ("xc", "yc"), fill_value=fill_na_with)
 
+# wet cells expanded to the grid, land and missing values fill_na_with
 lon_var[:] = lonc
 lat_var[:] = latc
-mud_var[:] = silt_arr_filled
-por_var[:] = porosity_arr
+mud_var[:] = wet.expand(np.where(np.isnan(silt_arr), fill_na_with, silt_arr), fill=fill_na_with)
+por_var[:] = wet.expand(np.where(np.isnan(porosity_arr), fill_na_with, porosity_arr), fill=fill_na_with)
+
+if sampling == "aggregate":
+    cov_var = ncnew.createVariable("mud_fraction_coverage", "f4", ("xc", "yc"))
+    cnt_var = ncnew.createVariable("mud_fraction_count", "i4", ("xc", "yc"))
+    cov_var.long_name = "fraction of the cell covered by valid TIFF pixels"
+    cnt_var.long_name = "number of valid TIFF pixels in the cell"
+    cov_var[:] = wet.expand(coverage, fill=0.0)
+    cnt_var[:] = wet.expand(count, fill=0)
 
 # global attributes
 ncnew.type = "Sediment mud fraction file for GETM"
@@ -128,13 +132,8 @@ ncnew.close()
 print("Wrote NetCDF:", out_nc)
 
 # ------------------------------------------------------------
-# 6. Optional: Plot porosity 0–1, missing in black
+# 5. Optional: Quicklook of porosity 0–1, missing transparent
 # ------------------------------------------------------------
-plt.figure(figsize=(6,5))
-plot_arr = porosity_arr.copy()
-plot_arr[plot_arr < 0] = np.nan  # remove -999
-plt.imshow(plot_arr, origin="lower", vmin=0, vmax=1, cmap="viridis")
-plt.colorbar(label="Porosity (0–1)")
-plt.title("Sediment Porosity")
-plt.show()
-
+# PNG without a display, cached by field content (see quicklook.py)
+plot_arr = wet.expand(porosity_arr)  # land and missing NaN
+quicklook(plot_arr, "porosity", vmin=0, vmax=1, cmap="viridis")
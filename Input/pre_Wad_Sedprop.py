@@ -3,17 +3,15 @@ import os
 import xarray as xr
 import pandas as pd
 import numpy as np
-from scipy.interpolate import griddata # for interpolation
 import matplotlib.pyplot as plt
+from quicklook import save_figure # figures as PNG, no display needed
 
-import esda, libpysal # spatial analysis libraries
-from libpysal.weights import KNN # for spatial weights
-from esda.moran import Moran # for spatial autocorrelation
-import geopandas as gpd # project coordinates
-from scipy.spatial import cKDTree # for fast neighbor search
+from spatial_diagnostics import knn_weights, morans_i, local_moran # spatial autocorrelation
+from grid_geometry import load_grid_geometry, project, UTM31N # projected grid, cached
+from idw import idw_wet # batched IDW
+from wet_grid import wet_grid # wet cells only, as 1D arrays
 
-from pykrige.ok import OrdinaryKriging # kriging interpolation
-from skgstat import Variogram, OrdinaryKriging
+from local_kriging import fit_variogram, krige_wet # local kriging
 
 # =========================
 # 1. Load topo dataset
@@ -69,7 +67,7 @@ plt.ylabel("Latitude")
 plt.title("Bathymetry with Porosity Sample Points")
 plt.legend(loc="upper right")
 plt.tight_layout()
-plt.show()
+save_figure(plt.gcf(), "bathymetry_samples")
 
 # =========================
 # 5. Quick stats
@@ -83,70 +81,44 @@ print(f"Porosity range in samples: {mud_df['porosity'].min():.2f} to {mud_df['po
 # 6. Project coordinates to meters
 # =========================
 
-# Convert sample points to GeoDataFrame
-gdf = gpd.GeoDataFrame(
-    mud_df,
-    geometry=gpd.points_from_xy(mud_df.x, mud_df.y),
-    crs="EPSG:4326"  # lon/lat
-)
+# Project the samples and the model grid to UTM zone 31N as plain arrays;
+# the grid geometry (x, y, land mask, KD-tree) is cached by topo file content
+mud_df["x_m"], mud_df["y_m"] = project(mud_df["x"].values, mud_df["y"].values, UTM31N)
 
-# Project to UTM zone 31N (meters)
-gdf_utm = gdf.to_crs("EPSG:32631")
-mud_df["x_m"] = gdf_utm.geometry.x
-mud_df["y_m"] = gdf_utm.geometry.y
-
-# Project model grid
-lon_flat = ds_topo["lonc"].values.flatten()
-lat_flat = ds_topo["latc"].values.flatten()
-grid_gdf = gpd.GeoDataFrame(geometry=gpd.points_from_xy(lon_flat, lat_flat), crs="EPSG:4326")
-grid_utm = grid_gdf.to_crs("EPSG:32631")
-grid_x = grid_utm.geometry.x.values.reshape(ds_topo["lonc"].shape)
-grid_y = grid_utm.geometry.y.values.reshape(ds_topo["latc"].shape)
+grid = load_grid_geometry("topo_adjusted_dws_200m_2009.nc")
+# interpolation on the wet cells only; fields are expanded to 2D (land NaN) for plotting
+wet = wet_grid(grid)
 
 # =========================
 # 7. Inverse distance weighting interpolation
 # =========================
 
-def idw_interpolation(xy_points, values, xi, yi, radius=1000, power=2):
+def idw_interpolation(xy_points, values, wet, radius=1000, power=2, k=None, min_neighbours=1):
     """
-    IDW interpolation for scattered points onto grid
+    IDW interpolation for scattered points onto the wet cells (batched, all cores; see idw.py)
     xy_points: (N,2) array of sample coordinates in meters
     values: (N,) array of sample porosity
-    xi, yi: 2D grid coordinates (meters)
+    wet: WetGrid of the model grid (projected x, y)
     radius: influence radius (meters)
     power: inverse distance power
+    k: use only the k nearest samples within radius (None: all of them)
+    min_neighbours: cells with fewer samples within reach get NaN
+    Returns a 1D array on the wet cells.
     """
-    xi_flat = xi.flatten()
-    yi_flat = yi.flatten()
-    interp = np.full_like(xi_flat, np.nan, dtype=float)
-    
-    # Build KDTree for fast neighbor search
-    tree = cKDTree(xy_points)
-    
-    for i, (xg, yg) in enumerate(zip(xi_flat, yi_flat)):
-        idxs = tree.query_ball_point([xg, yg], r=radius)
-        if len(idxs) > 0:
-            dists = np.sqrt((xy_points[idxs,0]-xg)**2 + (xy_points[idxs,1]-yg)**2) 
-            weights = 1.0 / (dists**power)
-            interp[i] = np.sum(weights * values[idxs]) / np.sum(weights)
-    
-    return interp.reshape(xi.shape)
+    return idw_wet(xy_points, values, wet, radius=radius, power=power, k=k,
+                   min_neighbours=min_neighbours)
 
 # Run IDW
 points_xy = np.column_stack((mud_df["x_m"], mud_df["y_m"]))
 values = mud_df["porosity"].values
 
-porosity_idw = idw_interpolation(points_xy, values, grid_x, grid_y, radius=1000, power=2)
-
-# Mask land
-land_mask = ds_topo["bathymetry"].values == -10
-porosity_idw_masked = np.where(land_mask, np.nan, porosity_idw)
+porosity_idw = wet.expand(idw_interpolation(points_xy, values, wet, radius=1000, power=2))
 
 # =========================
 # Plot IDW-interpolated porosity
 # =========================
 plt.figure(figsize=(10,6))
-plt.pcolormesh(ds_topo["lonc"], ds_topo["latc"], porosity_idw_masked,
+plt.pcolormesh(ds_topo["lonc"], ds_topo["latc"], porosity_idw,
                shading="auto", cmap="viridis")
 plt.colorbar(label="Porosity")
 # plt.scatter(mud_df["x"], mud_df["y"], c="k", s=10, label="Samples")
@@ -154,7 +126,7 @@ plt.xlabel("Longitude")
 plt.ylabel("Latitude")
 plt.title("Porosity - IDW interpolation (radius=1 km)")
 plt.legend()
-plt.show()
+save_figure(plt.gcf(), "porosity_idw")
 
 
 # =========================
@@ -163,10 +135,14 @@ plt.show()
 # Check for spatial autocorrelation
 # Moran’s I statistic
 # Measures global autocorrelation (values between -1 and 1):
-coords = list(zip(mud_df.x, mud_df.y))
-w = KNN.from_array(coords, k=5)
-moran = Moran(mud_df.porosity, w)
+# (sparse KNN weights in projected meters, vectorised permutations; see spatial_diagnostics.py)
+w = knn_weights(points_xy, k=5)
+moran = morans_i(mud_df.porosity.values, w, permutations=999, seed=42)
 print(moran.I, moran.p_sim)
+# Local Moran (LISA) per sample: clusters (q 1 HH, 3 LL) and outliers (q 2 LH, 4 HL)
+lisa = local_moran(mud_df.porosity.values, w, permutations=999, seed=42)
+mud_df["lisa_q"] = np.where(lisa.p_sim < 0.05, lisa.q, 0)
+print(mud_df["lisa_q"].value_counts().sort_index())
 # If I > 0.3 and p_sim < 0.05, there’s significant positive autocorrelation.
 # print(moran.I, moran.p_sim)
 # 0.8059314999249731 0.001
@@ -174,6 +150,23 @@ print(moran.I, moran.p_sim)
 # =========================
 # Kriging with radius-limited neighbors
 # =========================
-from skgstat import Variogram, OrdinaryKriging
-
-
+# Local ordinary kriging (see local_kriging.py): variogram fitted once,
+# k nearest samples within the radius per cell, tiles solved in parallel
+variogram = fit_variogram(points_xy, values, model="spherical")
+print(variogram)
+
+porosity_krig, porosity_krig_var = map(wet.expand, krige_wet(points_xy, values, wet,
+                                                              variogram=variogram, k=16, radius=5000,
+                                                              workers=os.cpu_count()))
+
+fig, axes = plt.subplots(1, 2, figsize=(14, 6))
+for ax, field, label in zip(axes, (porosity_krig, porosity_krig_var),
+                            ("Porosity", "Kriging variance")):
+    pc = ax.pcolormesh(ds_topo["lonc"], ds_topo["latc"], field, shading="auto", cmap="viridis")
+    fig.colorbar(pc, ax=ax, label=label)
+    ax.set_xlabel("Longitude")
+    ax.set_ylabel("Latitude")
+axes[0].set_title("Porosity - local ordinary kriging (k=16, radius=5 km)")
+axes[1].set_title("Kriging variance")
+plt.tight_layout()
+save_figure(fig, "porosity_kriging")
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# =========================
+# Quicklook images of 2D grid fields, without a display
+# =========================
+# A 2D field (e.g. bathymetry, porosity) is coloured once and written as PNG:
+#   quicklook    : one image, decimated (NaN-aware block mean) to at most
+#                  max_size pixels along each side
+#   tile_pyramid : tiles of tile x tile pixels at every zoom level, level 0
+#                  one tile for the whole field, each next level twice the
+#                  resolution, up to the full grid resolution
+#                  (<dir>/<level>/<column>_<row>.png, with pyramid.json)
+# Results are cached by the hash of the field values and the colour settings,
+# so a field that was rendered before is not rendered again. Missing values
+# (NaN, masked) are transparent. Only the Agg backend is used.
+# GETM fields (xc, yc) are drawn with xc to the right and yc upwards.
+#
+# Usage:
+#   python quicklook.py sediment_mud_fraction.nc porosity --vmin 0 --vmax 1
+#   python quicklook.py topo_adjusted_dws_200m_2009.nc bathymetry --tiles
+import argparse
+import hashlib
+import json
+import os
+import numpy as np
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.image
+from netCDF4 import Dataset
+
+# default cache directory (relative to the working directory)
+CACHE_DIR = ".quicklook"
+
+# dimensions that are drawn to the right when they come first (GETM xc, restart xax)
+X_FIRST = ("xc", "xax", "x", "lon")
+
+
+def image_array(field, x_first=True):
+    """
+    2D field as an image array: rows from north to south
+    x_first: the first dimension runs to the right (GETM (xc, yc))
+    """
+    field = np.ma.filled(np.ma.asarray(field, dtype=np.float64), np.nan)
+    if x_first:
+        field = field.T
+    return field[::-1]
+
+
+def decimate(image, factor):
+    """
+    NaN-aware mean over blocks of factor x factor pixels (edges padded with NaN)
+    """
+    if factor <= 1:
+        return image
+    ny = -(-image.shape[0] // factor) * factor
+    nx = -(-image.shape[1] // factor) * factor
+    padded = np.full((ny, nx), np.nan)
+    padded[:image.shape[0], :image.shape[1]] = image
+    blocks = padded.reshape(ny // factor, factor, nx // factor, factor)
+    valid = np.isfinite(blocks)
+    count = valid.sum(axis=(1, 3))
+    total = np.where(valid, blocks, 0.0).sum(axis=(1, 3))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(count > 0, total / count, np.nan)
+
+
+def colorize(image, vmin, vmax, cmap="viridis"):
+    """
+    RGBA uint8 array of an image, NaN transparent
+    """
+    rgba = matplotlib.colormaps[cmap](matplotlib.colors.Normalize(vmin, vmax, clip=True)(image), bytes=True)
+    rgba[~np.isfinite(image)] = 0
+    return rgba
+
+
+def field_key(image, vmin, vmax, cmap, *extra):
+    """
+    Cache key: hash of the image values and the colour (and other) settings
+    """
+    sha = hashlib.sha256()
+    sha.update(np.ascontiguousarray(image, dtype=np.float64).tobytes())
+    sha.update(json.dumps([image.shape, float(vmin), float(vmax), cmap] + list(extra)).encode())
+    return sha.hexdigest()[:20]
+
+
+def _limits(image, vmin, vmax):
+    if vmin is None:
+        vmin = float(np.nanmin(image))
+    if vmax is None:
+        vmax = float(np.nanmax(image))
+    return vmin, vmax
+
+
+def quicklook(field, name="field", vmin=None, vmax=None, cmap="viridis", max_size=1024, x_first=True,
+              cache_dir=CACHE_DIR, verbose=True):
+    """
+    One decimated PNG of a 2D field
+    field: 2D array (NaN or masked: missing)
+    name: start of the file name
+    vmin, vmax: colour limits; default the field range
+    cmap: matplotlib colour map
+    max_size: largest number of pixels along a side
+    x_first: the first dimension runs to the right (GETM (xc, yc))
+    cache_dir: directory of the images
+    Returns the file name of the PNG.
+    """
+    image = image_array(field, x_first)
+    vmin, vmax = _limits(image, vmin, vmax)
+    key = field_key(image, vmin, vmax, cmap, max_size)
+    fname = os.path.join(cache_dir, "%s_%s.png" % (name, key))
+    if not os.path.exists(fname):
+        factor = int(np.ceil(max(image.shape) / max_size))
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = fname + ".%d.tmp.png" % os.getpid()
+        matplotlib.image.imsave(tmp, colorize(decimate(image, factor), vmin, vmax, cmap))
+        os.replace(tmp, fname)
+    if verbose:
+        print("quicklook:", fname)
+    return fname
+
+
+def tile_pyramid(field, name="field", vmin=None, vmax=None, cmap="viridis", tile=256, x_first=True,
+                 cache_dir=CACHE_DIR, verbose=True):
+    """
+    PNG tile pyramid of a 2D field
+    field, name, vmin, vmax, cmap, x_first, cache_dir: see quicklook
+    tile: tile size in pixels
+    Returns the pyramid directory (<level>/<column>_<row>.png and pyramid.json).
+    """
+    image = image_array(field, x_first)
+    vmin, vmax = _limits(image, vmin, vmax)
+    directory = os.path.join(cache_dir, "%s_%s" % (name, field_key(image, vmin, vmax, cmap, tile)))
+    meta_file = os.path.join(directory, "pyramid.json")
+    if os.path.exists(meta_file):
+        if verbose:
+            print("tile pyramid (cached):", directory)
+        return directory
+
+    levels = int(np.ceil(np.log2(max(1.0, max(image.shape) / tile)))) + 1
+    meta = {"name": name, "shape": list(image.shape), "tile": tile, "vmin": vmin, "vmax": vmax,
+            "cmap": cmap, "levels": []}
+    for level in range(levels):
+        factor = 2 ** (levels - 1 - level)
+        rgba = colorize(decimate(image, factor), vmin, vmax, cmap)
+        os.makedirs(os.path.join(directory, str(level)), exist_ok=True)
+        rows = -(-rgba.shape[0] // tile)
+        cols = -(-rgba.shape[1] // tile)
+        for r in range(rows):
+            for c in range(cols):
+                part = rgba[r * tile:(r + 1) * tile, c * tile:(c + 1) * tile]
+                matplotlib.image.imsave(os.path.join(directory, str(level), "%d_%d.png" % (c, r)), part)
+        meta["levels"].append({"level": level, "factor": factor, "shape": list(rgba.shape[:2]),
+                               "columns": cols, "rows": rows})
+    # pyramid.json last: a directory without it is incomplete and is rebuilt
+    with open(meta_file, "w") as f:
+        json.dump(meta, f, indent=1)
+    if verbose:
+        print("tile pyramid:", directory)
+    return directory
+
+
+def save_figure(fig, name, out_dir=CACHE_DIR, dpi=100, verbose=True):
+    """
+    Save a matplotlib figure as PNG (instead of plt.show()) and close it
+    Returns the file name.
+    """
+    import matplotlib.pyplot as plt
+    os.makedirs(out_dir, exist_ok=True)
+    fname = os.path.join(out_dir, name + ".png")
+    fig.savefig(fname, dpi=dpi)
+    plt.close(fig)
+    if verbose:
+        print("figure:", fname)
+    return fname
+
+
+def read_field(fname, varname, index=0):
+    """
+    2D field of a NetCDF variable; leading dimensions (e.g. time) at index
+    Returns (field with NaN for missing values, x_first).
+    """
+    with Dataset(fname, "r") as nc:
+        var = nc.variables[varname]
+        dims = var.dimensions
+        data = var[(index,) * (var.ndim - 2)]
+    return np.ma.filled(np.ma.asarray(data, dtype=np.float64), np.nan), dims[-2] in X_FIRST
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Quicklook PNG (or tile pyramid) of a 2D NetCDF field")
+    parser.add_argument("file", help="NetCDF file")
+    parser.add_argument("var", help="variable (2D, or the first 2D slice of it)")
+    parser.add_argument("--index", type=int, default=0, help="index in the leading dimensions (default 0)")
+    parser.add_argument("--vmin", type=float, default=None, help="lower colour limit")
+    parser.add_argument("--vmax", type=float, default=None, help="upper colour limit")
+    parser.add_argument("--below", type=float, default=None,
+                        help="values below this are missing (e.g. -998 for -999 fills)")
+    parser.add_argument("--cmap", default="viridis", help="matplotlib colour map")
+    parser.add_argument("--max-size", type=int, default=1024, help="largest image side (default 1024)")
+    parser.add_argument("--tiles", action="store_true", help="write a tile pyramid instead of one image")
+    parser.add_argument("--tile", type=int, default=256, help="tile size (default 256)")
+    parser.add_argument("--out-dir", default=CACHE_DIR, help="cache directory (default %s)" % CACHE_DIR)
+    args = parser.parse_args()
+
+    field, x_first = read_field(args.file, args.var, args.index)
+    if args.below is not None:
+        field[field < args.below] = np.nan
+    name = "%s_%s" % (os.path.splitext(os.path.basename(args.file))[0], args.var)
+    if args.tiles:
+        tile_pyramid(field, name, args.vmin, args.vmax, args.cmap, args.tile, x_first, args.out_dir)
+    else:
+        quicklook(field, name, args.vmin, args.vmax, args.cmap, args.max_size, x_first, args.out_dir)
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# =========================
+# Aggregation of a fine raster (GeoTIFF) over the footprints of the GETM cells
+# =========================
+# Instead of one value at the cell centre, every cell gets the area-weighted
+# mean of all raster pixels inside its footprint, the fraction of its area
+# covered by valid pixels and the number of valid pixels.
+#   1. the cell centres are projected to the raster CRS; the footprint of a
+#      cell is the region closer to its centre than to any other centre
+#      (for the near-regular GETM grid this is the cell quadrilateral),
+#      limited to half the longer cell diagonal at the edges of the grid
+#   2. every raster pixel is split in subsample x subsample parts, and each
+#      part is assigned to the cell it falls in (KD-tree); this gives a sparse
+#      (cells x pixels) matrix W of the pixel area inside each cell
+#   3. W is cached on disk, keyed by the cell centres and the raster grid
+#      (CRS, transform, size), so other rasters on the same grid reuse it
+#   4. the raster is streamed in bands of rows; per band the sums are one
+#      sparse matrix-vector product with the columns of W of that band
+# Both the weights and the sums are built band by band; the rows of a band
+# follow from a byte budget (--> band_rows), so the peak memory does not grow
+# with the size of the raster beyond W itself.
+import hashlib
+import os
+from collections import namedtuple
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+from scipy import sparse
+from scipy.spatial import cKDTree
+from grid_geometry import project
+
+# memory of one band of raster rows, both for building the weights and for aggregating
+BLOCK_BYTES = 64 * 1024**2
+# bytes per pixel part while building the weights (coordinates, KD-tree query, indices)
+SAMPLE_BYTES = 64
+# bytes per pixel while aggregating (values, valid mask and products)
+PIXEL_BYTES = 32
+
+AggregateResult = namedtuple("AggregateResult", "mean coverage count")
+
+
+class CellWeights:
+    """
+    Pixel to cell weights of one model grid and one raster grid
+    matrix: (cells, pixels) CSC matrix, area of pixel p inside cell c in pixels
+    cell_area: (cells,) cell areas in pixels
+    shape: shape of the model grid
+    raster_shape: (height, width) of the raster
+    """
+
+    def __init__(self, matrix, cell_area, shape, raster_shape):
+        self.matrix = matrix
+        self.cell_area = cell_area
+        self.shape = shape
+        self.raster_shape = raster_shape
+        # 1 for every (cell, pixel) overlap, for the pixel count
+        self.overlap = matrix.copy()
+        self.overlap.data[:] = 1.0
+
+
+def cell_corners(x, y):
+    """
+    Corner coordinates of a curvilinear grid from its centres
+    x, y: 2D centre coordinates (meters)
+    Returns xq, yq with one row and column more than x: the mean of the four
+    surrounding centres, the outer centres extrapolated linearly.
+    """
+    def pad(a):
+        a = np.vstack((2 * a[:1] - a[1:2], a, 2 * a[-1:] - a[-2:-1]))
+        return np.hstack((2 * a[:, :1] - a[:, 1:2], a, 2 * a[:, -1:] - a[:, -2:-1]))
+    xp, yp = pad(x), pad(y)
+    xq = 0.25 * (xp[:-1, :-1] + xp[1:, :-1] + xp[:-1, 1:] + xp[1:, 1:])
+    yq = 0.25 * (yp[:-1, :-1] + yp[1:, :-1] + yp[:-1, 1:] + yp[1:, 1:])
+    return xq, yq
+
+
+def cell_areas(xq, yq):
+    """
+    Area of the quadrilateral cells between the corners xq, yq (shoelace formula)
+    """
+    x = (xq[:-1, :-1], xq[1:, :-1], xq[1:, 1:], xq[:-1, 1:])
+    y = (yq[:-1, :-1], yq[1:, :-1], yq[1:, 1:], yq[:-1, 1:])
+    twice = sum(x[i] * y[(i + 1) % 4] - x[(i + 1) % 4] * y[i] for i in range(4))
+    return 0.5 * np.abs(twice)
+
+
+def band_rows(width, bytes_per_pixel, max_bytes=BLOCK_BYTES):
+    """
+    Raster rows per band so that a band of width pixels takes about max_bytes (at least one row)
+    """
+    return max(1, int(max_bytes // (width * bytes_per_pixel)))
+
+
+def build_weights(src, lon, lat, subsample=4, max_bytes=BLOCK_BYTES):
+    """
+    Pixel to cell weights of a raster and a model grid
+    src: open rasterio dataset
+    lon, lat: 2D cell centres (lonc, latc)
+    subsample: parts per pixel side used to split the pixels over cells
+    max_bytes: memory of the pixel parts of one band of raster rows
+    Returns a CellWeights.
+    """
+    x, y = project(lon, lat, src.crs.to_wkt())
+    xq, yq = cell_corners(x, y)
+    pixel_area = abs(src.transform.a * src.transform.e - src.transform.b * src.transform.d)
+    area = cell_areas(xq, yq).ravel()
+    half_diagonal = 0.5 * np.maximum(np.hypot(xq[1:, 1:] - xq[:-1, :-1], yq[1:, 1:] - yq[:-1, :-1]),
+                                     np.hypot(xq[1:, :-1] - xq[:-1, 1:], yq[1:, :-1] - yq[:-1, 1:])).ravel()
+    tree = cKDTree(np.column_stack((x.ravel(), y.ravel())))
+
+    offsets = (np.arange(subsample) + 0.5) / subsample
+    nparts = subsample**2
+    rows_per_band = band_rows(src.width, SAMPLE_BYTES * nparts, max_bytes)
+    bands = []
+    for r0 in range(0, src.height, rows_per_band):
+        r1 = min(src.height, r0 + rows_per_band)
+        # pixel parts in (row, column, sub-row, sub-column) order, so part k is in pixel k // nparts
+        rows = np.arange(r0, r1)[:, None, None, None] + offsets[None, None, :, None]
+        cols = np.arange(src.width)[None, :, None, None] + offsets[None, None, None, :]
+        px, py = src.transform * (cols, rows)
+        px, py = np.ravel(px), np.ravel(py)
+        inside = np.flatnonzero((px >= xq.min()) & (px <= xq.max()) & (py >= yq.min()) & (py <= yq.max()))
+        dist, cell = tree.query(np.column_stack((px[inside], py[inside])),
+                                distance_upper_bound=half_diagonal.max(), workers=-1)
+        del px, py
+        found = np.isfinite(dist)
+        found[found] = dist[found] <= half_diagonal[cell[found]]
+        # the columns of W of this band, duplicates (parts of one pixel in one cell) summed
+        bands.append(sparse.csc_matrix((np.full(found.sum(), 1.0 / nparts),
+                                        (cell[found], inside[found] // nparts)),
+                                       shape=(x.size, (r1 - r0) * src.width)))
+    matrix = sparse.hstack(bands, format="csc")
+    return CellWeights(matrix, area / pixel_area, x.shape, (src.height, src.width))
+
+
+def weights_key(src, lon, lat, subsample):
+    """
+    Cache key of the weights: hash of the cell centres, the raster grid and the subsampling
+    """
+    sha = hashlib.sha256()
+    sha.update(np.ascontiguousarray(lon, dtype=np.float64).tobytes())
+    sha.update(np.ascontiguousarray(lat, dtype=np.float64).tobytes())
+    sha.update(("%s|%s|%d|%d|%d" % (src.crs.to_wkt(), tuple(src.transform), src.width, src.height,
+                                    subsample)).encode())
+    return sha.hexdigest()[:20]
+
+
+def load_weights(src, lon, lat, subsample=4, cache_dir=None, verbose=True):
+    """
+    Pixel to cell weights from the cache, built (and cached) if not there
+    src: open rasterio dataset
+    lon, lat: 2D cell centres (lonc, latc)
+    subsample: see build_weights
+    cache_dir: cache directory; default .grid_cache next to the raster file
+    Returns a CellWeights.
+    """
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(src.name)), ".grid_cache")
+    cache_file = os.path.join(cache_dir, "weights_%s.npz" % weights_key(src, lon, lat, subsample))
+    if os.path.exists(cache_file):
+        with np.load(cache_file) as cached:
+            matrix = sparse.csc_matrix((cached["data"], cached["indices"], cached["indptr"]),
+                                       shape=tuple(cached["matrix_shape"]))
+            weights = CellWeights(matrix, cached["cell_area"], tuple(cached["shape"]),
+                                  tuple(cached["raster_shape"]))
+        if verbose:
+            print("pixel to cell weights from cache:", cache_file)
+        return weights
+
+    weights = build_weights(src, lon, lat, subsample)
+    os.makedirs(cache_dir, exist_ok=True)
+    # write to a temporary name first, so an interrupted run leaves no broken cache
+    tmp = cache_file + ".%d.tmp.npz" % os.getpid()
+    m = weights.matrix
+    np.savez(tmp, data=m.data, indices=m.indices, indptr=m.indptr, matrix_shape=m.shape,
+             cell_area=weights.cell_area, shape=weights.shape, raster_shape=weights.raster_shape)
+    os.replace(tmp, cache_file)
+    if verbose:
+        print("pixel to cell weights cached:", cache_file)
+    return weights
+
+
+def aggregate(src, weights, band=1, max_bytes=BLOCK_BYTES):
+    """
+    Area-weighted mean, coverage and count of the raster pixels in each cell
+    src: open rasterio dataset (the raster grid the weights were built for)
+    weights: CellWeights (load_weights)
+    band: raster band
+    max_bytes: memory of one band of raster rows read at a time
+    Returns an AggregateResult of 2D arrays (model grid shape):
+      mean: mean of the valid pixels, weighted by their area in the cell; NaN without any
+      coverage: fraction of the cell area covered by valid pixels
+      count: number of valid pixels overlapping the cell
+    """
+    if (src.height, src.width) != tuple(weights.raster_shape):
+        raise ValueError("raster size %s does not match the weights (%s)"
+                         % ((src.height, src.width), tuple(weights.raster_shape)))
+    ncells = weights.matrix.shape[0]
+    vsum = np.zeros(ncells)
+    wsum = np.zeros(ncells)
+    count = np.zeros(ncells)
+    rows_per_band = band_rows(src.width, PIXEL_BYTES, max_bytes)
+    for r0 in range(0, src.height, rows_per_band):
+        r1 = min(src.height, r0 + rows_per_band)
+        data = src.read(band, window=Window(0, r0, src.width, r1 - r0)).astype(np.float64).ravel()
+        if src.nodata is not None:
+            data[data == src.nodata] = np.nan
+        valid = np.isfinite(data)
+        columns = slice(r0 * src.width, r1 * src.width)
+        w = weights.matrix[:, columns]
+        vsum += w @ np.where(valid, data, 0.0)
+        wsum += w @ valid.astype(np.float64)
+        count += weights.overlap[:, columns] @ valid.astype(np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(wsum > 0, vsum / wsum, np.nan)
+        coverage = np.minimum(wsum / weights.cell_area, 1.0)
+    return AggregateResult(mean.reshape(weights.shape), coverage.reshape(weights.shape),
+                           count.astype(np.int64).reshape(weights.shape))
+
+
+def aggregate_raster(path, lon, lat, band=1, subsample=4, cache_dir=None, verbose=True):
+    """
+    Aggregate a raster file over the cells of a model grid (weights cached)
+    path: raster file
+    lon, lat: 2D cell centres (lonc, latc)
+    band, subsample, cache_dir: see aggregate and load_weights
+    Returns an AggregateResult.
+    """
+    with rasterio.open(path) as src:
+        weights = load_weights(src, lon, lat, subsample, cache_dir, verbose)
+        return aggregate(src, weights, band)
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# =========================
+# Sampling a raster (GeoTIFF) at the GETM cell centres
+# =========================
+# Instead of reprojecting the whole raster to EPSG:4326 and picking values
+# from the result, the cell centres are transformed to the raster's own CRS
+# and only the raster blocks that contain cell centres are read, one block
+# (plus a one pixel margin for bilinear) at a time. Memory is proportional
+# to the model grid, not to the raster. This is the default.
+#   nearest  : value of the raster pixel that contains the point
+#   bilinear : weighted mean of the 4 nearest pixel centres, nodata/NaN
+#              pixels left out (as GDAL does)
+# Nearest values from the raster's own CRS are not those of the former path
+# (reproject to EPSG:4326 with Resampling.nearest, then take the pixel at
+# lonc/latc): the reprojection resamples the raster once more onto a lon/lat
+# grid of about the same resolution, so a cell often gets a neighbouring
+# pixel (51% of the cells on a synthetic 50 m UTM raster of independent
+# random pixels; on a smooth field the values differ much less).
+# match_reprojection=True (opt-in, for a bit-for-bit comparison with the
+# former path) runs the same GDAL warp, but only for the rows of the
+# EPSG:4326 grid of calculate_default_transform that hold points. The rows
+# are warped at the full width of that grid: GDAL's approximate transformer
+# interpolates along each destination row, so a narrower window picks other
+# pixels near the pixel edges (about 4% of the cells on a 50 m UTM raster,
+# 7% when the points are snapped to the pixel centres instead). On that
+# raster all values equal those of the full reprojection (both with GDAL's
+# default warp memory, which sets how the warp is split in chunks). This is
+# NOT proportional to the model grid: the warped rows span the grid at the
+# full width of the reprojected raster, in float64, which for a grid that
+# covers the raster is about the whole reprojection (twice its size for a
+# float32 raster).
+# Different from the former path: cells outside the raster footprint and
+# nodata pixels are NaN, where the reprojection gave 0 (or the nodata value).
+import numpy as np
+import rasterio
+from affine import Affine
+from rasterio.warp import transform, calculate_default_transform, reproject, Resampling
+from rasterio.windows import Window
+
+# rows and columns of the blocks read at a time
+BLOCK = 512
+
+
+def to_raster_pixels(src, lon, lat, crs="EPSG:4326"):
+    """
+    Fractional raster pixel coordinates (col, row) of lon/lat points
+    src: open rasterio dataset
+    lon, lat: 1D arrays of point coordinates (crs)
+    Returns (col, row) float arrays; pixel (r, c) covers row r..r+1, col c..c+1.
+    """
+    lon = np.asarray(lon, dtype=float)
+    lat = np.asarray(lat, dtype=float)
+    finite = np.isfinite(lon) & np.isfinite(lat)
+    x = np.full(lon.shape, np.nan)
+    y = np.full(lat.shape, np.nan)
+    if finite.any():
+        xs, ys = transform(crs, src.crs, lon[finite], lat[finite])
+        x[finite] = xs
+        y[finite] = ys
+    col, row = ~src.transform * (x, y)
+    return np.asarray(col), np.asarray(row)
+
+
+def sample_reprojected(src, lon, lat, band=1, dst_crs="EPSG:4326"):
+    """
+    Nearest values at lon/lat points as from a full reprojection of the raster to dst_crs
+    (see module comment); only the rows of the reprojected grid that hold points are warped
+    src: open rasterio dataset
+    lon, lat: 1D arrays of point coordinates (dst_crs)
+    Returns a float array; NaN outside the reprojected grid and its footprint and for nodata.
+    """
+    aff, width, height = calculate_default_transform(src.crs, dst_crs, src.width, src.height,
+                                                     *src.bounds)
+    c, r = ~aff * (np.asarray(lon, dtype=float), np.asarray(lat, dtype=float))
+    with np.errstate(invalid="ignore"):
+        inside = (r >= 0) & (r < height) & (c >= 0) & (c < width)
+    values = np.full(np.shape(lon), np.nan)
+    if not inside.any():
+        return values
+    r = np.floor(r[inside]).astype(np.int64)
+    c = np.floor(c[inside]).astype(np.int64)
+    r0 = r.min()
+    rows = np.full((r.max() + 1 - r0, width), np.nan)
+    reproject(rasterio.band(src, band), rows, dst_transform=aff * Affine.translation(0, r0),
+              dst_crs=dst_crs, dst_nodata=np.nan, resampling=Resampling.nearest)
+    values[inside] = rows[r - r0, c]
+    return values
+
+
+def _read(src, band, r0, r1, c0, c1):
+    """
+    Read rows r0..r1-1 and columns c0..c1-1 as float, nodata as NaN
+    """
+    data = src.read(band, window=Window(c0, r0, c1 - c0, r1 - r0)).astype(np.float64)
+    if src.nodata is not None:
+        data[data == src.nodata] = np.nan
+    return data
+
+
+def sample_raster(path, lon, lat, method="nearest", match_reprojection=False, band=1, block=BLOCK):
+    """
+    Sample a raster at lon/lat points
+    path: raster file (or an open rasterio dataset)
+    lon, lat: arrays of point coordinates (EPSG:4326), any equal shape
+    method: 'nearest' or 'bilinear'
+    match_reprojection: nearest values as from a full reprojection to EPSG:4326
+                        (opt-in, memory of about the reprojected raster; see module
+                        comment; method nearest only)
+    band: raster band
+    block: rows and columns of the blocks read at a time
+    Returns an array of the shape of lon; NaN outside the raster and for nodata.
+    """
+    if method not in ("nearest", "bilinear"):
+        raise ValueError("unknown method %s, use nearest or bilinear" % method)
+    if match_reprojection and method != "nearest":
+        raise ValueError("match_reprojection is for method nearest only")
+    src = rasterio.open(path) if isinstance(path, str) else path
+    shape = np.shape(lon)
+    if match_reprojection:
+        values = sample_reprojected(src, np.ravel(lon), np.ravel(lat), band)
+        if isinstance(path, str):
+            src.close()
+        return values.reshape(shape)
+    col, row = to_raster_pixels(src, np.ravel(lon), np.ravel(lat))
+    values = np.full(col.shape, np.nan)
+
+    if method == "nearest":
+        # pixel containing the point
+        r = np.floor(row)
+        c = np.floor(col)
+        inside = (r >= 0) & (r < src.height) & (c >= 0) & (c < src.width)
+    else:
+        # upper left of the 4 pixel centres around the point; the edges are clamped
+        r = np.floor(row - 0.5)
+        c = np.floor(col - 0.5)
+        inside = (row >= 0) & (row <= src.height) & (col >= 0) & (col <= src.width)
+    points = np.flatnonzero(inside)
+    r = r[points].astype(np.int64)
+    c = c[points].astype(np.int64)
+
+    # group the points by block and read one block at a time
+    key = (np.clip(r, 0, src.height - 1) // block) * (src.width // block + 1) + np.clip(c, 0, src.width - 1) // block
+    order = np.argsort(key, kind="stable")
+    starts = np.flatnonzero(np.r_[True, np.diff(key[order]) != 0])
+    for group in np.split(order, starts[1:]):
+        br = max(0, min(r[group].min(), src.height - 1))
+        bc = max(0, min(c[group].min(), src.width - 1))
+        r1 = min(src.height, r[group].max() + 2)
+        c1 = min(src.width, c[group].max() + 2)
+        data = _read(src, band, br, r1, bc, c1)
+        rr = r[group] - br
+        cc = c[group] - bc
+        if method == "nearest":
+            values[points[group]] = data[rr, cc]
+            continue
+        fr = row[points[group]] - 0.5 - r[group]
+        fc = col[points[group]] - 0.5 - c[group]
+        total = np.zeros(len(group))
+        wsum = np.zeros(len(group))
+        for dr, dc, w in ((0, 0, (1 - fr) * (1 - fc)), (0, 1, (1 - fr) * fc),
+                          (1, 0, fr * (1 - fc)), (1, 1, fr * fc)):
+            v = data[np.clip(rr + dr, 0, data.shape[0] - 1), np.clip(cc + dc, 0, data.shape[1] - 1)]
+            ok = np.isfinite(v) & (w > 0)
+            total += np.where(ok, w * v, 0.0)
+            wsum += np.where(ok, w, 0.0)
+        with np.errstate(invalid="ignore"):
+            values[points[group]] = np.where(wsum > 0, total / wsum, np.nan)
+
+    if isinstance(path, str):
+        src.close()
+    return values.reshape(shape)
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+# =========================
+# Sediment property pipeline: sediment_mud_fraction.nc and Ben_Sedprop.nc
+# =========================
+# One script for the steps of porosity_conv_R_python.py / Sediment_layer.R
+# (Wadden Sea silt raster onto the GETM grid) and Input_data_prep.Rmd (North
+# Sea porosity onto the grid, Wadden Sea values merged in, islands masked).
+# Stages:
+#   grid      : lonc, latc, bathymetry and land mask of the topo file
+#   wadden    : silt raster (Franken et al.) onto the grid, mud fraction (%)
+#   north_sea : Porosity of the North Sea Ben_Sedprop.nc onto the grid
+#   blend     : porosity of the mud fraction, blended into the North Sea field
+#               (porosity_blend.py, optionally over a transition zone)
+# Every stage result is memoised on disk, keyed by the hashes of its input
+# files, the keys of the stages it uses and its parameters; a stage runs
+# only if that key is new. Changing only the blend parameters reruns only
+# the blend stage, a new topo file reruns everything.
+# The stages after grid work on the wet cells only (1D, see wet_grid.py);
+# the fields are expanded to the 820x486 grid when the files are written.
+#
+# Usage:
+#   python sedprop_pipeline.py --topo topo_adjusted_dws_200m_2009.nc \
+#       --silt 2024_11_18_Franken_SuppInfo3B_BelowMurkyWaters_Silt.tif \
+#       --north-sea Ben_Sedprop.nc --out-dir ../dws_200m/Input
+import argparse
+import hashlib
+import json
+import os
+from datetime import datetime
+import numpy as np
+from netCDF4 import Dataset
+from grid_geometry import file_hash, read_topo, LAND_VALUE
+from wet_grid import WetGrid
+from porosity_blend import blend_porosity, cell_size, read_north_sea, sample_regular
+
+# bump when the computation of a stage changes, so old cache entries are not used
+VERSION = 4
+
+# fill value of the output files
+FILL_VALUE = -999.0
+
+# porosity of the mud fraction (%): a + b * mud / 100 (porosity_conv_R_python.py)
+POROSITY_A = 0.387
+POROSITY_B = 0.415
+
+
+def stage_key(name, files=(), upstream=(), params=None):
+    """
+    Key of a stage result: hash of the stage name, the content of its input
+    files, the keys of the stages it uses and its parameters
+    """
+    sha = hashlib.sha256()
+    sha.update(("%s|%d" % (name, VERSION)).encode())
+    for fname in files:
+        sha.update(file_hash(fname).encode())
+    for key in upstream:
+        sha.update(key.encode())
+    sha.update(json.dumps(params or {}, sort_keys=True).encode())
+    return sha.hexdigest()[:20]
+
+
+def memo(cache_dir, name, key, func, verbose=True):
+    """
+    Result of a stage (dict of arrays) from the cache, or computed by func() and cached
+    cache_dir: cache directory
+    name: stage name
+    key: stage_key of the stage
+    func: function without arguments that returns a dict of numpy arrays
+    """
+    cache_file = os.path.join(cache_dir, "%s_%s.npz" % (name, key))
+    if os.path.exists(cache_file):
+        if verbose:
+            print("%-10s cached  %s" % (name, key))
+        with np.load(cache_file) as cached:
+            return {k: cached[k] for k in cached.files}
+    if verbose:
+        print("%-10s running %s" % (name, key))
+    result = func()
+    os.makedirs(cache_dir, exist_ok=True)
+    # write to a temporary name first, so an interrupted run leaves no broken cache
+    tmp = cache_file + ".%d.tmp.npz" % os.getpid()
+    np.savez(tmp, **result)
+    os.replace(tmp, cache_file)
+    return result
+
+
+# =========================
+# Stages
+# =========================
+
+def grid_stage(topo_nc, land_value=LAND_VALUE):
+    """
+    lonc, latc, bathymetry and land mask (land value or missing bathymetry)
+    """
+    lon, lat, bathy, land = read_topo(topo_nc, land_value)
+    return {"lon": lon, "lat": lat, "bathymetry": bathy, "land": land | ~np.isfinite(bathy)}
+
+
+def wet_cells(grid):
+    """
+    WetGrid (lon, lat) of the result of the grid stage
+    """
+    return WetGrid.from_mask(grid["land"], lon=grid["lon"], lat=grid["lat"])
+
+
+def wadden_stage(grid, silt_tif, method="nearest"):
+    """
+    Silt raster (mud fraction, %) onto the wet cells
+    method: "nearest" (as porosity_conv_R_python.py), "bilinear" (as Sediment_layer.R),
+            "aggregate" (area-weighted mean over the cell footprints) or "match_reprojection"
+            (nearest values of a full reprojection, memory of about the reprojected raster;
+            see raster_sampling.py)
+    """
+    wet = wet_cells(grid)
+    if method == "aggregate":
+        # the footprints need the full grid
+        from raster_aggregate import aggregate_raster
+        result = aggregate_raster(silt_tif, grid["lon"], grid["lat"])
+        return {"mud": wet.compress(result.mean), "coverage": wet.compress(result.coverage),
+                "count": wet.compress(result.count)}
+    from raster_sampling import sample_raster
+    if method == "match_reprojection":
+        mud = sample_raster(silt_tif, wet.lon, wet.lat, method="nearest", match_reprojection=True)
+    else:
+        mud = sample_raster(silt_tif, wet.lon, wet.lat, method=method)
+    return {"mud": mud}
+
+
+def north_sea_stage(grid, ben_nc, method="nearest"):
+    """
+    Porosity of a regular lon/lat Ben_Sedprop.nc file onto the wet cells
+    method: "nearest" (terra::extract "simple", as Input_data_prep.Rmd) or "bilinear"
+    """
+    wet = wet_cells(grid)
+    return {"porosity": sample_regular(*read_north_sea(ben_nc), wet.lon, wet.lat, method)}
+
+
+def blend_stage(grid, wadden, north_sea, a=POROSITY_A, b=POROSITY_B, north_sea_value=None,
+                transition=0.0):
+    """
+    Porosity of the Wadden Sea mud fraction, blended into the North Sea porosity
+    a, b: porosity = a + b * mud / 100
+    north_sea_value, transition: see porosity_blend.blend_porosity
+    """
+    wet = wet_cells(grid)
+    wadden_porosity = a + b * wadden["mud"] / 100.0
+    porosity = blend_porosity(wadden_porosity, north_sea["porosity"], wet, transition,
+                              cell_size(grid["lon"], grid["lat"]), north_sea_value)
+    return {"porosity": porosity, "wadden_porosity": wadden_porosity}
+
+
+# =========================
+# Output files
+# =========================
+
+def _up_to_date(fname, key):
+    """
+    True if fname exists and was written from the stage result with this key
+    """
+    if not os.path.exists(fname):
+        return False
+    with Dataset(fname, "r") as nc:
+        return getattr(nc, "pipeline_key", None) == key
+
+
+def _create(fname, lon, lat, key, title):
+    nc = Dataset(fname, "w", format="NETCDF4")
+    nc.createDimension("xc", lon.shape[0])
+    nc.createDimension("yc", lon.shape[1])
+    lon_var = nc.createVariable("lonc", "f4", ("xc", "yc"), fill_value=1e20)
+    lat_var = nc.createVariable("latc", "f4", ("xc", "yc"), fill_value=1e20)
+    lon_var.units = "degree_east"
+    lat_var.units = "degree_north"
+    lon_var[:] = lon
+    lat_var[:] = lat
+    nc.type = title
+    nc.gridid = "North Sea and Wadden Sea"
+    nc.history = "Created: " + datetime.now().strftime("%Y-%m-%d %H:%M")
+    nc.pipeline_key = key
+    return nc
+
+
+def _put(nc, wet, name, values, units, long_name, dtype="f4"):
+    """
+    Write a wet cell field, expanded to the dense grid (land and missing values FILL_VALUE)
+    """
+    var = nc.createVariable(name, dtype, ("xc", "yc"), fill_value=FILL_VALUE if dtype == "f4" else None)
+    var.units = units
+    var.long_name = long_name
+    if dtype == "f4":
+        var[:] = wet.expand(np.where(np.isfinite(values), values, FILL_VALUE), fill=FILL_VALUE)
+    else:
+        var[:] = wet.expand(values, fill=0)
+
+
+def write_mud_fraction(fname, grid, wadden, blend, key):
+    """
+    sediment_mud_fraction.nc: lonc, latc, mud_fraction, porosity (and coverage, count)
+    """
+    wet = wet_cells(grid)
+    with _create(fname, grid["lon"], grid["lat"], key, "Sediment mud fraction file for GETM") as nc:
+        _put(nc, wet, "mud_fraction", wadden["mud"], "percent", "sediment mud content (%)")
+        _put(nc, wet, "porosity", blend["wadden_porosity"], "1", "sediment porosity (0-1)")
+        if "coverage" in wadden:
+            _put(nc, wet, "mud_fraction_coverage", wadden["coverage"], "1",
+                 "fraction of the cell covered by valid raster pixels")
+            _put(nc, wet, "mud_fraction_count", wadden["count"], "1",
+                 "number of valid raster pixels in the cell", dtype="i4")
+
+
+def write_ben_sedprop(fname, grid, blend, key):
+    """
+    Ben_Sedprop.nc: lonc, latc, porosity on the GETM grid
+    """
+    wet = wet_cells(grid)
+    with _create(fname, grid["lon"], grid["lat"], key, "Merged Wadden Sea + North Sea porosity") as nc:
+        _put(nc, wet, "porosity", blend["porosity"], "1", "sediment porosity (0-1)")
+
+
+# =========================
+# Pipeline
+# =========================
+
+def run_pipeline(topo_nc, silt_tif, ben_nc, out_dir, method="nearest", a=POROSITY_A,
+                 b=POROSITY_B, north_sea_value=None, transition=0.0, north_sea_method="nearest",
+                 cache_dir=None, verbose=True):
+    """
+    Run the stages that are out of date and write the output files
+    topo_nc: GETM topo file (lonc, latc, bathymetry)
+    silt_tif: Wadden Sea silt raster
+    ben_nc: North Sea Ben_Sedprop.nc (regular lon/lat, Porosity)
+    out_dir: directory of sediment_mud_fraction.nc and Ben_Sedprop.nc
+    method: see wadden_stage
+    a, b, north_sea_value, transition: see blend_stage
+    north_sea_method: see north_sea_stage
+    cache_dir: stage cache; default .grid_cache in out_dir
+    Returns the dict of stage results.
+    """
+    mud_nc = os.path.join(out_dir, "sediment_mud_fraction.nc")
+    sedprop_nc = os.path.join(out_dir, "Ben_Sedprop.nc")
+    if os.path.exists(sedprop_nc) and os.path.samefile(sedprop_nc, ben_nc):
+        raise ValueError("the output %s would overwrite the North Sea input" % sedprop_nc)
+    if cache_dir is None:
+        cache_dir = os.path.join(out_dir, ".grid_cache")
+
+    keys = {}
+    results = {}
+    keys["grid"] = stage_key("grid", [topo_nc], params={"land_value": LAND_VALUE})
+    results["grid"] = memo(cache_dir, "grid", keys["grid"], lambda: grid_stage(topo_nc), verbose)
+
+    keys["wadden"] = stage_key("wadden", [silt_tif], [keys["grid"]], {"method": method})
+    results["wadden"] = memo(cache_dir, "wadden", keys["wadden"],
+                             lambda: wadden_stage(results["grid"], silt_tif, method), verbose)
+
+    keys["north_sea"] = stage_key("north_sea", [ben_nc], [keys["grid"]], {"method": north_sea_method})
+    results["north_sea"] = memo(cache_dir, "north_sea", keys["north_sea"],
+                                lambda: north_sea_stage(results["grid"], ben_nc, north_sea_method),
+                                verbose)
+
+    blend_params = {"a": a, "b": b, "north_sea_value": north_sea_value, "transition": transition}
+    keys["blend"] = stage_key("blend", (), [keys["grid"], keys["wadden"], keys["north_sea"]],
+                              blend_params)
+    results["blend"] = memo(cache_dir, "blend", keys["blend"],
+                            lambda: blend_stage(results["grid"], results["wadden"], results["north_sea"],
+                                                **blend_params), verbose)
+
+    os.makedirs(out_dir, exist_ok=True)
+    for fname, write in ((mud_nc, lambda: write_mud_fraction(mud_nc, results["grid"], results["wadden"],
+                                                             results["blend"], keys["blend"])),
+                         (sedprop_nc, lambda: write_ben_sedprop(sedprop_nc, results["grid"],
+                                                                results["blend"], keys["blend"]))):
+        if _up_to_date(fname, keys["blend"]):
+            if verbose:
+                print("up to date:", fname)
+            continue
+        write()
+        if verbose:
+            print("wrote:", fname)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sediment mud fraction and porosity files for GETM")
+    parser.add_argument("--topo", required=True, help="GETM topo file")
+    parser.add_argument("--silt", required=True, help="Wadden Sea silt raster (GeoTIFF)")
+    parser.add_argument("--north-sea", required=True, help="North Sea Ben_Sedprop.nc (lon/lat, Porosity)")
+    parser.add_argument("--out-dir", required=True, help="directory of the output files")
+    parser.add_argument("--method", default="nearest",
+                        choices=("nearest", "bilinear", "aggregate", "match_reprojection"),
+                        help="silt raster onto the grid (default: nearest)")
+    parser.add_argument("--a", type=float, default=POROSITY_A, help="porosity = a + b * mud / 100")
+    parser.add_argument("--b", type=float, default=POROSITY_B, help="porosity = a + b * mud / 100")
+    parser.add_argument("--north-sea-value", type=float, default=None,
+                        help="one porosity for all North Sea cells (e.g. 0.4011)")
+    parser.add_argument("--transition", type=float, default=0.0,
+                        help="width of the Wadden Sea / North Sea transition zone in meters")
+    parser.add_argument("--north-sea-method", default="nearest", choices=("nearest", "bilinear"),
+                        help="North Sea raster onto the grid (default: nearest)")
+    parser.add_argument("--cache-dir", default=None, help="stage cache (default: OUT_DIR/.grid_cache)")
+    args = parser.parse_args()
+    run_pipeline(args.topo, args.silt, args.north_sea, args.out_dir, args.method, args.a, args.b,
+                 args.north_sea_value, args.transition, args.north_sea_method, args.cache_dir)
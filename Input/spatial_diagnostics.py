@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# =========================
+# Spatial autocorrelation diagnostics of sample values (Moran's I, LISA)
+# =========================
+# Weights are sparse (scipy.sparse CSR, row standardised) and built from
+# projected coordinates in meters with a KD-tree: k nearest neighbours or a
+# distance band. The permutation tests are vectorised: a batch of
+# permutations is one sparse matrix product, batches can be spread over
+# worker processes, and every batch has its own seed derived from one seed,
+# so the results do not depend on the number of workers.
+# The statistics follow esda (Moran, Moran_Local): pseudo p-values are
+# (larger + 1) / (permutations + 1), folded to the smaller tail.
+import multiprocessing
+from collections import namedtuple
+import numpy as np
+from scipy import sparse
+from scipy.spatial import cKDTree
+
+# memory budget of one batch of permutations (bytes)
+BATCH_BYTES = 256 * 1024**2
+
+MoranResult = namedtuple("MoranResult", "I EI EI_sim z_sim p_sim permutations")
+LocalMoranResult = namedtuple("LocalMoranResult", "Is q p_sim permutations")
+
+
+def knn_weights(xy, k=5):
+    """
+    Row-standardised k nearest neighbour weights
+    xy: (N,2) array of coordinates in meters
+    k: number of neighbours
+    Returns an (N,N) CSR matrix.
+    """
+    xy = np.asarray(xy, dtype=float)
+    n = len(xy)
+    dist, idx = cKDTree(xy).query(xy, k=k + 1, workers=-1)
+    # drop the point itself (also when duplicates make it not come first)
+    others = idx != np.arange(n)[:, None]
+    keep = np.cumsum(others, axis=1) <= k
+    cols = idx[others & keep].reshape(n, k)
+    rows = np.repeat(np.arange(n), k)
+    return sparse.csr_matrix((np.full(n * k, 1.0 / k), (rows, cols.ravel())), shape=(n, n))
+
+
+def distance_band_weights(xy, threshold, binary=True):
+    """
+    Row-standardised distance band weights
+    xy: (N,2) array of coordinates in meters
+    threshold: neighbours are the points within this distance (meters)
+    binary: equal weights; False: inverse distance weights
+    Returns an (N,N) CSR matrix; islands (no neighbour) have an empty row.
+    """
+    xy = np.asarray(xy, dtype=float)
+    tree = cKDTree(xy)
+    pairs = tree.query_pairs(threshold, output_type="ndarray")
+    rows = np.concatenate((pairs[:, 0], pairs[:, 1]))
+    cols = np.concatenate((pairs[:, 1], pairs[:, 0]))
+    if binary:
+        data = np.ones(len(rows))
+    else:
+        data = 1.0 / np.maximum(np.hypot(*(xy[rows] - xy[cols]).T), 1e-12)
+    w = sparse.csr_matrix((data, (rows, cols)), shape=(len(xy), len(xy)))
+    rowsum = np.asarray(w.sum(axis=1)).ravel()
+    islands = np.sum(rowsum == 0)
+    if islands:
+        print("WARNING: %d samples without neighbours within %g m" % (islands, threshold))
+    return sparse.diags(np.where(rowsum > 0, 1.0 / np.where(rowsum > 0, rowsum, 1), 0.0)) @ w
+
+
+def _batch_size(n, permutations, itemsize=8, copies=3):
+    return int(max(1, min(permutations, BATCH_BYTES // max(1, n * itemsize * copies))))
+
+
+def _moran_batch(z, w, nperm, seed):
+    """
+    Moran's I of nperm permutations of z; returns (nperm,) array
+    """
+    rng = np.random.default_rng(seed)
+    zp = rng.permuted(np.broadcast_to(z, (nperm, len(z))), axis=1).T    # (N, nperm)
+    return len(z) / w.sum() * np.sum(zp * (w @ zp), axis=0) / np.dot(z, z)
+
+
+def morans_i(values, w, permutations=999, seed=None, workers=1):
+    """
+    Global Moran's I with a permutation test
+    values: (N,) sample values
+    w: (N,N) sparse weights (e.g. knn_weights)
+    permutations: number of random permutations (0: none)
+    seed: seed of the random generator, for reproducible p-values
+    workers: number of processes for the permutation batches
+    Returns a MoranResult (I, EI, EI_sim, z_sim, p_sim, permutations).
+    """
+    y = np.asarray(values, dtype=float)
+    z = y - y.mean()
+    n = len(z)
+    w = sparse.csr_matrix(w)
+    moran = n / w.sum() * np.dot(z, w @ z) / np.dot(z, z)
+    ei = -1.0 / (n - 1)
+    if not permutations:
+        return MoranResult(moran, ei, np.nan, np.nan, np.nan, 0)
+
+    batch = _batch_size(n, permutations)
+    sizes = [min(batch, permutations - start) for start in range(0, permutations, batch)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(z, w, size, s) for size, s in zip(sizes, seeds)]
+    if workers > 1:
+        with multiprocessing.Pool(workers) as pool:
+            sim = np.concatenate(pool.starmap(_moran_batch, tasks))
+    else:
+        sim = np.concatenate([_moran_batch(*task) for task in tasks])
+
+    larger = np.sum(sim >= moran)
+    if permutations - larger < larger:
+        larger = permutations - larger
+    p_sim = (larger + 1.0) / (permutations + 1.0)
+    z_sim = (moran - sim.mean()) / sim.std()
+    return MoranResult(moran, ei, sim.mean(), z_sim, p_sim, permutations)
+
+
+def _local_batch(rows, z, indptr, weights, permutations, seed, Is):
+    """
+    Conditional randomisation for the samples in rows: the neighbours of sample i
+    are replaced by random other samples (drawn with replacement, which is
+    negligible when N is much larger than the number of neighbours).
+    Returns the number of simulated values >= the observed one, per row.
+    """
+    rng = np.random.default_rng(seed)
+    n = len(z)
+    m2 = np.dot(z, z) / n
+    card = indptr[rows + 1] - indptr[rows]
+    larger = np.zeros(len(rows), dtype=np.int64)
+    # samples with the same number of neighbours are simulated together
+    for c in np.unique(card[card > 0]):
+        sel = np.flatnonzero(card == c)
+        i = rows[sel]
+        wi = weights[indptr[i][:, None] + np.arange(c)]                # (S, c)
+        draw = rng.integers(0, n - 1, size=(len(i), permutations, c))
+        draw += draw >= i[:, None, None]                               # never the sample itself
+        sim = z[i][:, None] * np.einsum("spc,sc->sp", z[draw], wi) / m2
+        larger[sel] = np.sum(sim >= Is[i][:, None], axis=1)
+    return larger
+
+
+def local_moran(values, w, permutations=999, seed=None, workers=1, chunk=1000):
+    """
+    Local Moran's I (LISA) per sample with conditional permutation p-values
+    values: (N,) sample values
+    w: (N,N) sparse row-standardised weights
+    permutations: number of random permutations per sample
+    seed: seed of the random generator
+    workers: number of processes; the samples are split in chunks
+    chunk: samples per task
+    Returns a LocalMoranResult: Is (N,), q (N,) quadrant (1 HH, 2 LH, 3 LL, 4 HL),
+    p_sim (N,) pseudo p-values, NaN for samples without neighbours.
+    """
+    y = np.asarray(values, dtype=float)
+    z = y - y.mean()
+    n = len(z)
+    w = sparse.csr_matrix(w)
+    lag = w @ z
+    m2 = np.dot(z, z) / n
+    Is = z * lag / m2
+    q = np.where(z > 0, np.where(lag > 0, 1, 4), np.where(lag > 0, 2, 3))
+
+    chunks = [np.arange(start, min(start + chunk, n)) for start in range(0, n, chunk)]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+    tasks = [(rows, z, w.indptr, w.data, permutations, s, Is) for rows, s in zip(chunks, seeds)]
+    if workers > 1:
+        with multiprocessing.Pool(workers) as pool:
+            larger = np.concatenate(pool.starmap(_local_batch, tasks))
+    else:
+        larger = np.concatenate([_local_batch(*task) for task in tasks])
+    larger = np.minimum(larger, permutations - larger)
+    p_sim = (larger + 1.0) / (permutations + 1.0)
+    p_sim[np.diff(w.indptr) == 0] = np.nan     # islands
+    return LocalMoranResult(Is, q, p_sim, permutations)
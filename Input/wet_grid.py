@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# =========================
+# Wet cells of the GETM grid as compact 1D arrays
+# =========================
+# A large part of the dws_200m grid is land. A WetGrid keeps only the wet
+# cells: the flat (row-major) index of each wet cell in the dense grid, its
+# (i, j) and 1D arrays of the cell fields (lon, lat, x, y, bathymetry, ...).
+# Interpolation and conversions work on the 1D arrays; a field is expanded
+# to the dense grid (land filled) only when it is written or plotted.
+import numpy as np
+from grid_geometry import load_grid_geometry, UTM31N, LAND_VALUE
+
+
+class WetGrid:
+    """
+    Wet cells of a 2D grid
+    shape: shape of the dense grid
+    index: (n,) flat indices of the wet cells in the dense grid, increasing
+    i, j: (n,) indices of the wet cells along the first and second dimension
+    fields: names of the 1D cell fields, each also an attribute (e.g. wet.lon)
+    """
+
+    def __init__(self, shape, index, **fields):
+        self.shape = tuple(int(n) for n in shape)
+        self.index = np.asarray(index, dtype=np.int64)
+        self.i, self.j = np.unravel_index(self.index, self.shape)
+        self.fields = []
+        for name, values in fields.items():
+            self.add(name, values)
+
+    @classmethod
+    def from_mask(cls, land_mask, **dense_fields):
+        """
+        WetGrid of the cells where land_mask is False, with the given 2D fields compressed
+        """
+        land_mask = np.asarray(land_mask, dtype=bool)
+        wet = cls(land_mask.shape, np.flatnonzero(~land_mask.ravel()))
+        for name, values in dense_fields.items():
+            wet.add(name, wet.compress(values))
+        return wet
+
+    def add(self, name, values):
+        """
+        Add a 1D cell field (length of the wet cells)
+        """
+        values = np.asarray(values)
+        if values.shape != (self.size,):
+            raise ValueError("field %s has shape %s, expected (%d,)" % (name, values.shape, self.size))
+        if name not in self.fields:
+            self.fields.append(name)
+        setattr(self, name, values)
+
+    @property
+    def size(self):
+        """number of wet cells"""
+        return len(self.index)
+
+    @property
+    def mask(self):
+        """dense bool array, True for wet cells"""
+        mask = np.zeros(self.shape, dtype=bool)
+        mask.flat[self.index] = True
+        return mask
+
+    @property
+    def xy(self):
+        """(n,2) projected coordinates of the wet cells"""
+        return np.column_stack((self.x, self.y))
+
+    def compress(self, dense):
+        """
+        1D values of the wet cells of a dense 2D field
+        """
+        dense = np.asarray(dense)
+        if dense.shape != self.shape:
+            raise ValueError("field has shape %s, the grid %s" % (dense.shape, self.shape))
+        return dense.ravel()[self.index]
+
+    def expand(self, values, fill=np.nan, dtype=None):
+        """
+        Dense 2D field of 1D wet cell values, land cells set to fill
+        """
+        values = np.asarray(values)
+        dense = np.full(int(np.prod(self.shape)), fill, dtype=dtype or np.result_type(values, type(fill)))
+        dense[self.index] = values
+        return dense.reshape(self.shape)
+
+
+def wet_grid(geometry):
+    """
+    WetGrid of a GridGeometry, with lon, lat, x, y and bathymetry
+    """
+    return WetGrid.from_mask(geometry.land_mask, lon=geometry.lon, lat=geometry.lat,
+                             x=geometry.x, y=geometry.y, bathymetry=geometry.bathymetry)
+
+
+def load_wet_grid(topo_nc, crs=UTM31N, cache_dir=None, land_value=LAND_VALUE, verbose=True):
+    """
+    WetGrid of a topo file; the projected geometry comes from the grid geometry cache
+    (see grid_geometry.load_grid_geometry for the arguments)
+    """
+    return wet_grid(load_grid_geometry(topo_nc, crs, cache_dir, land_value, verbose))
@@ -0,0 +1,336 @@
+#! /usr/bin/env python
+
+# post-mortem index of the logs of a GETM run (log/<setup>/<conf>/<date>/)
+#
+# The <runid>.NNNN.stderr files of all ranks are parsed in parallel into one
+# small JSON file in the run directory (log_index.json). Per rank it holds
+#   - the host, the last micro time step n and the model time it stands for
+#     (time reference + n * time step, from the header of the log)
+#   - the number of findnan reports, the first one (line, step, message) and
+#     the NaN events of the state variables: ppState,jout, where it was
+#     detected and the variable of the rate ('in rate R3c layer')
+#   - the FATAL GETM ERROR message ('Called from CalculateSet') and its line
+#   - the offset of the tile from the 'id =' line, and with the
+#     subdomain_spec.lst of the run the tile (i0, i1, j0, j1; 0-based, half open)
+# log.run adds the rank and error code of MPI_ABORT.
+# Indexing again only parses the logs that changed (size or time stamp), so
+# it can also be run on a directory of a run that is still going. Queries
+# read the index files only and go across any number of runs.
+# Usage:
+#   python getm_log_index.py index log/dws_200m/32x32/20150101 \
+#       --spec dws_200m/Configurations/32x32/dws_200m.mask.size0032x0032_offset+0000x-0010_nodes006.subdomain_spec.lst
+#   python getm_log_index.py query log/dws_200m
+#   python getm_log_index.py query log/dws_200m --state 44 --json
+
+import argparse
+import bisect
+import json
+import os
+import re
+import sys
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+
+from getm_subdomains import read_subdomain_spec
+
+# index file in each run directory
+INDEX = 'log_index.json'
+
+# bump when the content of the rank entries changes: all logs are parsed again
+VERSION = 1
+
+RANK_LOG = re.compile(r'^(.+)\.(\d{4})\.stderr$')
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+PROCESS = re.compile(rb'Process\s+(\d+)\s+of\s+(\d+)\s+is alive on (\S+)')
+STARTED = re.compile(rb'getm: Started on\s+(\d{8} \d{6})')
+TIME_STEP = re.compile(rb'Time step:\s+([-+.0-9EeDd]+)')
+TIME_REF = re.compile(rb'using "([^"]+)" as time reference')
+START = re.compile(rb'^\s+Start:\s+(\S+ \S+)', re.M)
+STOP = re.compile(rb'^\s+Stop:\s+(\S+ \S+)', re.M)
+ID = re.compile(rb'^ id =\s+(-?\d+)\s+(-?\d+)\s+(-?\d+)\s+(-?\d+)\s+(-?\d+)', re.M)
+STEP = re.compile(rb'^\s+(\d\d:\d\d:\d\d\.\d+) n=\s*(\d+)', re.M)
+FINDNAN = re.compile(rb'findnan case:[^\n]*\n([^\n]*)')
+PPSTATE = re.compile(rb'ppState,jout\s+(-?\d+)\s+(-?\d+)[^\n]*\n([^\n]*)\n(?:in rate (\S+) layer)?')
+FATAL = re.compile(rb'FATAL GETM ERROR: *([^\n]*?) *$', re.M)
+ABORT = re.compile(r'MPI_ABORT was invoked on rank (\d+)[^\n]*\s*with errorcode (-?\d+)')
+
+
+class _Lines(object):
+    """
+    Line numbers (1-based) of increasing byte positions in a text
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+        self.line = 1
+
+    def __call__(self, pos):
+        self.line += self.data.count(b'\n', self.pos, pos)
+        self.pos = pos
+        return self.line
+
+
+def _text(value):
+    return value.decode('ascii', 'replace').strip()
+
+
+def _first(regex, data, default=None):
+    match = regex.search(data)
+    return match.groups() if match else default
+
+
+def parse_rank_log(fname):
+    """
+    Parse the stderr log of one rank. Returns the rank entry of the index (a dict).
+    """
+    with open(fname, 'rb') as f:
+        data = f.read()
+    stat = os.stat(fname)
+    entry = {'file': os.path.basename(fname), 'size': stat.st_size, 'mtime': stat.st_mtime,
+             'rank': int(RANK_LOG.match(os.path.basename(fname)).group(2))}
+
+    process = _first(PROCESS, data)
+    entry['host'] = _text(process[2]) if process else None
+    started = _first(STARTED, data)
+    entry['started'] = datetime.strptime(_text(started[0]), '%Y%m%d %H%M%S').isoformat() if started else None
+    # 'id = <rank> <coordinates> <ioff> <joff>'
+    ident = _first(ID, data)
+    entry['offset'] = [int(ident[3]), int(ident[4])] if ident else None
+    entry['tile'] = None
+
+    dt = _first(TIME_STEP, data)
+    ref = _first(TIME_REF, data)
+    dt = float(dt[0].replace(b'D', b'E').replace(b'd', b'e')) if dt else None
+    ref = datetime.strptime(_text(ref[0]), TIME_FORMAT) if ref else None
+    for key, regex in (('start', START), ('stop', STOP)):
+        value = _first(regex, data)
+        entry[key] = _text(value[0]) if value else None
+
+    def model_time(step):
+        if step is None or dt is None or ref is None:
+            return None
+        return (ref + timedelta(seconds=step*dt)).strftime(TIME_FORMAT)
+
+    # progress lines 'hh:mm:ss.sss n= <step>', with their positions
+    steps = [(m.start(), int(m.group(2)), _text(m.group(1))) for m in STEP.finditer(data)]
+    positions = [s[0] for s in steps]
+
+    def step_before(pos):
+        k = bisect.bisect_left(positions, pos)
+        return steps[k-1][1] if k > 0 else None
+
+    entry['last_step'] = steps[-1][1] if steps else None
+    entry['last_wall'] = steps[-1][2] if steps else None
+    entry['last_time'] = model_time(entry['last_step'])
+
+    lines = _Lines(data)
+    nans = list(FINDNAN.finditer(data))
+    entry['nan_count'] = len(nans)
+    entry['first_nan'] = None
+    if nans:
+        pos = nans[0].start()
+        step = step_before(pos)
+        entry['first_nan'] = {'line': lines(pos), 'step': step, 'time': model_time(step),
+                              'message': _text(nans[0].group(1))}
+    # [line, ppState, jout, where, variable]
+    entry['nan_events'] = [[lines(m.start()), int(m.group(1)), int(m.group(2)), _text(m.group(3)),
+                            _text(m.group(4)) if m.group(4) else None] for m in PPSTATE.finditer(data)]
+
+    entry['fatal'] = None
+    messages = [m for m in FATAL.finditer(data)]
+    if messages:
+        text = [_text(m.group(1)) for m in messages if m.group(1).strip()]
+        entry['fatal'] = {'line': _Lines(data)(messages[0].start()),
+                          'message': '; '.join(text), 'step': step_before(messages[0].start())}
+    return entry
+
+
+def read_abort(fname):
+    """
+    Rank and error code of the MPI_ABORT in a log.run file, or None
+    """
+    if not os.path.exists(fname):
+        return None
+    with open(fname, errors='replace') as f:
+        match = ABORT.search(f.read())
+    return {'rank': int(match.group(1)), 'errorcode': int(match.group(2))} if match else None
+
+
+def rank_logs(run_dir):
+    """
+    The rank stderr logs of a run directory, sorted by rank
+    """
+    names = [name for name in os.listdir(run_dir) if RANK_LOG.match(name)]
+    return sorted(names, key=lambda name: int(RANK_LOG.match(name).group(2)))
+
+
+def load_index(run_dir):
+    """
+    The index of a run directory (a dict), or None if there is none
+    """
+    fname = os.path.join(run_dir, INDEX)
+    if not os.path.exists(fname):
+        return None
+    with open(fname) as f:
+        return json.load(f)
+
+
+def build_index(run_dir, spec_file=None, workers=None, verbose=True):
+    """
+    Index the logs of a run directory and write it to <run_dir>/log_index.json.
+    Logs of the existing index with the same size and time stamp are not parsed again.
+    spec_file: subdomain_spec.lst of the run (tiles); None: keep the one of the existing index
+    workers: number of processes (default: all cores)
+    Returns the index.
+    """
+    old = load_index(run_dir) or {}
+    known = {}
+    if old.get('version') == VERSION:
+        known = dict((entry['file'], entry) for entry in old['ranks'])
+    names = rank_logs(run_dir)
+    todo = []
+    entries = {}
+    for name in names:
+        stat = os.stat(os.path.join(run_dir, name))
+        entry = known.get(name)
+        if entry is not None and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+            entries[name] = entry
+        else:
+            todo.append(name)
+    if todo:
+        paths = [os.path.join(run_dir, name) for name in todo]
+        with Pool(min(workers or os.cpu_count(), len(paths))) as pool:
+            for entry in pool.imap_unordered(parse_rank_log, paths, chunksize=4):
+                entries[entry['file']] = entry
+    if verbose:
+        print('%s: %d rank logs, %d parsed' % (run_dir, len(names), len(todo)))
+
+    spec_file = spec_file or old.get('spec')
+    spec = read_subdomain_spec(spec_file) if spec_file else None
+    ranks = [entries[name] for name in names]
+    if spec is not None:
+        wrong = 0
+        for entry in ranks:
+            if entry['rank'] < spec.nranks:
+                entry['tile'] = [int(v) for v in spec.bounds(entry['rank'])]
+                if entry['offset'] is not None and entry['offset'] != entry['tile'][::2]:
+                    wrong += 1
+            else:
+                wrong += 1
+        if wrong:
+            print('%s: %d ranks do not match the tiles of %s' % (run_dir, wrong, spec_file))
+
+    index = {'version': VERSION,
+             'run_dir': os.path.abspath(run_dir),
+             'spec': os.path.abspath(spec_file) if spec_file else None,
+             'abort': read_abort(os.path.join(run_dir, 'log.run')),
+             'ranks': ranks}
+    fname = os.path.join(run_dir, INDEX)
+    tmp = fname + '.%d.tmp' % os.getpid()
+    with open(tmp, 'w') as f:
+        json.dump(index, f, separators=(',', ':'))
+    os.replace(tmp, fname)
+    return index
+
+
+def find_indexes(paths):
+    """
+    Run directories with an index below the given directories
+    """
+    found = []
+    for path in paths:
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            if INDEX in files:
+                found.append(root)
+    return found
+
+
+def _order(entry):
+    first = entry['first_nan']
+    step = first['step'] if first and first['step'] is not None else sys.maxsize
+    return step, first['line'] if first else 0, entry['rank']
+
+
+def failing_ranks(index, state=None, variable=None):
+    """
+    Ranks with NaN reports or a fatal error, the first to fail first (by the step of the first NaN)
+    state, variable: only ranks with a NaN event of this ppState index / rate variable
+    """
+    ranks = []
+    for entry in index['ranks']:
+        if not (entry['nan_count'] or entry['fatal']):
+            continue
+        events = entry['nan_events']
+        if state is not None and not any(e[1] == state for e in events):
+            continue
+        if variable is not None and not any(e[4] == variable for e in events):
+            continue
+        ranks.append(entry)
+    return sorted(ranks, key=_order)
+
+
+def summary(index, state=None, variable=None):
+    """
+    Short summary of a run for a query (a dict)
+    """
+    ranks = index['ranks']
+    steps = [e['last_step'] for e in ranks if e['last_step'] is not None]
+    failing = failing_ranks(index, state, variable)
+    return {'run_dir': index['run_dir'],
+            'ranks': len(ranks),
+            'abort': index['abort'],
+            'last_step': [min(steps), max(steps)] if steps else None,
+            'last_time': max((e['last_time'] for e in ranks if e['last_time']), default=None),
+            'fatal': [{'rank': e['rank'], 'host': e['host'], 'tile': e['tile'] or e['offset'], **e['fatal']}
+                      for e in ranks if e['fatal']],
+            'failing': [{'rank': e['rank'], 'host': e['host'], 'tile': e['tile'] or e['offset'],
+                         'nan_count': e['nan_count'], 'first_nan': e['first_nan'],
+                         'states': sorted(set((ev[1], ev[4]) for ev in e['nan_events']),
+                                          key=lambda s: s[0])}
+                        for e in failing]}
+
+
+def print_summary(s):
+    print(s['run_dir'])
+    print('  ranks: %d, last step %s, model time %s' % (s['ranks'], s['last_step'], s['last_time']))
+    if s['abort']:
+        print('  MPI_ABORT on rank %(rank)d, error code %(errorcode)d' % s['abort'])
+    for f in s['fatal']:
+        print('  FATAL rank %d (%s) tile %s line %d: %s' % (f['rank'], f['host'], f['tile'], f['line'],
+                                                           f['message']))
+    for f in s['failing']:
+        first = f['first_nan'] or {}
+        states = ' '.join('%d:%s' % state for state in f['states'])
+        print('  rank %4d tile %-22s %5d findnan, first at step %s (%s) line %s  ppState %s'
+              % (f['rank'], f['tile'], f['nan_count'], first.get('step'), first.get('time'),
+                 first.get('line'), states or '-'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Index and query the per-rank GETM stderr logs')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('index', help='(re)index run directories')
+    p.add_argument('run_dirs', nargs='+', help='run directories with <runid>.NNNN.stderr files')
+    p.add_argument('--spec', help='subdomain_spec.lst of the runs (tile offsets)')
+    p.add_argument('--workers', type=int, default=None, help='number of processes (default: all cores)')
+    p = sub.add_parser('query', help='failing ranks of the indexed runs below directories')
+    p.add_argument('paths', nargs='+', help='run directories or directories above them')
+    p.add_argument('--state', type=int, default=None, help='only ranks with a NaN of this ppState index')
+    p.add_argument('--var', default=None, help='only ranks with a NaN in the rate of this variable')
+    p.add_argument('--json', action='store_true', help='print JSON')
+    args = parser.parse_args()
+
+    if args.command == 'index':
+        for run_dir in args.run_dirs:
+            print_summary(summary(build_index(run_dir, args.spec, args.workers)))
+    else:
+        result = [summary(load_index(run_dir), args.state, args.var) for run_dir in find_indexes(args.paths)]
+        if args.json:
+            json.dump(result, sys.stdout, indent=1)
+            print()
+        else:
+            for s in result:
+                print_summary(s)
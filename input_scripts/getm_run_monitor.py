@@ -0,0 +1,275 @@
+#! /usr/bin/env python
+
+# throughput monitor of a running GETM model (see dws_200m/run.getm_laplace_getmiow)
+#
+# The rank 0 stderr log (<runid>.0000.stderr) and log.run are tailed: every
+# update only reads what was appended since the last one (the read offsets
+# are kept in the status file, so the monitor can also be started again or
+# be run from cron with --once). From the progress lines of GETM
+#     16:37:38.905 n=    39441700
+# and the header (time step, time reference, start step (MinN), number of
+# steps) it derives the model time against the wall time and writes
+#   <out>      JSON status, replaced atomically at every update: state
+#              (starting, running, stalled, finished, aborted), last step and
+#              model time, progress, model days per wall hour over the whole
+#              run and per segment of --segment wall seconds, estimated end
+#   <out>.tsv  the time series, one line per progress line (appended):
+#              wall time (epoch s), step, model time
+# A run is stalled when no progress line came for --stall seconds (default
+# 10 times the median interval of the progress lines, at least 2 minutes).
+# It is aborted on a FATAL GETM ERROR or an MPI_ABORT, finished on the
+# 'Finished on' line or the last step.
+# The exit status of --once is 0 while the run is fine, 1 when it stalled
+# or aborted.
+# Usage:
+#   python getm_run_monitor.py dws_200m.0000.stderr $logdir/log.run --out $logdir/run_monitor.json &
+#   python getm_run_monitor.py dws_200m.0000.stderr $logdir/log.run --out $logdir/run_monitor.json --once
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from datetime import datetime, timedelta
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# number of segments kept in the status file
+SEGMENTS = 48
+
+STARTED = re.compile(r'getm: Started on\s+(\d{8}) (\d{6})')
+TIME_STEP = re.compile(r'Time step:\s+([-+.0-9EeDd]+)')
+TIME_REF = re.compile(r'using "([^"]+)" as time reference')
+NSTEPS = re.compile(r'==>\s+(\d+)\s+micro time steps')
+MIN_N = re.compile(r'MinN adjusted to\s+(\d+)')
+STEP = re.compile(r'^\s+(\d\d):(\d\d):(\d\d(?:\.\d+)?) n=\s*(\d+)\s*$')
+FINISHED = re.compile(r'Finished on')
+FATAL = re.compile(r'FATAL GETM ERROR')
+ABORT = re.compile(r'MPI_ABORT was invoked on rank (\d+)')
+
+
+class Tail(object):
+    """
+    Complete lines appended to a file since the last call. A file that got
+    shorter or was replaced (other inode) is read again from the start.
+    """
+
+    def __init__(self, path, offset=0, inode=None):
+        self.path = path
+        self.offset = offset
+        self.inode = inode
+
+    def lines(self):
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return []
+        with f:
+            stat = os.fstat(f.fileno())
+            if stat.st_ino != self.inode or stat.st_size < self.offset:
+                self.offset = 0
+                self.inode = stat.st_ino
+            f.seek(self.offset)
+            data = f.read()
+        end = data.rfind(b'\n') + 1
+        self.offset += end
+        return data[:end].decode('ascii', 'replace').splitlines()
+
+    def state(self):
+        return {'path': self.path, 'offset': self.offset, 'inode': self.inode}
+
+
+def _median(values):
+    values = sorted(values)
+    return values[len(values)//2] if values else None
+
+
+def _rate(dstep, dwall, dt):
+    """model days per wall hour"""
+    if dwall <= 0 or dt is None:
+        return None
+    return dstep * dt / 86400. / (dwall / 3600.)
+
+
+class RunMonitor(object):
+    """
+    Progress of a GETM run from its rank 0 log and log.run.
+    status: the dict written to the status file
+    """
+
+    def __init__(self, stderr, log_run, out, segment=900., stall=None):
+        self.out = out
+        self.segment = segment
+        self.stall = stall
+        status = {}
+        if os.path.exists(out):
+            with open(out) as f:
+                status = json.load(f)
+            if status.get('tail', {}).get('stderr', {}).get('path') != os.path.abspath(stderr):
+                status = {}
+        tail = status.get('tail', {})
+        self.stderr = Tail(os.path.abspath(stderr), **_tail_args(tail.get('stderr')))
+        self.log_run = Tail(os.path.abspath(log_run), **_tail_args(tail.get('log_run'))) if log_run else None
+        self.status = status or {'state': 'starting', 'header': {}, 'first': None, 'last': None,
+                                 'intervals': [], 'segments': [], 'problem': None}
+
+    def _wall(self, hh, mm, ss):
+        """epoch seconds of a progress line clock time, on the day of the previous line"""
+        header = self.status['header']
+        last = self.status['last']
+        if last is not None:
+            day = datetime.fromtimestamp(last['wall']).replace(hour=0, minute=0, second=0, microsecond=0)
+        elif 'started' in header:
+            day = datetime.strptime(header['started'][:10], '%Y-%m-%d')
+        else:
+            day = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        wall = (day + timedelta(hours=int(hh), minutes=int(mm), seconds=float(ss))).timestamp()
+        # past midnight
+        if last is not None and wall < last['wall'] - 43200:
+            wall += 86400
+        return wall
+
+    def _model_time(self, step):
+        header = self.status['header']
+        if 'ref' not in header or 'dt' not in header:
+            return None
+        ref = datetime.strptime(header['ref'], TIME_FORMAT)
+        return (ref + timedelta(seconds=step*header['dt'])).strftime(TIME_FORMAT)
+
+    def _header(self, line):
+        header = self.status['header']
+        for key, regex in (('dt', TIME_STEP), ('ref', TIME_REF), ('nsteps', NSTEPS), ('min_n', MIN_N)):
+            if key not in header:
+                match = regex.search(line)
+                if match:
+                    value = match.group(1)
+                    header[key] = (float(value.replace('D', 'E').replace('d', 'e')) if key == 'dt' else
+                                   value if key == 'ref' else int(value))
+        if 'started' not in header:
+            match = STARTED.search(line)
+            if match:
+                header['started'] = datetime.strptime(' '.join(match.groups()),
+                                                      '%Y%m%d %H%M%S').strftime(TIME_FORMAT)
+
+    def _progress(self, wall, step, rows):
+        s = self.status
+        sample = {'wall': wall, 'step': step}
+        if s['first'] is None:
+            s['first'] = sample
+        elif s['last'] is not None and step > s['last']['step']:
+            s['intervals'] = (s['intervals'] + [wall - s['last']['wall']])[-100:]
+        seg = s['segments'][-1] if s['segments'] else None
+        if seg is None or wall - seg['wall'][0] >= self.segment:
+            start = s['last'] or sample
+            seg = {'wall': [start['wall'], wall], 'step': [start['step'], step]}
+            s['segments'] = (s['segments'] + [seg])[-SEGMENTS:]
+        else:
+            seg['wall'][1] = wall
+            seg['step'][1] = step
+        seg['model_days_per_hour'] = _rate(seg['step'][1] - seg['step'][0], seg['wall'][1] - seg['wall'][0],
+                                           s['header'].get('dt'))
+        s['last'] = sample
+        rows.append('%.3f\t%d\t%s\n' % (wall, step, self._model_time(step)))
+
+    def update(self, now=None):
+        """
+        Read the new lines, update the status and write the status and time series files.
+        Returns the status.
+        """
+        s = self.status
+        now = time.time() if now is None else now
+        rows = []
+        for line in self.stderr.lines():
+            match = STEP.match(line)
+            if match:
+                hh, mm, ss, step = match.groups()
+                self._progress(self._wall(hh, mm, ss), int(step), rows)
+            elif FATAL.search(line):
+                s['state'] = 'aborted'
+                s['problem'] = s['problem'] or line.strip()
+            elif FINISHED.search(line):
+                s['state'] = 'finished'
+            elif s['last'] is None:
+                self._header(line)
+        for line in self.log_run.lines() if self.log_run else []:
+            match = ABORT.search(line)
+            if match:
+                s['state'] = 'aborted'
+                s['problem'] = line.strip()
+
+        header = s['header']
+        last = s['last']
+        if last is not None:
+            first = s['first']
+            start = header.get('min_n', first['step'])
+            stop = header.get('nsteps')
+            last['model_time'] = self._model_time(last['step'])
+            s['model_days_per_hour'] = _rate(last['step'] - first['step'], last['wall'] - first['wall'],
+                                             header.get('dt'))
+            if stop and stop > start:
+                s['progress'] = (last['step'] - start) / float(stop - start)
+            recent = s['segments'][-1]
+            dstep = recent['step'][1] - recent['step'][0]
+            if stop and dstep > 0 and recent['wall'][1] > recent['wall'][0]:
+                rest = (stop - last['step']) * (recent['wall'][1] - recent['wall'][0]) / dstep
+                s['eta'] = datetime.fromtimestamp(last['wall'] + rest).strftime(TIME_FORMAT)
+            if stop and last['step'] >= stop and s['state'] != 'aborted':
+                s['state'] = 'finished'
+        if s['state'] in ('starting', 'running', 'stalled') and last is not None:
+            limit = self.stall or max(120., 10 * (_median(s['intervals']) or 12.))
+            s['stall_limit'] = limit
+            s['state'] = 'stalled' if now - last['wall'] > limit else 'running'
+        s['updated'] = datetime.fromtimestamp(now).strftime(TIME_FORMAT)
+        s['tail'] = {'stderr': self.stderr.state(),
+                     'log_run': self.log_run.state() if self.log_run else None}
+
+        if rows:
+            with open(self.out + '.tsv', 'a') as f:
+                f.writelines(rows)
+        tmp = self.out + '.%d.tmp' % os.getpid()
+        with open(tmp, 'w') as f:
+            json.dump(s, f, indent=1)
+        os.replace(tmp, self.out)
+        return s
+
+
+def _tail_args(state):
+    if not state:
+        return {}
+    return {'offset': state['offset'], 'inode': state['inode']}
+
+
+def report(s):
+    last = s['last'] or {}
+    rate = s.get('model_days_per_hour')
+    print('%s: %s, step %s, model time %s, %.1f%% done, %s model days/hour, end %s'
+          % (s['updated'], s['state'], last.get('step'), last.get('model_time'),
+             100 * s.get('progress', 0), '%.2f' % rate if rate else '-', s.get('eta')))
+    if s['problem']:
+        print('  ' + s['problem'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Monitor the throughput of a running GETM model')
+    parser.add_argument('stderr', help='rank 0 log, e.g. dws_200m.0000.stderr')
+    parser.add_argument('log_run', nargs='?', default=None, help='log.run of mpirun (MPI_ABORT)')
+    parser.add_argument('--out', default='run_monitor.json', help='status file (default run_monitor.json)')
+    parser.add_argument('--interval', type=float, default=30., help='seconds between updates (default 30)')
+    parser.add_argument('--segment', type=float, default=900.,
+                        help='wall seconds per throughput segment (default 900)')
+    parser.add_argument('--stall', type=float, default=None,
+                        help='seconds without progress for a stall (default: 10 times the usual interval)')
+    parser.add_argument('--once', action='store_true', help='update once and exit')
+    parser.add_argument('--quiet', action='store_true', help='no report on stdout')
+    args = parser.parse_args()
+
+    monitor = RunMonitor(args.stderr, args.log_run, args.out, args.segment, args.stall)
+    while True:
+        status = monitor.update()
+        if not args.quiet:
+            report(status)
+        if args.once or status['state'] in ('finished', 'aborted'):
+            break
+        time.sleep(args.interval)
+    sys.exit(0 if status['state'] in ('starting', 'running', 'finished') else 1)
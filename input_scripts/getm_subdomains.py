@@ -0,0 +1,252 @@
+#! /usr/bin/env python
+
+# reading and writing the GETM parallel setup files of a configuration
+# (Configurations/<conf>/*.subdomain_spec.lst, *.machine_file, dws_200m.dim,
+# dws_200m.mask)
+#
+# subdomain_spec.lst:
+#   line 1 : number of subdomains (MPI ranks)
+#   line 2 : imax jmax iextr jextr    (tile size and global grid size)
+#   then per rank: id ioff joff and the 8 neighbour ids in the order of
+#   NEIGHBOURS, -1 where there is no neighbour (land or outside the grid).
+#   The tile of a rank covers the global (0-based) indices
+#   ioff..ioff+imax-1 and joff..joff+jmax-1; offsets can be negative.
+#   Tiles without wet cells are left out; the ranks are ordered by joff, then
+#   ioff. In the safe_subdomain_spec.lst every neighbouring tile is listed,
+#   in the subdomain_spec.lst only the ones that exchange wet halo cells
+#   (see decompose).
+# machine_file: the host of every rank, one per line.
+# The mask file holds jextr lines of iextr values, the northern row first.
+
+import numpy as np
+
+# order of the neighbour columns in subdomain_spec.lst
+NEIGHBOURS = ('W', 'NW', 'N', 'NE', 'E', 'SE', 'S', 'SW')
+
+# tile steps (di, dj) to the neighbours, in the order of NEIGHBOURS
+DIRECTIONS = ((-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1))
+
+# halo width of GETM
+HALO = 2
+
+
+class SubdomainSpec(object):
+    """
+    Subdomain decomposition of a GETM grid.
+    imax, jmax: tile size
+    iextr, jextr: global grid size
+    ioff, joff: (nranks,) offsets of the tiles, 0-based global index of their first cell
+    neighbours: (nranks, 8) neighbour ranks in the order of NEIGHBOURS, -1 for none
+    """
+
+    def __init__(self, imax, jmax, iextr, jextr, ioff, joff, neighbours):
+        self.imax = imax
+        self.jmax = jmax
+        self.iextr = iextr
+        self.jextr = jextr
+        self.ioff = np.asarray(ioff, dtype=int)
+        self.joff = np.asarray(joff, dtype=int)
+        self.neighbours = np.asarray(neighbours, dtype=int).reshape(-1, len(NEIGHBOURS))
+
+    @property
+    def nranks(self):
+        return len(self.ioff)
+
+    def bounds(self, rank, halo=0):
+        """
+        Global index range of the tile of rank, grown by halo cells on every side:
+        (i0, i1, j0, j1), half open. Can extend outside the global grid.
+        """
+        i0 = self.ioff[rank] - halo
+        j0 = self.joff[rank] - halo
+        return i0, i0 + self.imax + 2*halo, j0, j0 + self.jmax + 2*halo
+
+    def row_bands(self):
+        """
+        Ranks grouped by joff, from south to north: a list of (joff, [ranks])
+        """
+        return [(joff, list(np.flatnonzero(self.joff == joff)))
+                for joff in np.unique(self.joff)]
+
+
+def read_subdomain_spec(fname):
+    """
+    Read a (safe_)subdomain_spec.lst file into a SubdomainSpec.
+    The ranks must be listed as 0..n-1.
+    """
+    with open(fname) as f:
+        lines = [line.split() for line in f if line.strip()]
+    nranks = int(lines[0][0])
+    imax, jmax, iextr, jextr = [int(v) for v in lines[1][:4]]
+    table = np.array([[int(v) for v in line[:3+len(NEIGHBOURS)]] for line in lines[2:2+nranks]],
+                     dtype=int).reshape(-1, 3+len(NEIGHBOURS))
+    if len(table) != nranks:
+        raise ValueError('%s: %d subdomains announced, %d listed' % (fname, nranks, len(table)))
+    if not np.array_equal(table[:, 0], np.arange(nranks)):
+        raise ValueError('%s: subdomain ids are not 0..%d in order' % (fname, nranks-1))
+    return SubdomainSpec(imax, jmax, iextr, jextr, table[:, 1], table[:, 2], table[:, 3:])
+
+
+def read_mask(fname):
+    """
+    Read a GETM mask file (e.g. dws_200m.mask) as an (jextr, iextr) int array
+    indexed [j, i] like the model, j=0 being the southern row.
+    """
+    return np.loadtxt(fname, dtype=int, ndmin=2)[::-1]
+
+
+def strip(bounds, di, dj, halo=HALO):
+    """
+    The cells of a tile (i0, i1, j0, j1) sent to the neighbour in direction (di, dj):
+    the halo rows/columns along that side (or corner)
+    """
+    i0, i1, j0, j1 = bounds
+    if di:
+        i0, i1 = (i1-halo, i1) if di > 0 else (i0, i0+halo)
+    if dj:
+        j0, j1 = (j1-halo, j1) if dj > 0 else (j0, j0+halo)
+    return i0, i1, j0, j1
+
+
+def has_wet(mask, bounds):
+    """
+    True if the index range (i0, i1, j0, j1) holds a wet cell of mask (jextr, iextr)
+    """
+    i0, i1, j0, j1 = bounds
+    return bool((mask[max(j0, 0):max(j1, 0), max(i0, 0):max(i1, 0)] > 0).any())
+
+
+def decompose(mask, imax, jmax, ioff0=0, joff0=0, safe=False, halo=HALO):
+    """
+    Decomposition of the grid of mask (jextr, iextr) into tiles of imax x jmax with the
+    first tile at (ioff0, joff0) (-imax < ioff0 <= 0, -jmax < joff0 <= 0), as the GETM tools do:
+    tiles without wet cells are left out, the ranks are ordered by joff, then ioff.
+    safe: list every neighbouring tile; otherwise only neighbours that exchange wet cells
+          (the strips of halo cells on both sides of the common edge or corner hold wet cells)
+    Returns a SubdomainSpec.
+    """
+    jextr, iextr = mask.shape
+    tiles = [(ioff, joff) for joff in range(joff0, jextr, jmax) for ioff in range(ioff0, iextr, imax)
+             if has_wet(mask, (ioff, ioff+imax, joff, joff+jmax))]
+    rank = dict((tile, n) for n, tile in enumerate(tiles))
+    neighbours = np.full((len(tiles), len(NEIGHBOURS)), -1, dtype=int)
+    for n, (ioff, joff) in enumerate(tiles):
+        for k, (di, dj) in enumerate(DIRECTIONS):
+            other = rank.get((ioff + di*imax, joff + dj*jmax), -1)
+            if other < 0:
+                continue
+            own = (ioff, ioff+imax, joff, joff+jmax)
+            theirs = (own[0] + di*imax, own[1] + di*imax, own[2] + dj*jmax, own[3] + dj*jmax)
+            if safe or (has_wet(mask, strip(own, di, dj, halo)) and
+                        has_wet(mask, strip(theirs, -di, -dj, halo))):
+                neighbours[n, k] = other
+    ioff, joff = np.array(tiles, dtype=int).reshape(-1, 2).T
+    return SubdomainSpec(imax, jmax, iextr, jextr, ioff, joff, neighbours)
+
+
+def spec_name(prefix, spec, nodes):
+    """
+    Base name of the files of a decomposition, e.g.
+    dws_200m.mask.size0032x0032_offset+0000x-0010_nodes006
+    """
+    # offset of the first tile, -imax < ioff0 <= 0
+    ioff0 = -(-spec.ioff[0] % spec.imax)
+    joff0 = -(-spec.joff[0] % spec.jmax)
+    return '%s.size%04dx%04d_offset%+05dx%+05d_nodes%03d' % (prefix, spec.imax, spec.jmax, ioff0, joff0, nodes)
+
+
+def write_subdomain_spec(fname, spec):
+    """
+    Write a SubdomainSpec as (safe_)subdomain_spec.lst
+    """
+    with open(fname, 'w') as f:
+        f.write('%d\n' % spec.nranks)
+        f.write('%d %d %d %d\n' % (spec.imax, spec.jmax, spec.iextr, spec.jextr))
+        for rank in range(spec.nranks):
+            f.write('%4d%8d%7d%6d' % (rank, spec.ioff[rank], spec.joff[rank], spec.neighbours[rank, 0]))
+            f.write(''.join('%5d' % n for n in spec.neighbours[rank, 1:]) + '\n')
+
+
+def write_dim(fname, spec, kmax):
+    """
+    Write the GETM dimension file (<setup>.dim, included as dimensions.h) of a decomposition
+    """
+    with open(fname, 'w') as f:
+        f.write('   integer, parameter :: iextr=%d,jextr=%d\n' % (spec.iextr, spec.jextr))
+        f.write('   integer, parameter :: imin=1,imax=%d,jmin=1,jmax=%d\n' % (spec.imax, spec.jmax))
+        f.write('   integer, parameter :: iimin=1,iimax=iextr,jjmin=1,jjmax=jextr\n')
+        f.write('   integer, parameter :: kmax=%d\n' % kmax)
+
+
+def read_machine_file(fname):
+    """
+    The hosts of a machine file, one per rank
+    """
+    with open(fname) as f:
+        return [line.split()[0] for line in f if line.strip()]
+
+
+def write_machine_file(fname, hosts):
+    """
+    Write a machine file: the host of every rank, one per line
+    """
+    with open(fname, 'w') as f:
+        f.writelines('%s\n' % host for host in hosts)
+
+
+def fill_nodes(nranks, nodes, cores, names=None):
+    """
+    Hosts of the ranks when the nodes are filled in rank order, the ranks spread
+    evenly over the nodes (at most cores per node).
+    names: host names (default n01, n02, ...)
+    """
+    if nranks > nodes*cores:
+        raise ValueError('%d ranks do not fit on %d nodes of %d cores' % (nranks, nodes, cores))
+    names = names or ['n%02d' % (n+1) for n in range(nodes)]
+    per_node = -(-nranks // nodes)
+    return [names[rank // per_node] for rank in range(nranks)]
+
+
+def window_index(start, stop, n):
+    """
+    Indices start..stop-1 clipped to 0..n-1, and the mask of the ones inside 0..n-1
+    """
+    index = np.arange(start, stop)
+    inside = (index >= 0) & (index < n)
+    return np.clip(index, 0, n-1), inside
+
+
+def coverage(spec):
+    """
+    Number of tiles of spec covering each cell of the global grid, (jextr, iextr)
+    """
+    count = np.zeros((spec.jextr, spec.iextr), dtype=int)
+    for rank in range(spec.nranks):
+        i0, i1, j0, j1 = spec.bounds(rank)
+        count[max(j0, 0):max(j1, 0), max(i0, 0):max(i1, 0)] += 1
+    return count
+
+
+def check_coverage(spec, mask, name='spec'):
+    """
+    Check that every wet cell (mask > 0) is in exactly one tile of spec.
+    Returns the number of bad cells; the first few are printed.
+    """
+    count = coverage(spec)
+    bad = np.argwhere((mask > 0) & (count != 1))
+    for j, i in bad[:10]:
+        print('%s: wet cell i=%d j=%d (1-based %d,%d) is in %d tiles' % (name, i, j, i+1, j+1, count[j, i]))
+    if len(bad) > 10:
+        print('%s: ... %d wet cells in total not covered exactly once' % (name, len(bad)))
+    return len(bad)
+
+
+def overlap(a, b):
+    """
+    Intersection of two index ranges (i0, i1, j0, j1), or None if they do not overlap
+    """
+    i0, i1 = max(a[0], b[0]), min(a[1], b[1])
+    j0, j1 = max(a[2], b[2]), min(a[3], b[3])
+    if i0 >= i1 or j0 >= j1:
+        return None
+    return i0, i1, j0, j1
@@ -0,0 +1,137 @@
+#! /usr/bin/env python
+
+# adds rows to a restart file
+# used to make restart file match a particular subdomain decomposition
+#
+# Any axis (yax, xax, ...) is grown by a number of rows at the bottom (start)
+# or top (end), copying the edge row or using a fill value. Variables are
+# streamed one by one, slab by slab, into a single output file: no repeated
+# ncrcat passes, and the dimension order and any record dimension of the
+# input are kept.
+# Usage:
+#   python add_rows_to_restartfile.py restart_in.nc restart_out.nc --axis yax --rows 10
+#   python add_rows_to_restartfile.py restart_in.nc restart_out.nc --axis xax --rows 4 --side top --fill 0
+
+import argparse
+import time
+from netCDF4 import Dataset
+import numpy as np
+
+from hotstart_io import slabs, SLAB_BYTES, OutputFormat, add_output_arguments, output_format
+
+
+def pad_block(block, pos, nrows, side='bottom', fill=None, edge_offset=0):
+    """
+    Add nrows rows to a block along axis pos.
+    side: 'bottom' (before index 0) or 'top' (after the last index)
+    fill: value for the new rows; None copies the edge row
+    edge_offset: copy the row this far in from the edge (0: the edge row itself)
+    """
+    if fill is None:
+        edge = edge_offset if side == 'bottom' else block.shape[pos]-1-edge_offset
+        rows = np.repeat(np.take(block, [edge], axis=pos), nrows, axis=pos)
+    else:
+        shape = list(block.shape)
+        shape[pos] = nrows
+        rows = np.full(shape, fill, dtype=block.dtype)
+    parts = [rows, block] if side == 'bottom' else [block, rows]
+    return np.concatenate(parts, axis=pos)
+
+
+def pad_axis(values, nrows, side='bottom'):
+    """
+    Extend a 1D coordinate with its end spacing, so the new rows get new coordinates
+    """
+    if len(values) < 2:
+        step = 1
+    elif side == 'bottom':
+        step = values[1]-values[0]
+    else:
+        step = values[-1]-values[-2]
+    if side == 'bottom':
+        return np.concatenate([values[0] - step*np.arange(nrows, 0, -1), values])
+    return np.concatenate([values, values[-1] + step*np.arange(1, nrows+1)])
+
+
+def add_rows(infname, ofname, axis='yax', nrows=10, side='bottom', fill=None, edge_offset=0,
+             output=None, max_bytes=SLAB_BYTES, verbose=True):
+    """
+    Write a copy of infname with nrows extra rows along dimension axis to ofname.
+    See pad_block for side, fill and edge_offset; fill applies to the data variables,
+    the coordinate variable of axis is extended with its end spacing.
+    """
+    t0 = time.time()
+    if output is None:
+        output = OutputFormat()
+    infile = Dataset(infname, 'r')
+    infile.set_auto_mask(False)
+    if axis not in infile.dimensions:
+        raise ValueError('no dimension %s in %s' % (axis, infname))
+
+    outfile = output.create(ofname)
+    outfile.setncatts({att: infile.getncattr(att) for att in infile.ncattrs()})
+    for dimname, dim in infile.dimensions.items():
+        if dim.isunlimited():
+            outfile.createDimension(dimname, None)
+        else:
+            outfile.createDimension(dimname, len(dim) + (nrows if dimname == axis else 0))
+
+    copies = []
+    for varname, var in infile.variables.items():
+        outvar = output.variable(outfile, varname, var.dtype, var.dimensions,
+                                 fill_value=getattr(var, '_FillValue', None))
+        outvar.setncatts({att: var.getncattr(att) for att in var.ncattrs() if att != '_FillValue'})
+        copies.append((var, outvar))
+
+    for var, outvar in copies:
+        if verbose:
+            print(var.name)
+        dims = var.dimensions
+        if axis not in dims:
+            if len(dims) < 2:
+                outvar[...] = var[...]
+            else:
+                for index in slabs(var.shape, var.dtype.itemsize, axis=0, max_bytes=max_bytes):
+                    outvar[index] = var[index]
+            continue
+        pos = dims.index(axis)
+        if len(dims) == 1:
+            if var.name == axis:
+                # the coordinate of the padded axis is always extended, fill is for the data only
+                values = pad_axis(var[:], nrows, side)
+                steps = np.diff(values)
+                if len(steps) and not (np.all(steps > 0) or np.all(steps < 0)):
+                    raise ValueError('%s is not monotonic after adding %d rows' % (axis, nrows))
+                outvar[:] = values
+            else:
+                outvar[:] = pad_block(var[:], 0, nrows, side, fill, edge_offset)
+            continue
+        # stream along the first other axis; every slab holds all rows of the padded axis
+        cut = 1 if pos == 0 else 0
+        for index in slabs(var.shape, var.dtype.itemsize, axis=cut, max_bytes=max_bytes):
+            outvar[index] = pad_block(var[index], pos, nrows, side, fill, edge_offset)
+
+    infile.close()
+    outfile.close()
+    if verbose:
+        print('added %d rows to %s (%s) in %.1f s' % (nrows, axis, side, time.time()-t0))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='add rows to a restart file')
+    parser.add_argument('infname', help='input restart file')
+    parser.add_argument('ofname', help='output restart file')
+    parser.add_argument('--axis', default='yax', help='dimension to grow (default %(default)s)')
+    parser.add_argument('--rows', type=int, default=10, help='number of rows to add (default %(default)s)')
+    parser.add_argument('--side', default='bottom', choices=('bottom', 'top'),
+                        help='bottom: before the first row (default), top: after the last row')
+    parser.add_argument('--fill', default='edge',
+                        help='value for the new rows, or edge to copy the edge row (default)')
+    parser.add_argument('--edge-offset', type=int, default=0,
+                        help='copy the row this far in from the edge (default 0, the edge row)')
+    add_output_arguments(parser, compare=False)
+    args = parser.parse_args()
+
+    fill = None if args.fill == 'edge' else float(args.fill)
+    add_rows(args.infname, args.ofname, args.axis, args.rows, args.side, fill,
+             args.edge_offset, output_format(args))
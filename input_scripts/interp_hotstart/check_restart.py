@@ -0,0 +1,282 @@
+#! /usr/bin/env python
+
+# preflight check of restart files: NaN, Inf and out-of-range values
+#
+# Checks a global restart file or a directory with a per-rank set
+# (restart.NNNN.in) before mpirun. The global file is read in slabs of rows,
+# a per-rank set file by file, by a pool of worker processes. Every bad value
+# is located as variable, k (zax index) and global i, j (1-based, as in
+# GETM); with the subdomain_spec.lst the rank owning the cell is given as
+# well. With a mask only the wet cells of every slab are gathered and
+# checked, the land cells are not scanned.
+# Ranges: T and S by default (see DEFAULT_RANGES), more with --range,
+# and --nonnegative sets a lower bound of 0 for the BFM state variables.
+# The exit status is 1 if a bad value is found.
+# Usage:
+#   python check_restart.py restart_dws200m_2015_01.nc --spec par_setup.dat [--workers 8]
+#   python check_restart.py out/2015/01 --spec par_setup.dat --mask dws_200m.mask --nonnegative
+#   python check_restart.py restart.nc --range N1p=0:50 --range O2o=0:600
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from netCDF4 import Dataset
+import numpy as np
+
+from hotstart_io import slabs, SLAB_BYTES
+from mix_restartfiles import BIO_VARS
+from split_restart import file_offsets, XAX, YAX
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from getm_subdomains import read_subdomain_spec, read_mask
+
+# default valid ranges (min, max)
+DEFAULT_RANGES = {'T': (-2.5, 40.), 'S': (0., 45.)}
+
+# bad values listed per variable and file; all are counted
+MAX_LISTED = 10
+
+
+def find_bad(block, limits=None):
+    """
+    Indices of the NaN, Inf and out-of-range values of a block.
+    limits: (min, max) or None; either can be None
+    Returns (indices (n, ndim), kinds (n,) of 'NaN', 'Inf', '<min' or '>max').
+    """
+    if block.dtype.kind != 'f' and limits is None:
+        return np.zeros((0, block.ndim), dtype=int), np.zeros(0, dtype=object)
+    kind = np.zeros(block.shape, dtype=np.int8)
+    if block.dtype.kind == 'f':
+        kind[np.isnan(block)] = 1
+        kind[np.isinf(block)] = 2
+    if limits is not None:
+        lo, hi = limits
+        with np.errstate(invalid='ignore'):
+            if lo is not None:
+                kind[(kind == 0) & (block < lo)] = 3
+            if hi is not None:
+                kind[(kind == 0) & (block > hi)] = 4
+    index = np.argwhere(kind)
+    names = np.array([None, 'NaN', 'Inf', '<min', '>max'], dtype=object)
+    return index, names[kind[tuple(index.T)]]
+
+
+def _scan(fname, varnames, ranges, index=None, ioff=0, joff=0, wet=None):
+    """
+    Scan variables of one file (or one slab of it) in a worker.
+    index: slab of rows (slice along yax), None for the whole file
+    ioff, joff: global 0-based index of the first column and row of the file
+    wet: (ny, nx) bool array of the wet cells of the file, or None
+    Returns a list of (varname, number of bad values, [(kind, k, j, i, value), ...]).
+    """
+    infile = Dataset(fname, 'r')
+    infile.set_auto_mask(False)
+    results = []
+    for varname in varnames:
+        var = infile.variables[varname]
+        dims = var.dimensions
+        key = [slice(None)]*len(dims)
+        row0 = 0
+        if index is not None and YAX in dims:
+            key[dims.index(YAX)] = index
+            row0 = index.start
+        block = np.asarray(var[tuple(key)])
+        if wet is not None and XAX in dims and YAX in dims:
+            # only the wet cells are scanned: (other dimensions..., wet cell)
+            py, px = dims.index(YAX), dims.index(XAX)
+            rows, cols = np.nonzero(wet[row0:row0 + block.shape[py]])
+            found, kinds = find_bad(np.moveaxis(block, (py, px), (-2, -1))[..., rows, cols],
+                                    ranges.get(varname))
+            bad = np.zeros((len(found), len(dims)), dtype=int)
+            bad[:, [n for n, d in enumerate(dims) if n not in (py, px)]] = found[:, :-1]
+            bad[:, py] = rows[found[:, -1]]
+            bad[:, px] = cols[found[:, -1]]
+        else:
+            bad, kinds = find_bad(block, ranges.get(varname))
+        if len(bad) and 'zax' in dims:
+            # level 0 is not used by the model: only NaN and Inf count there
+            keep = (bad[:, dims.index('zax')] > 0) | (kinds == 'NaN') | (kinds == 'Inf')
+            bad, kinds = bad[keep], kinds[keep]
+        if not len(bad):
+            continue
+        listed = []
+        for loc, kind in zip(bad[:MAX_LISTED], kinds[:MAX_LISTED]):
+            ijk = dict(zip(dims, loc))
+            listed.append((kind, ijk.get('zax', -1),
+                           ijk[YAX] + row0 + joff if YAX in ijk else -1,
+                           ijk[XAX] + ioff if XAX in ijk else -1,
+                           float(block[tuple(loc)])))
+        results.append((varname, len(bad), listed))
+    infile.close()
+    return results
+
+
+def owner_map(spec):
+    """
+    Rank owning each cell of the global grid, -1 outside all tiles, (jextr, iextr)
+    """
+    owner = np.full((spec.jextr, spec.iextr), -1, dtype=int)
+    for rank in range(spec.nranks):
+        i0, i1, j0, j1 = spec.bounds(rank)
+        owner[max(j0, 0):max(j1, 0), max(i0, 0):max(i1, 0)] = rank
+    return owner
+
+
+def _init_worker(spec, mask, ranges):
+    global _spec, _mask, _ranges
+    _spec, _mask, _ranges = spec, mask, ranges
+
+
+def _scan_rank(fname, rank):
+    """
+    Scan the file of one rank of a per-rank set in a worker (see _scan).
+    Returns None for a global file linked for every rank (link_restartfiles): it is checked
+    once, as a global file.
+    """
+    with Dataset(fname, 'r') as infile:
+        varnames = list(infile.variables)
+        nx = len(infile.dimensions[XAX])
+    if nx >= _spec.iextr:
+        return None
+    halo = (nx - _spec.imax)//2
+    i0, i1, j0, j1 = _spec.bounds(rank, halo)
+    wet = None
+    if _mask is not None:
+        # wet cells of the tile; outside the grid counts as land
+        wet = np.zeros((j1-j0, i1-i0), dtype=bool)
+        r0, r1 = max(j0, 0), min(j1, _spec.jextr)
+        c0, c1 = max(i0, 0), min(i1, _spec.iextr)
+        wet[r0-j0:r1-j0, c0-i0:c1-i0] = _mask[r0:r1, c0:c1] > 0
+    return _scan(fname, varnames, _ranges, None, i0, j0, wet)
+
+
+def _scan_global(fname, varnames, index, xoff, yoff):
+    """
+    Scan variables of a global file, or one slab of rows of it, in a worker (see _scan).
+    xoff, yoff: padding columns and rows of the file before the grid (file_offsets)
+    """
+    wet = None
+    if _mask is not None:
+        # in file rows and columns; padding rows are not checked
+        wet = np.zeros((_mask.shape[0] + yoff, _mask.shape[1] + xoff), dtype=bool)
+        wet[yoff:, xoff:] = _mask > 0
+    return _scan(fname, varnames, _ranges, index, -xoff, -yoff, wet)
+
+
+def _global_tasks(fname, spec, max_bytes):
+    """
+    Scan tasks (_scan_global) for a global file: the variables without yax, then the others
+    per slab of rows
+    """
+    with Dataset(fname, 'r') as infile:
+        varnames = list(infile.variables)
+        offsets = file_offsets(infile, spec) if spec is not None else {XAX: 0, YAX: 0}
+        layered = [v for v in varnames if YAX in infile.variables[v].dimensions]
+        others = [v for v in varnames if v not in layered]
+        shapes = [infile.variables[v].shape for v in layered]
+    tasks = [(fname, others, None, offsets[XAX], offsets[YAX])]
+    if not layered:
+        return tasks
+    shape = max(shapes, key=len)
+    for index in slabs(shape, 8, axis=len(shape)-2, max_bytes=max_bytes):
+        tasks.append((fname, layered, index[len(shape)-2], offsets[XAX], offsets[YAX]))
+    return tasks
+
+
+def check_restart(path, spec=None, mask=None, ranges=DEFAULT_RANGES, pattern='restart.%04d.in',
+                  workers=1, max_bytes=SLAB_BYTES, verbose=True):
+    """
+    Check a global restart file, or a directory with the per-rank set of spec.
+    spec: SubdomainSpec, to give the rank of every bad value; required for a directory.
+          Per-rank files that are links to a global file are checked once, as a global file.
+    mask: (jextr, iextr) mask, to check wet cells only
+    ranges: {variable: (min, max)}
+    Returns the total number of bad values.
+    """
+    t0 = time.time()
+    if os.path.isdir(path) and spec is None:
+        raise ValueError('a per-rank set needs the subdomain spec')
+    pool = None
+    if workers > 1:
+        pool = multiprocessing.Pool(workers, _init_worker, (spec, mask, ranges))
+        starmap = pool.starmap
+    else:
+        _init_worker(spec, mask, ranges)
+
+        def starmap(func, tasks):
+            return [func(*task) for task in tasks]
+    try:
+        files, results = [], []
+        if os.path.isdir(path):
+            # the workers open the rank files
+            fnames = [os.path.join(path, pattern % rank) for rank in range(spec.nranks)]
+            linked = set()
+            for fname, found in zip(fnames, starmap(_scan_rank, list(zip(fnames, range(spec.nranks))))):
+                if found is None:
+                    linked.add(os.path.realpath(fname))
+                else:
+                    files.append(fname)
+                    results.append(found)
+            tasks = [task for fname in sorted(linked) for task in _global_tasks(fname, spec, max_bytes)]
+        else:
+            tasks = _global_tasks(path, spec, max_bytes)
+        files += [task[0] for task in tasks]
+        results += starmap(_scan_global, tasks)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    owner = owner_map(spec) if spec is not None else None
+    total = 0
+    counts = {}
+    for fname, found in zip(files, results):
+        for varname, nbad, listed in found:
+            total += nbad
+            counts[varname] = counts.get(varname, 0) + nbad
+            if not verbose:
+                continue
+            for kind, k, j, i, value in listed:
+                rank = -1
+                if owner is not None and 0 <= j < owner.shape[0] and 0 <= i < owner.shape[1]:
+                    rank = owner[j, i]
+                print('%-10s %-4s rank %4s  i=%4d j=%4d k=%3d  value %g  (%s)'
+                      % (varname, kind, rank if rank >= 0 else '-', i+1, j+1, k, value,
+                         os.path.basename(fname)))
+            if nbad > len(listed):
+                print('%-10s ... %d more in %s' % (varname, nbad - len(listed), os.path.basename(fname)))
+    if verbose:
+        for varname, n in sorted(counts.items()):
+            print('%-10s %d bad values' % (varname, n))
+        print('%s: %d bad values, checked in %.1f s' % (path, total, time.time()-t0))
+    return total
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='check restart files for NaN, Inf and out-of-range values')
+    parser.add_argument('path', help='global restart file, or directory with a per-rank set')
+    parser.add_argument('--spec', default=None,
+                        help='subdomain_spec.lst (e.g. par_setup.dat), to give ranks; required for a directory')
+    parser.add_argument('--mask', default=None, help='GETM mask file, to check wet cells only')
+    parser.add_argument('--range', action='append', default=[], metavar='NAME=MIN:MAX',
+                        help='valid range of a variable, MIN or MAX can be empty; can be repeated')
+    parser.add_argument('--nonnegative', action='store_true',
+                        help='values of the BFM state variables must be >= 0')
+    parser.add_argument('--pattern', default='restart.%04d.in',
+                        help='file name of a rank in a directory (default %(default)s)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes (default 1: serial)')
+    args = parser.parse_args()
+
+    ranges = dict(DEFAULT_RANGES)
+    if args.nonnegative:
+        ranges.update((v, (0., None)) for v in BIO_VARS)
+    for item in args.range:
+        name, limits = item.split('=', 1)
+        lo, hi = limits.split(':')
+        ranges[name] = (float(lo) if lo else None, float(hi) if hi else None)
+    spec = None if args.spec is None else read_subdomain_spec(args.spec)
+    mask = None if args.mask is None else read_mask(args.mask)
+    nbad = check_restart(args.path, spec, mask, ranges, args.pattern, args.workers)
+    sys.exit(1 if nbad else 0)
@@ -0,0 +1,153 @@
+#! /usr/bin/env python
+
+# shared NetCDF helpers for the hotstart (restart file) tools in this directory
+
+import os
+import time
+from netCDF4 import Dataset
+import numpy as np
+
+# attributes that are not copied from the input restart variables
+SKIP_ATTS = ('_FillValue', 'assignValue', 'getValue', 'typecode')
+
+# default upper bound for the size of one slab read from a variable (bytes)
+SLAB_BYTES = 64*1024**2
+
+# output modes: name -> netCDF file format
+#   classic : uncompressed NETCDF3_CLASSIC, as the restart files GETM writes
+#   zlib    : deflate (+ shuffle), chunked per dimension layout
+#   fast    : netCDF4 without compression, contiguous storage
+OUTPUT_MODES = {
+    'classic': 'NETCDF3_CLASSIC',
+    'zlib': 'NETCDF4_CLASSIC',
+    'fast': 'NETCDF4_CLASSIC',
+}
+
+# horizontal chunk size (yax, xax) of the zlib mode; a chunk holds all levels
+CHUNK_ROWS = 64
+
+
+def copy_attributes(invar, outvar):
+    """
+    Copy the attributes of a restart variable, except the system ones in SKIP_ATTS
+    """
+    for att in invar.ncattrs():
+        if att not in SKIP_ATTS:
+            setattr(outvar, att, getattr(invar, att))
+
+
+def slabs(shape, itemsize, axis=1, max_bytes=SLAB_BYTES, align=1):
+    """
+    Split an array shape into slices along one axis, so that every slab
+    (all other axes complete) holds at most max_bytes.
+    shape: shape of the variable, e.g. (zax, yax, xax)
+    itemsize: bytes per value
+    axis: axis to cut, yax by default
+    align: slab boundaries are multiples of align (e.g. the output chunk rows)
+    Yields tuples of slices that can be used to index the variable directly.
+    """
+    nrow = shape[axis]
+    rowbytes = itemsize*int(np.prod(shape))//max(nrow, 1)
+    step = max(align, max_bytes//max(rowbytes, 1)//align*align)
+    for r0 in range(0, nrow, step):
+        index = [slice(None)]*len(shape)
+        index[axis] = slice(r0, min(r0+step, nrow))
+        yield tuple(index)
+
+
+class OutputFormat(object):
+    """
+    How a restart tool writes its output file.
+    mode: one of OUTPUT_MODES
+    complevel: deflate level of the zlib mode
+    shuffle: apply the shuffle filter in the zlib mode
+    """
+
+    def __init__(self, mode='classic', complevel=4, shuffle=True):
+        if mode not in OUTPUT_MODES:
+            raise ValueError('unknown output mode %s, use one of %s' % (mode, ', '.join(OUTPUT_MODES)))
+        self.mode = mode
+        self.complevel = complevel
+        self.shuffle = shuffle
+
+    @property
+    def align(self):
+        """rows per slab should be a multiple of this, to write whole chunks"""
+        return CHUNK_ROWS if self.mode == 'zlib' else 1
+
+    def create(self, ofname):
+        """
+        Open a new output Dataset. Fill mode is off: the tools write every value.
+        """
+        outfile = Dataset(ofname, 'w', format=OUTPUT_MODES[self.mode])
+        outfile.set_fill_off()
+        return outfile
+
+    def variable(self, outfile, varname, datatype, dimensions, fill_value=None):
+        """
+        Create a variable with the storage settings of this mode
+        """
+        if self.mode == 'classic' or not dimensions:
+            return outfile.createVariable(varname, datatype, dimensions, fill_value=fill_value)
+        unlimited = any(outfile.dimensions[d].isunlimited() for d in dimensions)
+        if self.mode == 'fast':
+            return outfile.createVariable(varname, datatype, dimensions, fill_value=fill_value,
+                                          contiguous=not unlimited)
+        shape = [len(outfile.dimensions[d]) for d in dimensions]
+        return outfile.createVariable(varname, datatype, dimensions, fill_value=fill_value,
+                                      zlib=True, complevel=self.complevel, shuffle=self.shuffle,
+                                      chunksizes=chunk_sizes(dimensions, shape))
+
+
+def chunk_sizes(dimensions, shape):
+    """
+    Chunk shape for a restart variable: complete along zax (and 1D axes),
+    CHUNK_ROWS x CHUNK_ROWS in the horizontal, so a (zax, yax, xax) chunk is a
+    water column tile as read by one GETM subdomain.
+    """
+    return [max(1, min(n, CHUNK_ROWS)) if d in ('yax', 'xax') and len(dimensions) > 1 else max(n, 1)
+            for d, n in zip(dimensions, shape)]
+
+
+def add_output_arguments(parser, compare=True):
+    """
+    Add the --output-format, --complevel and --no-shuffle options to an argparse parser,
+    and --compare-formats if compare is set
+    """
+    parser.add_argument('--output-format', default='classic', choices=sorted(OUTPUT_MODES),
+                        help='classic: NETCDF3_CLASSIC (default); zlib: compressed NETCDF4_CLASSIC; '
+                             'fast: uncompressed NETCDF4_CLASSIC')
+    parser.add_argument('--complevel', type=int, default=4,
+                        help='deflate level for --output-format zlib (default %(default)s)')
+    parser.add_argument('--no-shuffle', action='store_true',
+                        help='do not use the shuffle filter with --output-format zlib')
+    if compare:
+        parser.add_argument('--compare-formats', action='store_true',
+                            help='write the output in every format and report write time and file size')
+
+
+def output_format(args):
+    """
+    OutputFormat from the options added by add_output_arguments
+    """
+    return OutputFormat(args.output_format, args.complevel, not args.no_shuffle)
+
+
+def compare_formats(write, ofname, complevel=4):
+    """
+    Write the output once per mode and print the time and size of each.
+    write: function write(ofname, output) producing one output file
+    ofname: output file name; the mode is added before the extension
+    """
+    root, ext = os.path.splitext(ofname)
+    modes = [('classic', OutputFormat('classic')),
+             ('fast', OutputFormat('fast')),
+             ('zlib', OutputFormat('zlib', complevel, shuffle=False)),
+             ('zlib+shuffle', OutputFormat('zlib', complevel, shuffle=True))]
+    print('%-14s %10s %12s  %s' % ('mode', 'time (s)', 'size (MB)', 'file'))
+    for name, output in modes:
+        fname = '%s.%s%s' % (root, name.replace('+', '_'), ext or '.nc')
+        t0 = time.time()
+        write(fname, output)
+        dt = time.time() - t0
+        print('%-14s %10.2f %12.1f  %s' % (name, dt, os.path.getsize(fname)/1e6, fname))
@@ -0,0 +1,196 @@
+#! /usr/bin/env python
+
+# streaming engine for halving the number of layers in a restart file
+#
+# Every 3D variable is read in horizontal slabs (all layers, a block of rows)
+# and the level pairs are combined in one vectorized operation, so peak memory
+# is one slab whatever the number or size of the variables.
+# Level 0 is kept, levels (1,2), (3,4), ... are combined:
+#   ho, hn            : sum of the two levels (layer thickness)
+#   all other 3D vars : average of the two levels
+# With workers>1 a pool of processes reads and reduces the slabs while the
+# calling process is the only writer; it writes the results in the fixed
+# (variable, slab) order of the serial path, so the output is byte-identical.
+# Whether the pool is faster has not been measured on a multi-core node: on
+# one core (a 200 MB restart, 16 levels of 486x820, in the page cache) the
+# serial path took 0.4 s and 2 or 4 workers 1.1 and 1.3 s. Run --scaling on
+# the target node before using --workers.
+# The output format is set with an OutputFormat (see hotstart_io.py).
+# Usage:
+#   python layer_reduction.py restart_in.nc restart_out.nc [--workers N] [--output-format zlib]
+#   python layer_reduction.py restart_in.nc restart_out.nc --scaling 1,2,4,8,20,40
+#   python layer_reduction.py restart_in.nc restart_out.nc --compare-formats
+
+import argparse
+import multiprocessing
+import time
+from collections import deque
+from netCDF4 import Dataset
+import numpy as np
+
+from hotstart_io import (copy_attributes, slabs, SLAB_BYTES, OutputFormat,
+                         add_output_arguments, output_format, compare_formats)
+
+# variables that are summed instead of averaged
+SUM_VARS = ('ho', 'hn')
+
+
+def halved_length(nz):
+    """
+    Number of levels left after halving nz levels (level 0 is kept)
+    """
+    return 1 + (nz-1)//2
+
+
+def halve_layers(block, summed=False):
+    """
+    Combine level pairs of a (zax, ...) block.
+    block: array with the levels along the first axis
+    summed: add the two levels (thicknesses) instead of averaging them
+    Returns an array with halved_length(nz) levels.
+    """
+    nz = block.shape[0]
+    nout = halved_length(nz)
+    if block.dtype.kind != 'f':
+        block = block.astype(np.float64)
+    out = np.empty((nout,) + block.shape[1:], dtype=block.dtype)
+    out[0] = block[0]
+    # levels 1..2*(nout-1) as (pair, 2, ...); an odd level at the top is dropped
+    pairs = block[1:2*nout-1].reshape((nout-1, 2) + block.shape[1:])
+    np.add(pairs[:, 0], pairs[:, 1], out=out[1:])
+    if not summed:
+        out[1:] /= 2
+    return out
+
+
+# input file of a worker process, opened once by _init_worker
+_infile = None
+
+
+def _init_worker(infname):
+    global _infile
+    _infile = Dataset(infname, 'r')
+    _infile.set_auto_mask(False)
+
+
+def _reduce_slab(varname, index):
+    block = _infile.variables[varname][index]
+    return halve_layers(block, varname in SUM_VARS), block.nbytes
+
+
+def reduce_layers(infname, ofname, max_bytes=SLAB_BYTES, workers=1, output=None, verbose=True):
+    """
+    Write a copy of restart file infname with halved zax to ofname.
+    max_bytes: upper bound for one slab of input data
+    workers: number of processes reducing slabs; 1 runs serially
+    output: OutputFormat of ofname, default NETCDF3_CLASSIC
+    Returns the wall clock time in seconds.
+    """
+    t0 = time.time()
+    if output is None:
+        output = OutputFormat()
+    pool = None
+    if workers > 1:
+        # start the workers before any file is opened in this process
+        pool = multiprocessing.Pool(workers, _init_worker, (infname,))
+        # results waiting to be written, in write order; at most 2 per worker
+        pending = deque()
+        maxpending = 2*workers
+
+    infile = Dataset(infname, 'r')
+    infile.set_auto_mask(False)
+    outfile = output.create(ofname)
+
+    for dimname, dim in infile.dimensions.items():
+        if dimname == 'zax':
+            lendim = halved_length(len(dim))
+        else:
+            lendim = len(dim)
+        outfile.createDimension(dimname, lendim)
+
+    nbytes = 0
+    for varname, var in infile.variables.items():
+        if verbose:
+            print(varname)
+        outvar = output.variable(outfile, varname, var.dtype.kind, var.dimensions)
+        copy_attributes(var, outvar)
+
+        if varname == 'zax':
+            outvar[:] = np.arange(len(outfile.dimensions['zax']), dtype=var.dtype)
+        elif len(var.dimensions) == 3:
+            summed = varname in SUM_VARS
+            for index in slabs(var.shape, var.dtype.itemsize, max_bytes=max_bytes,
+                               align=output.align):
+                if pool is None:
+                    block = var[index]
+                    nbytes += block.nbytes
+                    outvar[index] = halve_layers(block, summed)
+                    continue
+                pending.append((outvar, index,
+                                pool.apply_async(_reduce_slab, (varname, index))))
+                while len(pending) >= maxpending:
+                    nbytes += _write_next(pending)
+        else:
+            outvar[:] = var[:]
+
+    if pool is not None:
+        while pending:
+            nbytes += _write_next(pending)
+        pool.close()
+        pool.join()
+
+    infile.close()
+    outfile.close()
+
+    dt = time.time() - t0
+    if verbose:
+        print('3D data read: %.1f MB in %.1f s (%.1f MB/s), workers: %d'
+              % (nbytes/1e6, dt, nbytes/1e6/max(dt, 1e-9), workers))
+    return dt
+
+
+def _write_next(pending):
+    """
+    Wait for the oldest pending slab and write it; returns the bytes read for it
+    """
+    outvar, index, result = pending.popleft()
+    out, nbytes = result.get()
+    outvar[index] = out
+    return nbytes
+
+
+def scaling(infname, ofname, worker_counts, max_bytes=SLAB_BYTES, output=None):
+    """
+    Run the reduction for each number of workers and print the wall clock
+    time and speedup relative to the first entry.
+    """
+    times = []
+    for workers in worker_counts:
+        times.append(reduce_layers(infname, ofname, max_bytes, workers, output, verbose=False))
+        print('workers %3d: %8.2f s  speedup %5.2f' % (workers, times[-1], times[0]/times[-1]))
+    return times
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='halve the number of layers in a restart file')
+    parser.add_argument('infname', help='input restart file')
+    parser.add_argument('ofname', help='output restart file')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes (default 1: serial)')
+    parser.add_argument('--slab-mb', type=float, default=SLAB_BYTES/1024**2,
+                        help='maximum size of one slab in MB (default %(default)s)')
+    parser.add_argument('--scaling', default=None,
+                        help='comma separated worker counts to time, e.g. 1,2,4,8,20,40')
+    add_output_arguments(parser)
+    args = parser.parse_args()
+
+    max_bytes = int(args.slab_mb*1024**2)
+    if args.scaling:
+        scaling(args.infname, args.ofname, [int(n) for n in args.scaling.split(',')],
+                max_bytes, output_format(args))
+    elif args.compare_formats:
+        compare_formats(lambda fname, output: reduce_layers(args.infname, fname, max_bytes, args.workers,
+                                                            output, verbose=False),
+                        args.ofname, args.complevel)
+    else:
+        reduce_layers(args.infname, args.ofname, max_bytes, args.workers, output_format(args))
@@ -0,0 +1,149 @@
+#! /usr/bin/env python
+
+# combines two restart files in a single pass:
+# an early one (taking the physics)
+# a later one (taking the biology)
+#
+# Replaces the chain of ncks -A calls in mix_restartfiles_2025: both inputs are
+# opened once and every output variable is copied once, slab by slab, from the
+# source given in the variable-to-source mapping. No temporary copies are made,
+# so the I/O is the size of the output file.
+# Usage:
+#   python mix_restartfiles.py phys.nc bio.nc out.nc [--tempsalt-from-phys 1] [--spm-from-phys 0]
+#   python mix_restartfiles.py phys.nc bio.nc out.nc --var O3c=phys --var Mcac=bio
+
+import argparse
+import time
+from netCDF4 import Dataset
+
+from hotstart_io import slabs, SLAB_BYTES, OutputFormat, add_output_arguments, output_format
+
+# variables in the order in which mix_restartfiles_2025 adds them
+TIME_VARS = ['loop', 'julianday', 'secondsofday', 'timestep']
+AXES = ['xax', 'yax', 'zax']
+PHYS_VARS = ['z', 'zo', 'U', 'SlUx', 'Slru', 'V', 'SlVx', 'Slrv', 'ssen', 'ssun', 'ssvn',
+             'sseo', 'ssuo', 'ssvo', 'Uint', 'Vint', 'Uadv', 'Vadv', 'uu', 'vv', 'ww',
+             'uuEx', 'vvEx', 'tke', 'eps', 'num', 'nuh', 'ho', 'hn']
+TEMPSALT_VARS = ['T', 'S']
+SPM_VARS = ['R9x']
+BIO_VARS = ['numc', 'numbc', 'start_3d', 'start_2d',
+            'O2o', 'N1p', 'N3n', 'N4n', 'N5s', 'N6r', 'B1c', 'B1n', 'B1p', 'Bac',
+            'P1c', 'P1n', 'P1p', 'P1l', 'P1s', 'P2c', 'P2n', 'P2p', 'P2l', 'P3c', 'P3n', 'P3p', 'P3l',
+            'P4c', 'P4n', 'P4p', 'P4l', 'P5c', 'P5n', 'P5p', 'P5l', 'P5s', 'P6c', 'P6n', 'P6p', 'P6l', 'Pcc',
+            'R1c', 'R1n', 'R1p', 'R2c', 'R2n', 'R3c', 'R6c', 'R6n', 'R6p', 'R6s', 'RZc', 'O3c', 'O3h',
+            'Z3c', 'Z4c', 'Z2c', 'Z5c', 'Z6c', 'BP1c', 'BP1n', 'BP1p', 'BP1l', 'BP1s',
+            'Y1c', 'Y1n', 'Y1p', 'Y2c', 'Y2n', 'Y2p', 'Y4c', 'Y4n', 'Y4p', 'Y5c', 'Y5n', 'Y5p',
+            'Yy3c', 'Yy3n', 'Yy3p', 'Y3c', 'Y3n', 'Y3p', 'Ys3c', 'Q6c', 'Q6n', 'Q6p', 'Q6s',
+            'Q9x', 'Qp9x', 'QSx', 'Qun', 'Q1un', 'Q2un', 'Q2c', 'Q2n', 'Q12c', 'Q12n', 'Q1c', 'Q1n', 'Q1p',
+            'Q11c', 'Q11n', 'Q11p', 'Q21c', 'Q21n', 'Q21p', 'H1c', 'H1n', 'H1p', 'H2c', 'H2n', 'H2p',
+            'H3c', 'H3n', 'H3p', 'HNc', 'HNn', 'HNp', 'Hac', 'Kp1p', 'Kp3n', 'Kp4n', 'Kn4n', 'Kp5s',
+            'Qpun', 'K1p', 'K11p', 'K21p', 'K4n', 'K14n', 'K24n', 'K5s', 'K15s', 'K6r', 'K16r', 'K26r', 'K3n',
+            'K13n', 'K23n', 'G2o', 'G4n', 'Dfm', 'Dcm', 'Dlm', 'D1m', 'D2m', 'D6m', 'D7m', 'D8m', 'D9m', 'DSm',
+            'DH2m', 'DH3m', 'irri_bio', 'G3c', 'G3h', 'G13c', 'G13h', 'G23c', 'G23h']
+
+
+def default_mapping(tempsalt_from_phys=True, spm_from_phys=False):
+    """
+    Variable-to-source mapping of mix_restartfiles_2025, as an ordered list of
+    (variable, 'phys' or 'bio').
+    tempsalt_from_phys: take T and S from the physics file, else from the bio file
+    spm_from_phys: take the SPM (R9x) from the physics file, else from the bio file
+    """
+    mapping = [(v, 'phys') for v in TIME_VARS + AXES + PHYS_VARS]
+    mapping += [(v, 'phys' if tempsalt_from_phys else 'bio') for v in TEMPSALT_VARS]
+    mapping += [(v, 'phys' if spm_from_phys else 'bio') for v in SPM_VARS]
+    mapping += [(v, 'bio') for v in BIO_VARS]
+    return mapping
+
+
+def mix_restarts(physfname, biofname, ofname, mapping, output=None,
+                 max_bytes=SLAB_BYTES, verbose=True):
+    """
+    Write ofname with every variable of mapping copied from its source file.
+    mapping: ordered list of (variable, 'phys' or 'bio'); a later entry for
+             the same variable replaces the source of an earlier one
+    Variables missing in their source are skipped with a warning.
+    Global attributes are taken from the bio file, overwritten by the physics
+    file (restart_date and time come from the physics).
+    """
+    t0 = time.time()
+    if output is None:
+        output = OutputFormat()
+    sources = {'phys': Dataset(physfname, 'r'), 'bio': Dataset(biofname, 'r')}
+    for f in sources.values():
+        f.set_auto_mask(False)
+
+    # keep the first position of a variable, the last source given for it
+    order = []
+    source = {}
+    for varname, src in mapping:
+        if src not in sources:
+            raise ValueError('unknown source %s for %s, use phys or bio' % (src, varname))
+        if varname not in source:
+            order.append(varname)
+        source[varname] = src
+
+    outfile = output.create(ofname)
+    for src in ('bio', 'phys'):
+        for att in sources[src].ncattrs():
+            setattr(outfile, att, getattr(sources[src], att))
+
+    # define dimensions and variables
+    copies = []
+    for varname in order:
+        infile = sources[source[varname]]
+        if varname not in infile.variables:
+            print('WARNING: %s not in %s file, skipped' % (varname, source[varname]))
+            continue
+        var = infile.variables[varname]
+        for dimname in var.dimensions:
+            dim = infile.dimensions[dimname]
+            if dimname not in outfile.dimensions:
+                outfile.createDimension(dimname, None if dim.isunlimited() else len(dim))
+            elif len(outfile.dimensions[dimname]) != len(dim) and not dim.isunlimited():
+                raise ValueError('dimension %s of %s has length %d in the %s file, %d in the output'
+                                 % (dimname, varname, len(dim), source[varname],
+                                    len(outfile.dimensions[dimname])))
+        outvar = output.variable(outfile, varname, var.dtype, var.dimensions,
+                                 fill_value=getattr(var, '_FillValue', None))
+        for att in var.ncattrs():
+            if att != '_FillValue':
+                setattr(outvar, att, getattr(var, att))
+        copies.append((var, outvar))
+
+    # one sequential pass over the output
+    for var, outvar in copies:
+        if verbose:
+            print('%-12s from %s' % (var.name, source[var.name]))
+        if len(var.dimensions) < 2:
+            outvar[...] = var[...]
+            continue
+        axis = 1 if len(var.dimensions) == 3 else 0
+        for index in slabs(var.shape, var.dtype.itemsize, axis=axis, max_bytes=max_bytes,
+                           align=output.align):
+            outvar[index] = var[index]
+
+    for f in sources.values():
+        f.close()
+    outfile.close()
+    if verbose:
+        print('%d variables written in %.1f s' % (len(copies), time.time()-t0))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='combine a physics and a bio restart file')
+    parser.add_argument('physfname', help='restart file taking the physics')
+    parser.add_argument('biofname', help='restart file taking the biology')
+    parser.add_argument('ofname', help='output restart file')
+    parser.add_argument('--tempsalt-from-phys', type=int, default=1, choices=(0, 1),
+                        help='1: T and S from the physics file (default), 0: from the bio file')
+    parser.add_argument('--spm-from-phys', type=int, default=0, choices=(0, 1),
+                        help='1: R9x from the physics file, 0: from the bio file (default)')
+    parser.add_argument('--var', action='append', default=[], metavar='NAME=SOURCE',
+                        help='add a variable or change its source (phys or bio); can be repeated')
+    add_output_arguments(parser, compare=False)
+    args = parser.parse_args()
+
+    mapping = default_mapping(args.tempsalt_from_phys == 1, args.spm_from_phys == 1)
+    mapping += [tuple(item.split('=', 1)) for item in args.var]
+    mix_restarts(args.physfname, args.biofname, args.ofname, mapping, output_format(args))
@@ -0,0 +1,171 @@
+#! /usr/bin/env python
+
+# python script to remap a restart file from N to M layers in a single pass
+# (any M, e.g. the nwes layers onto the kmax=15 of dws_200m)
+#
+# The remap works in layer index space: new layer m covers the old layers
+# between m*N/M and (m+1)*N/M, so the weight matrix W (M x N) is the same for
+# every water column and is built once for the whole file. Level 0 is kept.
+#   ho, hn            : h_new = W h             (thickness is conserved)
+#   uu, vv, uuEx, vvEx: u_new = W u             (layer transports and their
+#                                                 explicit terms, the depth
+#                                                 integral is conserved)
+#   all other 3D vars : c_new = W (h c) / W h   (integrated h*c is conserved)
+# where h is the layer thickness (hn by default). Columns without thickness
+# (dry or land) get the unweighted average. The other 3D variables on
+# interfaces (ww, tke, eps, num, nuh) are treated like the tracers, as in
+# reduce_layers_hotstart.py.
+#
+# The file is read slab by slab: for each block of rows the thickness is read
+# once and all 3D variables are remapped, so memory stays at one slab.
+# Usage:
+#   python remap_layers_hotstart.py restart_in.nc restart_out.nc --layers 15 [--output-format zlib]
+#   python remap_layers_hotstart.py bio_in.nc bio_out.nc --layers 15 --thickness-file hydro_in.nc
+
+import argparse
+import time
+from netCDF4 import Dataset
+import numpy as np
+
+from hotstart_io import (copy_attributes, slabs, SLAB_BYTES, OutputFormat,
+                         add_output_arguments, output_format, compare_formats)
+from layer_reduction import SUM_VARS
+
+# layer integrated transports, summed like the thicknesses
+TRANSPORT_VARS = ('uu', 'vv', 'uuEx', 'vvEx')
+
+
+def remap_weights(nold, nnew):
+    """
+    Overlap of the old and new layers in layer index space.
+    nold, nnew: number of layers, level 0 not included
+    Returns W (nnew, nold); row m holds the fraction of each old layer in new layer m.
+    """
+    old_edges = np.arange(nold+1, dtype=np.float64)
+    new_edges = np.arange(nnew+1, dtype=np.float64)*nold/nnew
+    lower = np.maximum(new_edges[:-1, None], old_edges[None, :-1])
+    upper = np.minimum(new_edges[1:, None], old_edges[None, 1:])
+    return np.clip(upper - lower, 0, None)
+
+
+def remap_block(weights, block, thickness=None, summed=False):
+    """
+    Remap a (zax, ...) block with levels 0..N to levels 0..M.
+    weights: W from remap_weights(N, M)
+    thickness: (zax, ...) layer thickness for the same block, or None
+    summed: the variable is a thickness and is added up
+    """
+    if block.dtype.kind != 'f':
+        block = block.astype(np.float64)
+    out = np.empty((weights.shape[0]+1,) + block.shape[1:], dtype=np.float64)
+    out[0] = block[0]
+    if summed:
+        out[1:] = np.tensordot(weights, block[1:], axes=(1, 0))
+        return out
+
+    # unweighted average, used where there is no thickness
+    average = np.tensordot(weights/weights.sum(axis=1)[:, None], block[1:], axes=(1, 0))
+    if thickness is None:
+        out[1:] = average
+        return out
+    h = thickness[1:]
+    hnew = np.tensordot(weights, h, axes=(1, 0))
+    content = np.tensordot(weights, h*block[1:], axes=(1, 0))
+    wet = hnew > 0
+    out[1:] = np.where(wet, content/np.where(wet, hnew, 1), average)
+    return out
+
+
+def remap_layers(infname, ofname, nlayers, thickness='hn', thickness_file=None,
+                 sum_vars=SUM_VARS+TRANSPORT_VARS, max_bytes=SLAB_BYTES, output=None, verbose=True):
+    """
+    Write a copy of restart file infname with nlayers layers (zax=nlayers+1) to ofname.
+    thickness: name of the layer thickness variable used as weight
+    thickness_file: file to take the thickness from (e.g. the hydro restart
+                    for a bio restart); default infname
+    sum_vars: variables that are summed instead of averaged
+    output: OutputFormat of ofname, default NETCDF3_CLASSIC
+    """
+    t0 = time.time()
+    if output is None:
+        output = OutputFormat()
+    infile = Dataset(infname, 'r')
+    infile.set_auto_mask(False)
+    hfile = infile if thickness_file is None else Dataset(thickness_file, 'r')
+    hfile.set_auto_mask(False)
+
+    nold = len(infile.dimensions['zax']) - 1
+    weights = remap_weights(nold, nlayers)
+    if verbose:
+        print('remapping %d to %d layers' % (nold, nlayers))
+
+    hvar = hfile.variables.get(thickness)
+    if hvar is None:
+        print('WARNING: no %s in %s, using unweighted averages' % (thickness, hfile.filepath()))
+    else:
+        # the thickness must be on the grid of the 3D variables (e.g. a --thickness-file of another run)
+        shapes = set(var.shape for var in infile.variables.values()
+                     if len(var.dimensions) == 3 and var.dimensions[0] == 'zax')
+        if shapes and shapes != {hvar.shape}:
+            raise ValueError('%s in %s has shape %s, the 3D variables of %s %s'
+                             % (thickness, hfile.filepath(), hvar.shape, infname,
+                                ', '.join(str(shape) for shape in sorted(shapes))))
+
+    outfile = output.create(ofname)
+    for dimname, dim in infile.dimensions.items():
+        outfile.createDimension(dimname, nlayers+1 if dimname == 'zax' else len(dim))
+
+    # define all variables, write the small ones, collect the 3D ones
+    layered = []
+    for varname, var in infile.variables.items():
+        outvar = output.variable(outfile, varname, var.dtype, var.dimensions)
+        copy_attributes(var, outvar)
+        if len(var.dimensions) == 3 and var.dimensions[0] == 'zax':
+            layered.append((var, outvar))
+    for varname, var in infile.variables.items():
+        if varname == 'zax':
+            outfile.variables[varname][:] = np.arange(nlayers+1, dtype=var.dtype)
+        elif not (len(var.dimensions) == 3 and var.dimensions[0] == 'zax'):
+            outfile.variables[varname][:] = var[:]
+
+    # one pass over the file: per slab, read the thickness once, remap every variable
+    if layered:
+        shape = layered[0][0].shape
+        itemsize = max(var.dtype.itemsize for var, outvar in layered)
+        for index in slabs(shape, itemsize, max_bytes=max_bytes, align=output.align):
+            h = None if hvar is None else hvar[index]
+            for var, outvar in layered:
+                summed = var.name in sum_vars
+                outvar[index] = remap_block(weights, var[index], None if summed else h, summed)
+
+    if hfile is not infile:
+        hfile.close()
+    infile.close()
+    outfile.close()
+    if verbose:
+        print('%d 3D variables remapped in %.1f s' % (len(layered), time.time()-t0))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='remap a restart file to another number of layers')
+    parser.add_argument('infname', help='input restart file')
+    parser.add_argument('ofname', help='output restart file')
+    parser.add_argument('--layers', type=int, required=True,
+                        help='number of layers in the output (kmax), e.g. 15 for dws_200m')
+    parser.add_argument('--thickness', default='hn',
+                        help='layer thickness variable used as weight (default %(default)s)')
+    parser.add_argument('--thickness-file', default=None,
+                        help='restart file with the thickness variable (default: the input file)')
+    parser.add_argument('--sum-vars', default=','.join(SUM_VARS+TRANSPORT_VARS),
+                        help='comma separated variables that are summed (default %(default)s)')
+    add_output_arguments(parser)
+    args = parser.parse_args()
+
+    def write(fname, output, verbose=True):
+        remap_layers(args.infname, fname, args.layers, args.thickness, args.thickness_file,
+                     tuple(args.sum_vars.split(',')), output=output, verbose=verbose)
+
+    if args.compare_formats:
+        compare_formats(lambda fname, output: write(fname, output, False), args.ofname, args.complevel)
+    else:
+        write(args.ofname, output_format(args))
@@ -0,0 +1,228 @@
+#! /usr/bin/env python
+
+# converts a set of per-rank restart files from one subdomain decomposition
+# to another (e.g. Configurations/32x32, 239 ranks -> Configurations/42x42, 145 ranks)
+# without going through a global file
+#
+# For every new tile only the overlapping parts of the old tiles are read and
+# copied, variable by variable, so memory stays at one tile of one variable
+# per process. The new tiles are written per row band by a pool of workers.
+# Before anything is written both decompositions are checked against the
+# mask: every wet cell must be in exactly one tile. While copying, the wet
+# cells written to every new tile are counted, so a wet cell that receives no
+# value, or two, is reported. Cells of a new tile not covered by an old tile
+# (land, or outside the grid) get --fill; xax/yax are extrapolated there.
+# Usage:
+#   python retile_restart.py old_spec.lst outdir_old new_spec.lst outdir_new --mask dws_200m.mask [--workers 8]
+#   python retile_restart.py old_spec.lst outdir new_spec.lst hotdir --mask dws_200m.mask \
+#       --in-pattern restart.%04d.out --out-pattern restart.%04d.in
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from netCDF4 import Dataset
+import numpy as np
+
+from hotstart_io import OutputFormat, add_output_arguments, output_format
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from getm_subdomains import read_subdomain_spec, read_mask, check_coverage, overlap
+
+# names of the horizontal dimensions of a restart file
+XAX = 'xax'
+YAX = 'yax'
+
+
+def fill_axis(values, known):
+    """
+    Fill the unknown values of a 1D coordinate by linear extrapolation of the known ones
+    """
+    idx = np.flatnonzero(known)
+    if len(idx) == 0 or known.all():
+        return values
+    if len(idx) == 1:
+        step = 1
+    else:
+        step = (values[idx[-1]] - values[idx[0]])/(idx[-1] - idx[0])
+    missing = np.flatnonzero(~known)
+    nearest = idx[np.abs(idx[None, :] - missing[:, None]).argmin(axis=1)]
+    values[missing] = values[nearest] + (missing - nearest)*step
+    return values
+
+
+def retile_band(ranks, old, new, infnames, outfnames, mask, fill, output):
+    """
+    Write the new restart files of the ranks of one row band of the new spec.
+    old, new: SubdomainSpec of the input and output files
+    infnames, outfnames: file name per rank of old and new
+    mask: (jextr, iextr) mask, or None
+    Returns (number of files written, number of wet cells not written exactly once).
+    """
+    parts = {}
+    for rank in ranks:
+        tb = new.bounds(rank)
+        parts[rank] = [(src, ov) for src, ov in ((src, overlap(old.bounds(src), tb))
+                                                 for src in range(old.nranks)) if ov is not None]
+        if not parts[rank]:
+            raise ValueError('new rank %d does not overlap any old tile' % rank)
+    sources = sorted(set(src for rank in ranks for src, ov in parts[rank]))
+    infiles = {}
+    for src in sources:
+        infiles[src] = Dataset(infnames[src], 'r')
+        infiles[src].set_auto_mask(False)
+    # halo of the input files, if they are larger than the tiles
+    halo = {}
+    for src, infile in infiles.items():
+        halo[src] = (len(infile.dimensions[XAX]) - old.imax)//2
+        if len(infile.dimensions[YAX]) - 2*halo[src] != old.jmax:
+            raise ValueError('%s: %dx%d values, tiles are %dx%d'
+                             % (infnames[src], len(infile.dimensions[XAX]),
+                                len(infile.dimensions[YAX]), old.imax, old.jmax))
+
+    bad = 0
+    for rank in ranks:
+        ti0, ti1, tj0, tj1 = new.bounds(rank)
+        first = infiles[parts[rank][0][0]]
+        outfile = output.create(outfnames[rank])
+        outfile.setncatts({att: first.getncattr(att) for att in first.ncattrs()})
+        for dimname, dim in first.dimensions.items():
+            if dimname == XAX:
+                length = new.imax
+            elif dimname == YAX:
+                length = new.jmax
+            else:
+                length = None if dim.isunlimited() else len(dim)
+            outfile.createDimension(dimname, length)
+
+        # wet cells of the tile written so far, to check the coverage
+        written = np.zeros((new.jmax, new.imax), dtype=int)
+        counted = False
+        for varname, var in first.variables.items():
+            outvar = output.variable(outfile, varname, var.dtype, var.dimensions,
+                                     fill_value=getattr(var, '_FillValue', None))
+            outvar.setncatts({att: var.getncattr(att) for att in var.ncattrs() if att != '_FillValue'})
+            dims = var.dimensions
+            if XAX not in dims and YAX not in dims:
+                outvar[...] = var[...]
+                continue
+            shape = [len(outfile.dimensions[d]) for d in dims]
+            out = np.full(shape, fill, dtype=var.dtype)
+            known = np.zeros(shape[0], dtype=bool) if len(dims) == 1 else None
+            for src, (i0, i1, j0, j1) in parts[rank]:
+                si0, si1, sj0, sj1 = old.bounds(src)
+                h = halo[src]
+                inindex = []
+                outindex = []
+                for d in dims:
+                    if d == XAX:
+                        inindex.append(slice(i0 - si0 + h, i1 - si0 + h))
+                        outindex.append(slice(i0 - ti0, i1 - ti0))
+                    elif d == YAX:
+                        inindex.append(slice(j0 - sj0 + h, j1 - sj0 + h))
+                        outindex.append(slice(j0 - tj0, j1 - tj0))
+                    else:
+                        inindex.append(slice(None))
+                        outindex.append(slice(None))
+                out[tuple(outindex)] = infiles[src].variables[varname][tuple(inindex)]
+                if known is not None:
+                    known[outindex[0]] = True
+                elif not counted and XAX in dims and YAX in dims:
+                    written[j0 - tj0:j1 - tj0, i0 - ti0:i1 - ti0] += 1
+            counted = counted or (XAX in dims and YAX in dims)
+            if known is not None and varname == dims[0]:
+                out = fill_axis(out.astype(np.float64), known).astype(var.dtype)
+            outvar[...] = out
+        outfile.close()
+
+        if mask is not None:
+            # wet cells of the tile inside the grid
+            wet = np.zeros_like(written, dtype=bool)
+            r0, r1 = max(tj0, 0), min(tj1, mask.shape[0])
+            c0, c1 = max(ti0, 0), min(ti1, mask.shape[1])
+            wet[r0-tj0:r1-tj0, c0-ti0:c1-ti0] = mask[r0:r1, c0:c1] > 0
+            bad += int(((written != 1) & wet).sum())
+
+    for infile in infiles.values():
+        infile.close()
+    return len(ranks), bad
+
+
+def retile_restart(old, indir, new, outdir, mask=None, fill=0, in_pattern='restart.%04d.out',
+                   out_pattern='restart.%04d.in', workers=1, output=None, verbose=True):
+    """
+    Write the restart files of decomposition new from those of decomposition old.
+    old, new: SubdomainSpec
+    indir, outdir: directories of the input and output files
+    mask: (jextr, iextr) mask for the coverage checks, or None to skip them
+    fill: value for cells without input (land), default 0
+    in_pattern, out_pattern: file name of a rank, formatted with the rank number
+    workers: number of processes, each writing whole row bands of new
+    Returns the wall clock time in seconds.
+    """
+    t0 = time.time()
+    if output is None:
+        output = OutputFormat()
+    if (old.iextr, old.jextr) != (new.iextr, new.jextr):
+        raise ValueError('the decompositions are for different grids: %dx%d and %dx%d'
+                         % (old.iextr, old.jextr, new.iextr, new.jextr))
+    if mask is not None:
+        nbad = check_coverage(old, mask, 'old') + check_coverage(new, mask, 'new')
+        if nbad:
+            raise ValueError('%d wet cells are not in exactly one tile, nothing written' % nbad)
+    infnames = [os.path.join(indir, in_pattern % rank) for rank in range(old.nranks)]
+    missing = [fname for fname in infnames if not os.path.exists(fname)]
+    if missing:
+        raise IOError('%d input files missing, e.g. %s' % (len(missing), missing[0]))
+    outfnames = [os.path.join(outdir, out_pattern % rank) for rank in range(new.nranks)]
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+
+    bands = new.row_bands()
+    tasks = [(ranks, old, new, infnames, outfnames, mask, fill, output) for joff, ranks in bands]
+    if workers > 1:
+        pool = multiprocessing.Pool(min(workers, len(bands)))
+        results = pool.starmap(retile_band, tasks)
+        pool.close()
+        pool.join()
+    else:
+        results = [retile_band(*task) for task in tasks]
+    nfiles = sum(n for n, bad in results)
+    nbad = sum(bad for n, bad in results)
+
+    dt = time.time() - t0
+    if verbose:
+        print('%d tiles of %dx%d -> %d tiles of %dx%d in %.1f s'
+              % (old.nranks, old.imax, old.jmax, nfiles, new.imax, new.jmax, dt))
+        if mask is not None:
+            print('wet cells not written exactly once: %d' % nbad)
+    if nbad:
+        raise ValueError('%d wet cells not written exactly once' % nbad)
+    return dt
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='convert per-rank restart files to another decomposition')
+    parser.add_argument('old_spec', help='subdomain_spec.lst of the input files')
+    parser.add_argument('indir', help='directory of the input files')
+    parser.add_argument('new_spec', help='subdomain_spec.lst of the output files')
+    parser.add_argument('outdir', help='directory for the output files')
+    parser.add_argument('--mask', default=None,
+                        help='GETM mask file (e.g. dws_200m.mask) for the coverage checks')
+    parser.add_argument('--fill', type=float, default=0,
+                        help='value for cells not in any input tile (default %(default)s)')
+    parser.add_argument('--in-pattern', default='restart.%04d.out',
+                        help='file name of an input rank (default %(default)s)')
+    parser.add_argument('--out-pattern', default='restart.%04d.in',
+                        help='file name of an output rank (default %(default)s)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes (default 1: serial)')
+    add_output_arguments(parser, compare=False)
+    args = parser.parse_args()
+
+    if args.mask is None:
+        print('WARNING: no --mask given, coverage not checked')
+    mask = None if args.mask is None else read_mask(args.mask)
+    retile_restart(read_subdomain_spec(args.old_spec), args.indir, read_subdomain_spec(args.new_spec),
+                   args.outdir, mask, args.fill, args.in_pattern, args.out_pattern, args.workers,
+                   output_format(args))
@@ -0,0 +1,230 @@
+#! /usr/bin/env python
+
+# splits a global restart file into the per-rank restart.NNNN.in files
+# of a GETM subdomain decomposition (Configurations/<conf>/*.subdomain_spec.lst)
+#
+# The ranks are grouped in row bands (same joff). For every band each
+# variable is read once, as the block of rows covering the band, and the
+# tiles of all ranks in the band are cut from it and written. Bands are
+# processed in parallel by a pool of workers, each with the global file open.
+# Tiles are the interior imax x jmax cells, grown by --halo cells on every side;
+# cells outside the global file copy the nearest edge cell, or get --fill.
+# A global file padded by add_rows_to_restartfile (e.g. 496 rows for
+# jextr=486) is detected from its size: the extra rows are taken to be at the
+# start of the axis, as add_rows does by default.
+# Usage:
+#   python split_restart.py restart_dws200m_2015_01.nc spec.lst outdir [--workers 8]
+#   python split_restart.py restart.nc spec.lst outdir --halo 2 --fill 0 --pattern restart.%04d.in
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from netCDF4 import Dataset
+import numpy as np
+
+from hotstart_io import OutputFormat, add_output_arguments, output_format
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from getm_subdomains import read_subdomain_spec, window_index
+
+# names of the horizontal dimensions of a restart file
+XAX = 'xax'
+YAX = 'yax'
+
+
+def file_offsets(infile, spec):
+    """
+    Number of extra columns and rows at the start of xax/yax of a global restart
+    file with respect to the spec grid (0 for an unpadded file).
+    """
+    offsets = {}
+    for dimname, n in ((XAX, spec.iextr), (YAX, spec.jextr)):
+        extra = len(infile.dimensions[dimname]) - n
+        if extra < 0:
+            raise ValueError('%s has %d values, the subdomain grid %d'
+                             % (dimname, len(infile.dimensions[dimname]), n))
+        offsets[dimname] = extra
+    return offsets
+
+
+def cut_tile(block, windows, fill=None):
+    """
+    Cut a tile out of a block.
+    windows: {axis position: (index, inside)} as returned by window_index,
+             index relative to the block
+    fill: value outside the file, None copies the nearest edge cell
+    """
+    for pos, (index, inside) in windows.items():
+        block = np.take(block, index, axis=pos)
+        if fill is not None and not inside.all():
+            outside = [slice(None)]*block.ndim
+            outside[pos] = ~inside
+            block[tuple(outside)] = fill
+    return block
+
+
+def cut_axis(values, index, inside, start):
+    """
+    Cut a 1D coordinate; values outside the file are extrapolated with the edge spacing.
+    start: unclipped first index of the window
+    """
+    out = values[index].astype(np.float64)
+    if not inside.all() and len(values) > 1:
+        wanted = np.arange(start, start + len(index))
+        step = np.where(wanted < 0, values[1]-values[0], values[-1]-values[-2])
+        out = out + (wanted - index)*step
+    return out.astype(values.dtype)
+
+
+# global file and decomposition of a worker process, set by _init_worker
+_infile = None
+_spec = None
+
+
+def _init_worker(infname, spec):
+    global _infile, _spec
+    _infile = Dataset(infname, 'r')
+    _infile.set_auto_mask(False)
+    _spec = spec
+
+
+def split_band(ranks, outdir, pattern, halo, fill, offsets, output):
+    """
+    Write the restart files of the ranks of one row band.
+    Returns the list of file names written.
+    """
+    infile, spec = _infile, _spec
+    ny = len(infile.dimensions[YAX])
+    nx = len(infile.dimensions[XAX])
+    bounds = [spec.bounds(rank, halo) for rank in ranks]
+    # rows of the file covering all tiles of the band
+    r0 = max(min(b[2] for b in bounds) + offsets[YAX], 0)
+    r1 = min(max(b[3] for b in bounds) + offsets[YAX], ny)
+
+    fnames = [os.path.join(outdir, pattern % rank) for rank in ranks]
+    outfiles = [output.create(fname) for fname in fnames]
+    windows = []
+    for outfile, (i0, i1, j0, j1) in zip(outfiles, bounds):
+        outfile.setncatts({att: infile.getncattr(att) for att in infile.ncattrs()})
+        for dimname, dim in infile.dimensions.items():
+            if dimname in (XAX, YAX):
+                length = i1 - i0 if dimname == XAX else j1 - j0
+            else:
+                length = None if dim.isunlimited() else len(dim)
+            outfile.createDimension(dimname, length)
+        cols = window_index(i0 + offsets[XAX], i1 + offsets[XAX], nx)
+        rows = window_index(j0 + offsets[YAX], j1 + offsets[YAX], ny)
+        windows.append({XAX: cols + (i0 + offsets[XAX],), YAX: rows + (j0 + offsets[YAX],)})
+
+    for varname, var in infile.variables.items():
+        outvars = []
+        for outfile in outfiles:
+            outvar = output.variable(outfile, varname, var.dtype, var.dimensions,
+                                     fill_value=getattr(var, '_FillValue', None))
+            outvar.setncatts({att: var.getncattr(att) for att in var.ncattrs() if att != '_FillValue'})
+            outvars.append(outvar)
+        dims = var.dimensions
+        if XAX not in dims and YAX not in dims:
+            values = var[...]
+            for outvar in outvars:
+                outvar[...] = values
+            continue
+        if len(dims) == 1:
+            values = var[:]
+            for outvar, window in zip(outvars, windows):
+                index, inside, start = window[dims[0]]
+                if varname == dims[0]:
+                    outvar[:] = cut_axis(values, index, inside, start)
+                else:
+                    outvar[:] = cut_tile(values, {0: (index, inside)}, fill)
+            continue
+        # the rows of the band, once for all its tiles
+        index = [slice(None)]*len(dims)
+        if YAX in dims:
+            index[dims.index(YAX)] = slice(r0, r1)
+        block = var[tuple(index)]
+        for outvar, window in zip(outvars, windows):
+            cuts = {}
+            for d in (XAX, YAX):
+                if d in dims:
+                    index, inside, start = window[d]
+                    cuts[dims.index(d)] = (index - (r0 if d == YAX else 0), inside)
+            outvar[...] = cut_tile(block, cuts, fill)
+
+    for outfile in outfiles:
+        outfile.close()
+    return fnames
+
+
+def split_restart(infname, spec, outdir, halo=0, fill=None, pattern='restart.%04d.in',
+                  workers=1, output=None, verbose=True):
+    """
+    Write one restart file per rank of spec (a SubdomainSpec) to outdir.
+    halo: number of cells added on every side of the imax x jmax tiles
+    fill: value for cells outside the global file, None copies the nearest edge cell
+    pattern: file name of a rank, formatted with the rank number
+    workers: number of processes, each writing whole row bands
+    Returns the wall clock time in seconds.
+    """
+    t0 = time.time()
+    if output is None:
+        output = OutputFormat()
+    bands = spec.row_bands()
+    pool = None
+    if workers > 1:
+        # start the workers before any file is opened in this process
+        pool = multiprocessing.Pool(min(workers, len(bands)), _init_worker, (infname, spec))
+
+    infile = Dataset(infname, 'r')
+    offsets = file_offsets(infile, spec)
+    infile.close()
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    if verbose:
+        print('%d ranks in %d row bands, tiles %dx%d + halo %d, file offsets %s'
+              % (spec.nranks, len(bands), spec.imax, spec.jmax, halo, offsets))
+
+    tasks = [(ranks, outdir, pattern, halo, fill, offsets, output) for joff, ranks in bands]
+    if pool is None:
+        _init_worker(infname, spec)
+        results = (split_band(*task) for task in tasks)
+    else:
+        results = pool.starmap(split_band, tasks)
+    nfiles = 0
+    for fnames in results:
+        nfiles += len(fnames)
+        if verbose:
+            print('%s .. %s' % (os.path.basename(fnames[0]), os.path.basename(fnames[-1])))
+    if pool is None:
+        _infile.close()
+    else:
+        pool.close()
+        pool.join()
+
+    dt = time.time() - t0
+    if verbose:
+        print('%d restart files written in %.1f s' % (nfiles, dt))
+    return dt
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='split a global restart file into per-rank restart files')
+    parser.add_argument('infname', help='global restart file')
+    parser.add_argument('specfname', help='subdomain_spec.lst of the decomposition')
+    parser.add_argument('outdir', help='directory for the per-rank files')
+    parser.add_argument('--halo', type=int, default=0,
+                        help='cells added on every side of a tile (default 0: the interior '
+                             'tile, as GETM reads and writes restart files)')
+    parser.add_argument('--fill', default='edge',
+                        help='value outside the global file, or edge to copy the nearest edge cell (default)')
+    parser.add_argument('--pattern', default='restart.%04d.in',
+                        help='file name of a rank (default %(default)s)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes (default 1: serial)')
+    add_output_arguments(parser, compare=False)
+    args = parser.parse_args()
+
+    fill = None if args.fill == 'edge' else float(args.fill)
+    split_restart(args.infname, read_subdomain_spec(args.specfname), args.outdir, args.halo, fill,
+                  args.pattern, args.workers, output_format(args))
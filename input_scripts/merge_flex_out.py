@@ -0,0 +1,281 @@
+#! /usr/bin/env python
+
+# merges the per-rank flex_out files of a GETM run into one global file
+# (replaces ncmerge in dws_200m/move_files)
+#
+# <runid>.<selection>.NNNN.nc of rank NNNN holds its tile (imax x jmax, or
+# with a halo on every side) along the xc and yc dimensions; the tile is put
+# at its place in the global grid from the subdomain_spec.lst, the halo and
+# the cells outside the grid are left out. Cells of no tile (all-land tiles)
+# get the fill value. Variables without xc/yc are copied from rank 0.
+# The output is NetCDF4 with chunks of one time step, all levels and
+# --chunk x --chunk cells (deflate with --complevel).
+# Time slices are merged one after the other: for each the ranks are read
+# in row bands by a pool of workers and the slice is written when complete,
+# so the memory use is one time slice of all variables. Only the time
+# slices that all ranks have written are merged; with --append an existing
+# output gets the slices it does not have yet, and with --follow this is
+# repeated while the model is still writing, until no new slices came for
+# --idle rounds.
+# Usage:
+#   python merge_flex_out.py dws_200m 2d --spec ../dws_200m/par_setup.dat --dir $out_dir --workers 8
+#   python merge_flex_out.py dws_200m 3d --spec par_setup.dat --append --follow 600
+
+import argparse
+import multiprocessing
+import os
+import time
+
+import numpy as np
+from netCDF4 import Dataset, default_fillvals
+
+from getm_subdomains import read_subdomain_spec
+
+# horizontal and time dimensions of the flex_out files
+XDIM = 'xc'
+YDIM = 'yc'
+TDIM = 'time'
+
+# horizontal chunk size of the output
+CHUNK = 128
+
+# attributes that are not copied
+SKIP_ATTS = ('_FillValue', 'chunksizes')
+
+PATTERN = '%s.%s.%04d.nc'
+
+
+def tile_window(spec, rank, nx, ny):
+    """
+    Where the tile of rank goes in the global grid, for a file with nx x ny cells:
+    (global j slice, global i slice, local j slice, local i slice), or None if it is outside
+    """
+    halo = (nx - spec.imax) // 2
+    if nx != spec.imax + 2*halo or ny != spec.jmax + 2*halo:
+        raise ValueError('rank %d: %d x %d cells, not a tile of %d x %d with a halo'
+                         % (rank, nx, ny, spec.imax, spec.jmax))
+    i0, i1, j0, j1 = spec.bounds(rank)
+    gi0, gi1 = max(i0, 0), min(i1, spec.iextr)
+    gj0, gj1 = max(j0, 0), min(j1, spec.jextr)
+    if gi0 >= gi1 or gj0 >= gj1:
+        return None
+    li0, lj0 = gi0 - i0 + halo, gj0 - j0 + halo
+    return (slice(gj0, gj1), slice(gi0, gi1),
+            slice(lj0, lj0 + gj1 - gj0), slice(li0, li0 + gi1 - gi0))
+
+
+def _index(dims, window, local, t=None):
+    """
+    Index of a variable with dims for the global (local=False) or the tile part of a window;
+    at time t if the variable has a time dimension
+    """
+    gj, gi, lj, li = window
+    index = []
+    for dim in dims:
+        if dim == TDIM:
+            if t is not None:
+                index.append(t)
+        elif dim == YDIM:
+            index.append(lj if local else gj)
+        elif dim == XDIM:
+            index.append(li if local else gi)
+        else:
+            index.append(slice(None))
+    return tuple(index)
+
+
+def _init_worker(paths, spec, layout):
+    global _paths, _spec, _layout
+    _paths, _spec, _layout = paths, spec, layout
+
+
+def read_band(ranks, t):
+    """
+    Tiles of the ranks at time t (None: the variables without time), in a worker:
+    a list of (window, {variable: values})
+    """
+    tiles = []
+    for rank in ranks:
+        with Dataset(_paths[rank]) as nc:
+            nc.set_auto_mask(False)
+            window = tile_window(_spec, rank, len(nc.dimensions[XDIM]), len(nc.dimensions[YDIM]))
+            if window is None:
+                continue
+            values = {}
+            for name, dims in _layout:
+                if (TDIM in dims) == (t is not None):
+                    values[name] = nc.variables[name][_index(dims, window, True, t)]
+            tiles.append((window, values))
+    return tiles
+
+
+def layout(nc):
+    """
+    The variables of a rank file that are merged: [(name, dims)] with an xc or yc dimension
+    """
+    return [(name, var.dimensions) for name, var in nc.variables.items()
+            if XDIM in var.dimensions or YDIM in var.dimensions]
+
+
+def create_output(fname, template, spec, complevel=1, chunk=CHUNK):
+    """
+    Create the global file with the dimensions, variables and attributes of a rank file
+    and write the variables without time and without xc/yc
+    """
+    out = Dataset(fname, 'w', format='NETCDF4')
+    out.setncatts(dict((att, template.getncattr(att)) for att in template.ncattrs()))
+    sizes = {XDIM: spec.iextr, YDIM: spec.jextr}
+    for name, dim in template.dimensions.items():
+        out.createDimension(name, None if dim.isunlimited() else sizes.get(name, len(dim)))
+    for name, var in template.variables.items():
+        shape = [1 if d == TDIM else len(out.dimensions[d]) for d in var.dimensions]
+        chunks = [min(n, chunk) if d in (XDIM, YDIM) else max(n, 1) for d, n in zip(var.dimensions, shape)]
+        fill = var.getncattr('_FillValue') if '_FillValue' in var.ncattrs() else None
+        horizontal = XDIM in var.dimensions or YDIM in var.dimensions
+        outvar = out.createVariable(name, var.datatype, var.dimensions, fill_value=fill,
+                                    zlib=complevel > 0 and horizontal, complevel=max(complevel, 1),
+                                    shuffle=True, chunksizes=chunks if var.dimensions else None)
+        outvar.setncatts(dict((att, var.getncattr(att)) for att in var.ncattrs() if att not in SKIP_ATTS))
+        if not horizontal and TDIM not in var.dimensions:
+            outvar[...] = var[...]
+    return out
+
+
+def _slice_buffers(out, variables, timed):
+    """
+    Arrays of one time slice (or of the variables without time) of the global file, fill values set
+    """
+    buffers = {}
+    for name, dims in variables:
+        if (TDIM in dims) != timed:
+            continue
+        var = out.variables[name]
+        shape = [len(out.dimensions[d]) for d in dims if d != TDIM]
+        fill = var.getncattr('_FillValue') if '_FillValue' in var.ncattrs() else \
+            default_fillvals[np.dtype(var.dtype).str[1:]]
+        buffers[name] = np.full(shape, fill, dtype=var.dtype)
+    return buffers
+
+
+def _merge(pool, bands, out, variables, t=None):
+    """
+    Read all tiles of time slice t (None: the variables without time) and write it
+    """
+    buffers = _slice_buffers(out, variables, t is not None)
+    if not buffers:
+        return
+    dims = dict(variables)
+    for tiles in pool.imap_unordered(_read_band_task, [(band, t) for band in bands]):
+        for window, values in tiles:
+            for name, data in values.items():
+                local_dims = [d for d in dims[name] if d != TDIM]
+                buffers[name][_index(local_dims, window, False)] = data
+    for name, data in buffers.items():
+        index = tuple(t if d == TDIM else slice(None) for d in dims[name])
+        out.variables[name][index] = data
+
+
+def _read_band_task(args):
+    return read_band(*args)
+
+
+def available_slices(paths, lag=0):
+    """
+    Number of time slices written by every rank (minus lag, for files still being written)
+    """
+    count = None
+    for path in paths:
+        with Dataset(path) as nc:
+            n = len(nc.dimensions[TDIM]) if TDIM in nc.dimensions else 0
+        count = n if count is None else min(count, n)
+    return max((count or 0) - lag, 0)
+
+
+def merge(runid, selection, spec, directory='.', out=None, append=False, workers=4, complevel=1,
+          chunk=CHUNK, lag=0, verbose=True):
+    """
+    Merge (or append to) the global file of one selection
+    Returns the number of time slices written.
+    """
+    paths = [os.path.join(directory, PATTERN % (runid, selection, rank)) for rank in range(spec.nranks)]
+    missing = [p for p in paths if not os.path.exists(p)]
+    if missing:
+        raise IOError('%d rank files missing, e.g. %s' % (len(missing), missing[0]))
+    out = out or os.path.join(directory, '%s.%s.nc' % (runid, selection))
+    with Dataset(paths[0]) as template:
+        variables = layout(template)
+        timed = [name for name, var in template.variables.items()
+                 if TDIM in var.dimensions and (name, var.dimensions) not in variables]
+    nslices = available_slices(paths, lag)
+    bands = [ranks for joff, ranks in spec.row_bands()]
+    t0 = time.time()
+
+    pool = multiprocessing.Pool(workers, _init_worker, (paths, spec, variables))
+    try:
+        if append and os.path.exists(out):
+            nc = Dataset(out, 'a')
+            done = len(nc.dimensions[TDIM])
+        else:
+            with Dataset(paths[0]) as template:
+                nc = create_output(out, template, spec, complevel, chunk)
+            _merge(pool, bands, nc, variables)
+            done = 0
+        with nc:
+            for t in range(done, nslices):
+                # time and other variables without xc/yc from rank 0
+                with Dataset(paths[0]) as first:
+                    for name in timed:
+                        index = tuple(t if d == TDIM else slice(None) for d in first.variables[name].dimensions)
+                        nc.variables[name][index] = first.variables[name][index]
+                _merge(pool, bands, nc, variables, t)
+                nc.sync()
+    finally:
+        pool.close()
+        pool.join()
+    written = max(nslices - done, 0)
+    if verbose:
+        print('%s: %d time slices written (%d in total) from %d ranks in %.1f s'
+              % (out, written, max(nslices, done), spec.nranks, time.time() - t0))
+    return written
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Merge the per-rank flex_out files of a GETM run')
+    parser.add_argument('runid', help='run id, e.g. dws_200m')
+    parser.add_argument('selections', nargs='+', help='output selections, e.g. 2d 3d mean')
+    parser.add_argument('--spec', required=True, help='subdomain_spec.lst of the run (e.g. par_setup.dat)')
+    parser.add_argument('--dir', default='.', help='directory of the rank files (default .)')
+    parser.add_argument('--out', default=None, help='output file (one selection; default <runid>.<selection>.nc)')
+    parser.add_argument('--workers', type=int, default=4, help='number of reading processes (default 4)')
+    parser.add_argument('--complevel', type=int, default=1, help='deflate level, 0 for none (default 1)')
+    parser.add_argument('--chunk', type=int, default=CHUNK, help='horizontal chunk size (default %d)' % CHUNK)
+    parser.add_argument('--append', action='store_true', help='add the new time slices to an existing output')
+    parser.add_argument('--follow', type=float, default=None, metavar='SECONDS',
+                        help='keep appending every SECONDS while the model writes')
+    parser.add_argument('--idle', type=int, default=3, help='with --follow: stop after this many rounds '
+                                                            'without new slices (default 3)')
+    args = parser.parse_args()
+    if args.out and len(args.selections) > 1:
+        parser.error('--out needs a single selection')
+
+    spec = read_subdomain_spec(args.spec)
+    # the last slice of a file that is still written may be incomplete
+    lag = 1 if args.follow else 0
+    idle = 0
+    first = True
+    while True:
+        written = 0
+        for selection in args.selections:
+            written += merge(args.runid, selection, spec, args.dir, args.out, args.append or not first,
+                             args.workers, args.complevel, args.chunk, lag)
+        first = False
+        if args.follow is None:
+            break
+        idle = 0 if written else idle + 1
+        if idle >= args.idle:
+            # the model stopped writing: the last slices are complete now
+            for selection in args.selections:
+                merge(args.runid, selection, spec, args.dir, args.out, True, args.workers, args.complevel,
+                      args.chunk)
+            break
+        time.sleep(args.follow)
@@ -0,0 +1,234 @@
+#! /usr/bin/env python
+
+# search for a good GETM subdomain decomposition of a grid mask
+#
+# For every tile size in a range and every offset of the first tile, the
+# wet cells of all tiles are counted at once from the summed area table of
+# the mask (no loop over tiles), all-land tiles are dropped as GETM does, and
+# the halo exchange is derived from the neighbour rule of the
+# subdomain_spec.lst (a link only where both halo strips hold wet cells, see
+# getm_subdomains.decompose). Per candidate:
+#   ranks      number of tiles with wet cells
+#   max wet    wet cells of the busiest tile
+#   imbalance  max / mean wet cells per tile
+#   halo       halo cells received over all tiles / wet cells
+#   load       max over the tiles of wet + --halo-weight * halo cells,
+#              the candidates are ranked by it (then by fewer ranks)
+# Only candidates that fit on --nodes nodes of --cores cores are kept.
+# With --write the spec, safe spec, machine file and dim file of the chosen
+# candidate are written in the layout of dws_200m/Configurations:
+#   <out>/<imax>x<jmax>/dws_200m.mask.size<imax>x<jmax>_offset<i>x<j>_nodes<n>.*
+# The machine file fills the nodes in rank order with placeholder names
+# n01, n02, ... (replaced by make_machinefile_qsub) or the hosts of --hosts.
+# Usage:
+#   python optimize_subdomains.py ../dws_200m/dws_200m.mask --nodes 6 --cores 40 --sizes 24 48
+#   python optimize_subdomains.py ../dws_200m/dws_200m.mask --nodes 4 --cores 40 --sizes 30 50 \
+#       --rectangular --write ../dws_200m/Configurations --kmax 30
+
+import argparse
+import os
+
+import numpy as np
+
+from getm_subdomains import (DIRECTIONS, HALO, read_mask, decompose, spec_name, write_subdomain_spec,
+                             write_dim, write_machine_file, fill_nodes)
+
+# candidate fields, in the order of the table
+FIELDS = ('imax', 'jmax', 'ioff', 'joff', 'ranks', 'max_wet', 'imbalance', 'halo', 'load')
+
+
+def read_bathymetry_mask(fname, varname='bathymetry', land_value=-10.):
+    """
+    Mask (jextr, iextr), 1 wet 0 land, of the bathymetry of a topo file;
+    land where the bathymetry is missing or not above land_value
+    """
+    from netCDF4 import Dataset
+    with Dataset(fname) as nc:
+        var = nc.variables[varname]
+        bathy = np.ma.filled(var[:].astype(float), np.nan)
+        if var.dimensions[0].startswith('x'):
+            bathy = bathy.T
+    return (np.isfinite(bathy) & (bathy > land_value)).astype(int)
+
+
+def summed_area(mask):
+    """
+    Summed area table of the wet cells of mask: S[j, i] = wet cells in [0, j) x [0, i)
+    """
+    wet = (mask > 0).astype(np.int32)
+    table = np.zeros((wet.shape[0]+1, wet.shape[1]+1), dtype=np.int32)
+    table[1:, 1:] = wet.cumsum(axis=0).cumsum(axis=1)
+    return table
+
+
+class WetCounter(object):
+    """
+    Wet cells in index ranges [i0, i1) x [j0, j1), clipped to the grid, for all combinations
+    of the rows of i0, i1 (A, ni) and j0, j1 (B, nj) as (A, B, nj, ni) arrays, from the
+    summed area table. The table values at the corners are gathered once per pair of
+    corner index arrays (the tiles and their halo strips share most of them).
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.corners = {}
+
+    def corner(self, key, j, i):
+        if key not in self.corners:
+            jextr, iextr = self.table.shape[0]-1, self.table.shape[1]-1
+            rows = self.table.take(np.clip(j, 0, jextr).ravel(), axis=0)
+            corner = rows.take(np.clip(i, 0, iextr).ravel(), axis=1)
+            self.corners[key] = corner.reshape(j.shape + i.shape).transpose(2, 0, 1, 3)
+        return self.corners[key]
+
+    def count(self, i0, i1, j0, j1):
+        """i0, i1, j0, j1: (key, array) pairs"""
+        return (self.corner((j1[0], i1[0]), j1[1], i1[1]) - self.corner((j0[0], i1[0]), j0[1], i1[1])
+                - self.corner((j1[0], i0[0]), j1[1], i0[1]) + self.corner((j0[0], i0[0]), j0[1], i0[1]))
+
+
+def _shift(a, di, dj):
+    """
+    Value of the neighbouring tile (di, dj) along the last two axes (j, i), False/0 outside
+    """
+    out = np.zeros_like(a)
+    nj, ni = a.shape[-2:]
+    out[..., max(-dj, 0):nj-max(dj, 0), max(-di, 0):ni-max(di, 0)] = \
+        a[..., max(dj, 0):nj-max(-dj, 0), max(di, 0):ni-max(-di, 0)]
+    return out
+
+
+def evaluate(table, imax, jmax, ioffs, joffs, halo=HALO, halo_weight=1.):
+    """
+    Decompositions into tiles of imax x jmax for all first tile offsets ioffs x joffs
+    table: summed area table of the mask
+    Returns a dict of (len(ioffs), len(joffs)) arrays: ranks, max_wet, imbalance, halo, load
+    """
+    jextr, iextr = table.shape[0]-1, table.shape[1]-1
+    ni = -(-(iextr + imax - 1) // imax)
+    nj = -(-(jextr + jmax - 1) // jmax)
+    # tile origins, (A, ni) and (B, nj)
+    i0 = np.asarray(ioffs)[:, None] + imax*np.arange(ni)
+    j0 = np.asarray(joffs)[:, None] + jmax*np.arange(nj)
+    # tile edges and the inner edges of the halo strips, as (key, array)
+    i = {'0': ('0', i0), '0h': ('0h', i0+halo), '1h': ('1h', i0+imax-halo), '1': ('1', i0+imax)}
+    j = {'0': ('0', j0), '0h': ('0h', j0+halo), '1h': ('1h', j0+jmax-halo), '1': ('1', j0+jmax)}
+    counter = WetCounter(table)
+    wet = counter.count(i['0'], i['1'], j['0'], j['1'])
+    keep = wet > 0
+
+    # wet halo strips along every side and corner, a link where both strips are wet
+    strips = {}
+    for di, dj in DIRECTIONS:
+        si0, si1 = ('1h', '1') if di > 0 else ('0', '0h') if di < 0 else ('0', '1')
+        sj0, sj1 = ('1h', '1') if dj > 0 else ('0', '0h') if dj < 0 else ('0', '1')
+        strips[di, dj] = counter.count(i[si0], i[si1], j[sj0], j[sj1]) > 0
+    halo_cells = np.zeros(wet.shape, dtype=np.int64)
+    for di, dj in DIRECTIONS:
+        link = strips[di, dj] & _shift(strips[-di, -dj], di, dj)
+        size = (halo if di else imax) * (halo if dj else jmax)
+        halo_cells += link * size
+
+    ranks = keep.sum(axis=(2, 3))
+    total = wet.sum(axis=(2, 3))
+    max_wet = wet.max(axis=(2, 3))
+    load = np.where(keep, wet + halo_weight*halo_cells, 0).max(axis=(2, 3))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return {'ranks': ranks, 'max_wet': max_wet, 'imbalance': max_wet * ranks / total,
+                'halo': halo_cells.sum(axis=(2, 3)) / total, 'load': load}
+
+
+def search(mask, sizes, rectangular=False, offset_step=1, max_ranks=None, min_ranks=1, halo=HALO,
+           halo_weight=1.):
+    """
+    Evaluate all tile sizes (square, or all imax x jmax with rectangular) and offsets
+    (-size < offset <= 0, every offset_step) and return the candidates with
+    min_ranks <= ranks <= max_ranks as a structured array, best (lowest load) first
+    """
+    table = summed_area(mask)
+    pairs = [(i, j) for i in sizes for j in sizes] if rectangular else [(s, s) for s in sizes]
+    dtype = [(f, int) for f in FIELDS[:6]] + [(f, float) for f in FIELDS[6:]]
+    parts = []
+    for imax, jmax in pairs:
+        ioffs = np.arange(0, -imax, -offset_step)
+        joffs = np.arange(0, -jmax, -offset_step)
+        result = evaluate(table, imax, jmax, ioffs, joffs, halo, halo_weight)
+        ok = result['ranks'] >= min_ranks
+        if max_ranks is not None:
+            ok &= result['ranks'] <= max_ranks
+        a, b = np.nonzero(ok)
+        part = np.empty(len(a), dtype=dtype)
+        part['imax'], part['jmax'], part['ioff'], part['joff'] = imax, jmax, ioffs[a], joffs[b]
+        for f in FIELDS[4:]:
+            part[f] = result[f][a, b]
+        parts.append(part)
+    candidates = np.concatenate(parts) if parts else np.empty(0, dtype=dtype)
+    return np.sort(candidates, order=('load', 'ranks', 'imbalance'))
+
+
+def print_candidates(candidates, top=20):
+    print('  #  size      offset       ranks  max wet  imbalance   halo     load')
+    for n, c in enumerate(candidates[:top]):
+        print('%3d  %3dx%-3d  %+5dx%+-5d  %6d  %7d  %9.3f  %5.3f  %7.0f'
+              % ((n+1, c['imax'], c['jmax'], c['ioff'], c['joff'], c['ranks'], c['max_wet'],
+                  c['imbalance'], c['halo'], c['load'])))
+
+
+def write_configuration(mask, candidate, out_dir, nodes, cores, kmax, hosts=None, prefix='dws_200m.mask',
+                        setup='dws_200m'):
+    """
+    Write the spec, safe spec, machine and dim files of a candidate to <out_dir>/<imax>x<jmax>
+    Returns the base name of the files.
+    """
+    imax, jmax = int(candidate['imax']), int(candidate['jmax'])
+    spec = decompose(mask, imax, jmax, int(candidate['ioff']), int(candidate['joff']))
+    safe = decompose(mask, imax, jmax, int(candidate['ioff']), int(candidate['joff']), safe=True)
+    if spec.nranks != candidate['ranks']:
+        raise RuntimeError('%d ranks in the decomposition, %d evaluated' % (spec.nranks, candidate['ranks']))
+    directory = os.path.join(out_dir, '%dx%d' % (imax, jmax))
+    os.makedirs(directory, exist_ok=True)
+    name = os.path.join(directory, spec_name(prefix, spec, nodes))
+    write_subdomain_spec(name + '.subdomain_spec.lst', spec)
+    write_subdomain_spec(name + '.safe_subdomain_spec.lst', safe)
+    write_machine_file(name + '.machine_file', fill_nodes(spec.nranks, nodes, cores, hosts))
+    write_dim(os.path.join(directory, setup + '.dim'), spec, kmax)
+    return name
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Search tile sizes and offsets of a GETM decomposition')
+    parser.add_argument('mask', help='GETM mask file (e.g. dws_200m.mask) or topo NetCDF file (bathymetry)')
+    parser.add_argument('--nodes', type=int, required=True, help='number of nodes')
+    parser.add_argument('--cores', type=int, required=True, help='cores per node')
+    parser.add_argument('--sizes', type=int, nargs=2, default=(24, 48), metavar=('MIN', 'MAX'),
+                        help='range of tile sizes (default 24 48)')
+    parser.add_argument('--rectangular', action='store_true', help='also imax != jmax')
+    parser.add_argument('--offset-step', type=int, default=1, help='step of the offsets (default 1)')
+    parser.add_argument('--min-ranks', type=int, default=1, help='fewest ranks (default 1)')
+    parser.add_argument('--halo-weight', type=float, default=1., help='cost of a halo cell (default 1)')
+    parser.add_argument('--top', type=int, default=20, help='number of candidates shown (default 20)')
+    parser.add_argument('--write', metavar='OUT_DIR', help='write the files of a candidate to OUT_DIR/<size>')
+    parser.add_argument('--pick', type=int, default=1, help='candidate to write (default 1, the best)')
+    parser.add_argument('--kmax', type=int, help='number of layers in the dim file (with --write)')
+    parser.add_argument('--hosts', help='file with the host names, one per line (default n01, n02, ...)')
+    args = parser.parse_args()
+
+    if args.mask.endswith('.nc'):
+        mask = read_bathymetry_mask(args.mask)
+    else:
+        mask = read_mask(args.mask)
+    candidates = search(mask, range(args.sizes[0], args.sizes[1]+1), args.rectangular, args.offset_step,
+                        args.nodes*args.cores, args.min_ranks, halo_weight=args.halo_weight)
+    print('%d candidates on %d nodes of %d cores' % (len(candidates), args.nodes, args.cores))
+    print_candidates(candidates, args.top)
+    if args.write:
+        if args.kmax is None:
+            parser.error('--write needs --kmax')
+        hosts = None
+        if args.hosts:
+            with open(args.hosts) as f:
+                hosts = [line.split()[0] for line in f if line.strip()][:args.nodes]
+        name = write_configuration(mask, candidates[args.pick-1], args.write, args.nodes, args.cores,
+                                   args.kmax, hosts, os.path.basename(args.mask) if not
+                                   args.mask.endswith('.nc') else 'dws_200m.mask')
+        print('written:', name + '.*')
@@ -0,0 +1,206 @@
+#! /usr/bin/env python
+
+# placement of the GETM ranks on the nodes, keeping halo exchanges on a node
+#
+# The neighbour columns of the subdomain_spec.lst give the halo exchanges of
+# every rank; the weight of an exchange is the number of halo cells sent
+# (HALO rows along an edge of the tile, HALO x HALO at a corner). The ranks
+# are split over the nodes (at most --cores per node) so that the weight of
+# the exchanges between nodes (the cut) is small:
+#   1. recursive bisection of the tile positions, the number of ranks of
+#      each half in proportion to its number of nodes
+#   2. refinement: moves of single ranks to a node with free cores and swaps
+#      of two ranks between nodes, as long as the cut gets smaller
+# Written are a machine file (the host of every rank, one per line, as
+# make_machinefile_qsub and MPICH use it) and an OpenMPI rank file
+#   rank 0=no64 slot=0
+# that puts every rank on its own core of its node:
+#   mpirun --rankfile rankfile -np 239 ...   (instead of --bind-to core --hostfile)
+# The cut is compared with the machine file filled in rank order, the ranks
+# spread evenly over the nodes as optimize_subdomains writes it (fill_nodes).
+# Usage:
+#   python place_ranks.py ../dws_200m/par_setup.dat --nodes 6 --cores 40 --machinefile machinefile
+#   python place_ranks.py ../dws_200m/par_setup.dat --hosts ../dws_200m/new_hosts --cores 40 \
+#       --machinefile machinefile --rankfile rankfile
+
+import argparse
+from collections import defaultdict
+
+import numpy as np
+
+from getm_subdomains import (DIRECTIONS, HALO, read_subdomain_spec, read_machine_file, write_machine_file,
+                             fill_nodes)
+
+
+def halo_graph(spec, halo=HALO):
+    """
+    Halo exchange graph of a SubdomainSpec: {(a, b): halo cells} with a < b.
+    A link listed by only one of the two ranks counts as well.
+    """
+    edges = {}
+    for rank in range(spec.nranks):
+        for k, (di, dj) in enumerate(DIRECTIONS):
+            other = spec.neighbours[rank, k]
+            if other < 0:
+                continue
+            cells = (halo if di else spec.imax) * (halo if dj else spec.jmax)
+            key = (min(rank, other), max(rank, other))
+            edges[key] = max(edges.get(key, 0), cells)
+    return edges
+
+
+def cut(edges, part):
+    """
+    Halo cells exchanged between different parts and the number of such links
+    """
+    crossing = [w for (a, b), w in edges.items() if part[a] != part[b]]
+    return sum(crossing), len(crossing)
+
+
+def bisect(spec, nodes, cores):
+    """
+    Initial placement by recursive bisection of the tile centres. Each half gets
+    ranks in proportion to its nodes, the largest part at most cores ranks.
+    """
+    if spec.nranks > nodes*cores:
+        raise ValueError('%d ranks do not fit on %d nodes of %d cores' % (spec.nranks, nodes, cores))
+    x = spec.ioff + 0.5*spec.imax
+    y = spec.joff + 0.5*spec.jmax
+    part = np.zeros(spec.nranks, dtype=int)
+
+    def split(ranks, first, count):
+        if count == 1:
+            part[ranks] = first
+            return
+        low = count // 2
+        n_low = int(round(len(ranks) * low / float(count)))
+        # keep both halves within their capacity
+        n_low = min(max(n_low, len(ranks) - (count-low)*cores), low*cores)
+        coord = x[ranks] if np.ptp(x[ranks]) >= np.ptp(y[ranks]) else y[ranks]
+        order = ranks[np.lexsort((ranks, coord))]
+        split(order[:n_low], first, low)
+        split(order[n_low:], first + low, count - low)
+
+    split(np.arange(spec.nranks), 0, nodes)
+    return part
+
+
+def refine(edges, part, nodes, cores, max_passes=100):
+    """
+    Improve a placement by moves and swaps of ranks between nodes that lower the cut.
+    Returns the new placement.
+    """
+    part = np.array(part)
+    adjacent = defaultdict(dict)
+    for (a, b), w in edges.items():
+        adjacent[a][b] = w
+        adjacent[b][a] = w
+    load = np.bincount(part, minlength=nodes)
+
+    def links(rank):
+        """halo cells of rank to every node"""
+        to = defaultdict(int)
+        for other, w in adjacent[rank].items():
+            to[part[other]] += w
+        return to
+
+    for _ in range(max_passes):
+        improved = False
+        for rank in range(len(part)):
+            own = part[rank]
+            to = links(rank)
+            best = (0, None, None)
+            for node, w in to.items():
+                if node == own:
+                    continue
+                gain = w - to.get(own, 0)
+                if load[node] < cores and gain > best[0]:
+                    best = (gain, node, None)
+                # swap with a rank of that node
+                for other in np.flatnonzero(part == node):
+                    to_other = links(other)
+                    swap = gain + to_other.get(own, 0) - to_other.get(node, 0) - 2*adjacent[rank].get(other, 0)
+                    if swap > best[0]:
+                        best = (swap, node, other)
+            gain, node, other = best
+            if node is None:
+                continue
+            if other is None:
+                load[own] -= 1
+                load[node] += 1
+            else:
+                part[other] = own
+            part[rank] = node
+            improved = True
+        if not improved:
+            break
+    return part
+
+
+def place(spec, nodes, cores, halo=HALO):
+    """
+    Placement of the ranks of spec on nodes of cores cores: (node of every rank, halo graph)
+    """
+    edges = halo_graph(spec, halo)
+    return refine(edges, bisect(spec, nodes, cores), nodes, cores), edges
+
+
+def write_rankfile(fname, hosts):
+    """
+    Write an OpenMPI rank file: every rank on the next free core (slot) of its host
+    """
+    used = defaultdict(int)
+    with open(fname, 'w') as f:
+        for rank, host in enumerate(hosts):
+            f.write('rank %d=%s slot=%d\n' % (rank, host, used[host]))
+            used[host] += 1
+
+
+def report(name, edges, part):
+    total = sum(edges.values())
+    cells, links = cut(edges, part)
+    sizes = np.bincount(part)
+    print('%-10s cut %7d halo cells (%5.1f%% of %d), %4d of %d links between nodes, ranks per node %d-%d'
+          % (name, cells, 100.*cells/total, total, links, len(edges), sizes.min(), sizes.max()))
+    return cells
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Place the GETM ranks on nodes with few halo exchanges between nodes')
+    parser.add_argument('spec', help='subdomain_spec.lst (e.g. par_setup.dat)')
+    parser.add_argument('--nodes', type=int, default=None, help='number of nodes (default: the number of --hosts)')
+    parser.add_argument('--cores', type=int, required=True, help='cores per node')
+    parser.add_argument('--hosts', help='file with the host names, one per line (default n01, n02, ...)')
+    parser.add_argument('--machinefile', help='machine file to write')
+    parser.add_argument('--rankfile', help='OpenMPI rank file to write')
+    parser.add_argument('--compare', help='machine file to compare with (default: nodes filled in rank order, see fill_nodes)')
+    args = parser.parse_args()
+
+    hosts = None
+    if args.hosts:
+        hosts = read_machine_file(args.hosts)
+    nodes = args.nodes or (len(hosts) if hosts else None)
+    if nodes is None:
+        parser.error('give --nodes or --hosts')
+    hosts = (hosts or ['n%02d' % (n+1) for n in range(nodes)])[:nodes]
+    if len(hosts) < nodes:
+        parser.error('%d hosts for %d nodes' % (len(hosts), nodes))
+
+    spec = read_subdomain_spec(args.spec)
+    part, edges = place(spec, nodes, args.cores)
+    if args.compare:
+        names = read_machine_file(args.compare)
+        index = dict((name, n) for n, name in enumerate(sorted(set(names))))
+        naive = report('compare', edges, np.array([index[name] for name in names]))
+    else:
+        index = dict((name, n) for n, name in enumerate(hosts))
+        naive = report('in order', edges,
+                       np.array([index[name] for name in fill_nodes(spec.nranks, nodes, args.cores, hosts)]))
+    placed = report('placed', edges, part)
+    if naive:
+        print('halo cells between nodes %.1f%% less' % (100.*(naive - placed)/naive))
+    placement = [hosts[node] for node in part]
+    if args.machinefile:
+        write_machine_file(args.machinefile, placement)
+    if args.rankfile:
+        write_rankfile(args.rankfile, placement)
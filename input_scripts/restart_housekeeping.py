@@ -0,0 +1,157 @@
+#! /usr/bin/env python
+
+# restart file housekeeping around a GETM run (see dws_200m/run.getm_laplace_getmiow)
+#
+#   clean   : remove the files matching one or more patterns from a directory,
+#             using a pool of threads (replaces the rm/sleep loops)
+#   check   : check that a restart set is complete: restart.NNNN.<suffix> for
+#             every rank 0..nranks-1, none empty, all of the same size
+#   promote : check the restart.NNNN.out set of a run and move it to
+#             restart.NNNN.in in the next hotstart directory (replaces mv + rename)
+# promote only starts when the whole set passes the check, and every file is
+# moved with os.replace, so an existing restart.NNNN.in is replaced
+# atomically. If the directories are on different file systems, each file
+# is copied to a temporary name next to its target first.
+# The exit status is 0 on success, 1 otherwise.
+# Usage:
+#   python restart_housekeeping.py clean $out_dir 'restart.????.out' '*.nc'
+#   python restart_housekeeping.py check $out_dir --nranks 239 --suffix in
+#   python restart_housekeeping.py promote $out_dir $hot_dir --nranks 239
+
+import argparse
+import errno
+import fnmatch
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# number of threads for file system operations
+THREADS = 16
+
+# name of the restart file of a rank
+PATTERN = 'restart.%04d.%s'
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+        return 1
+    except FileNotFoundError:
+        return 0
+
+
+def clean(directory, patterns, threads=THREADS):
+    """
+    Remove the files in directory matching any of the shell patterns.
+    Returns the number of files removed.
+    """
+    if not os.path.isdir(directory):
+        return 0
+    paths = [entry.path for entry in os.scandir(directory)
+             if not entry.is_dir(follow_symlinks=False)
+             and any(fnmatch.fnmatch(entry.name, pattern) for pattern in patterns)]
+    with ThreadPoolExecutor(threads) as pool:
+        return sum(pool.map(_unlink, paths))
+
+
+def _size(path):
+    try:
+        return os.stat(path).st_size
+    except FileNotFoundError:
+        return None
+
+
+def check_set(directory, nranks, suffix='in', threads=THREADS, verbose=True):
+    """
+    Check that restart.NNNN.<suffix> exists in directory for every rank 0..nranks-1,
+    that no file is empty and that all have the same size.
+    Returns the list of problems, empty if the set is complete.
+    """
+    paths = [os.path.join(directory, PATTERN % (rank, suffix)) for rank in range(nranks)]
+    with ThreadPoolExecutor(threads) as pool:
+        sizes = list(pool.map(_size, paths))
+    problems = ['missing: %s' % path for path, size in zip(paths, sizes) if size is None]
+    problems += ['empty: %s' % path for path, size in zip(paths, sizes) if size == 0]
+    present = [size for size in sizes if size]
+    if present:
+        # the size of most files is taken as the right one
+        common = max(set(present), key=present.count)
+        problems += ['size %d instead of %d: %s' % (size, common, path)
+                     for path, size in zip(paths, sizes) if size and size != common]
+    extra = os.path.join(directory, PATTERN % (nranks, suffix))
+    if os.path.exists(extra):
+        problems.append('more ranks than %d: %s' % (nranks, extra))
+    if verbose:
+        for problem in problems:
+            print(problem)
+        print('%s: %d of %d restart.NNNN.%s files, %s'
+              % (directory, nranks - sum(size is None for size in sizes), nranks, suffix,
+                 'complete' if not problems else '%d problems' % len(problems)))
+    return problems
+
+
+def _move(source, target):
+    try:
+        os.replace(source, target)
+    except OSError as err:
+        if err.errno != errno.EXDEV:
+            raise
+        # other file system: copy next to the target, then replace it
+        tmp = target + '.tmp'
+        shutil.copyfile(source, tmp)
+        os.replace(tmp, target)
+        os.unlink(source)
+
+
+def promote(out_dir, hot_dir, nranks, threads=THREADS, verbose=True):
+    """
+    Move the complete set restart.NNNN.out of out_dir to restart.NNNN.in in hot_dir.
+    Nothing is moved if the set is incomplete. Returns the list of problems.
+    """
+    problems = check_set(out_dir, nranks, 'out', threads, verbose)
+    if problems:
+        print('restart files not moved')
+        return problems
+    if not os.path.isdir(hot_dir):
+        os.makedirs(hot_dir)
+    sources = [os.path.join(out_dir, PATTERN % (rank, 'out')) for rank in range(nranks)]
+    targets = [os.path.join(hot_dir, PATTERN % (rank, 'in')) for rank in range(nranks)]
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(_move, sources, targets))
+    if verbose:
+        print('%d restart files moved to %s' % (nranks, hot_dir))
+    return []
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='restart file housekeeping around a GETM run')
+    parser.add_argument('--threads', type=int, default=THREADS,
+                        help='number of threads (default %(default)s)')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    p = commands.add_parser('clean', help='remove files matching patterns')
+    p.add_argument('directory')
+    p.add_argument('patterns', nargs='+', help="shell patterns, e.g. 'restart.????.out' '*.nc'")
+    p = commands.add_parser('check', help='check that a restart set is complete')
+    p.add_argument('directory')
+    p.add_argument('--nranks', type=int, required=True, help='number of ranks (head -1 par_setup.dat)')
+    p.add_argument('--suffix', default='in', help='in or out (default %(default)s)')
+    p = commands.add_parser('promote', help='move restart.NNNN.out to the next restart.NNNN.in')
+    p.add_argument('out_dir')
+    p.add_argument('hot_dir')
+    p.add_argument('--nranks', type=int, required=True, help='number of ranks (head -1 par_setup.dat)')
+    args = parser.parse_args()
+
+    t0 = time.time()
+    if args.command == 'clean':
+        n = clean(args.directory, args.patterns, args.threads)
+        print('%d files removed from %s' % (n, args.directory))
+        ok = True
+    elif args.command == 'check':
+        ok = not check_set(args.directory, args.nranks, args.suffix, args.threads)
+    else:
+        ok = not promote(args.out_dir, args.hot_dir, args.nranks, args.threads)
+    print('%s done in %.2f s' % (args.command, time.time()-t0))
+    sys.exit(0 if ok else 1)
@@ -217,6 +217,8 @@ esac
 # --- Prepare a porosity map based on SIBES&SUBES dataset. An example of such a file is in "/export/lv1/user/jvandermolen/home/GETM_ERSEM_SETUPS/north_west_european_shelf_bfm_jan2025/nwes/Input/Ben_Sedprop.nc"
 # --- download SIBES mud_percentage dataset (https://doi.org/10.25850/nioz/7b.b.ug)
 # --- download tiff image from Franken (BelowMurkyWaters_Silt)
+# --- make sediment_mud_fraction.nc and Ben_Sedprop.nc on the GETM grid (stages cached, only changed ones rerun):
+#     python Input/sedprop_pipeline.py --topo <topo.nc> --silt <Franken silt .tif> --north-sea <nwes Ben_Sedprop.nc> --out-dir dws_200m/Input
 
 # Run the script by:
 # Make it executable: